@@ -64,12 +64,20 @@ from buildtool.subprocess_support import (
     check_subprocesses_to_logfile,
     determine_subprocess_outcome_labels)
 
+from buildtool.repository_executor import (
+    GCLOUD_RESOURCE,
+    GIT_NETWORK_RESOURCE,
+    GRADLE_RESOURCE,
+    RepositoryExecutor,
+    RepositoryOutcome)
+
 from buildtool.git_support import (
     GitRepositorySpec,
     GitRunner,
 
     CommitMessage,
     CommitTag,
+    RefTransaction,
     RepositorySummary,
     SemanticVersion)
 
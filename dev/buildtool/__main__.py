@@ -36,7 +36,8 @@ from buildtool.metrics import MetricsManager
 from buildtool import (
     add_parser_argument,
     maybe_log_exception,
-    GitRunner)
+    GitRunner,
+    RepositoryExecutor)
 
 
 STANDARD_LOG_LEVELS = {
@@ -278,6 +279,7 @@ def main():
     MetricsManager.singleton().observe_timer(
         'BuildTool_Outcome', labels,
         time.time() - start_time)
+    RepositoryExecutor.shutdown_singleton()
     MetricsManager.shutdown_metrics()
 
   return 0
@@ -0,0 +1,341 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Run-scoped inventories of the build artifacts that already exist.
+
+Commands that decide whether an artifact needs to be built used to ask
+gcloud about each individual artifact. Each gcloud invocation costs a couple
+of seconds just to start up, so asking about every repository (and every
+variant) adds up. An inventory lists everything once, in parallel, and
+answers the individual existence questions from memory.
+
+Inventories are shared within the process so that all the commands in a
+run see the same listing. Entries expire after a TTL so that long running
+flows eventually notice artifacts created by others.
+"""
+
+import json
+import logging
+import threading
+import time
+
+from multiprocessing.pool import ThreadPool
+
+from buildtool import (
+    GCLOUD_RESOURCE,
+    RepositoryExecutor,
+    add_parser_argument,
+    check_subprocess)
+
+
+class RegistryTagInventory(object):
+  """Knows the tags of every image in a docker registry.
+
+  The inventory is keyed by the image name relative to the registry
+  (e.g. "clouddriver" within "gcr.io/my-project").
+  """
+
+  __INSTANCES = {}
+  __INSTANCES_LOCK = threading.Lock()
+
+  @staticmethod
+  def add_parser_args(parser, defaults):
+    """Add parser arguments controlling the registry inventory."""
+    if hasattr(parser, 'added_registry_inventory'):
+      return
+    parser.added_registry_inventory = True
+
+    add_parser_argument(
+        parser, 'registry_inventory_ttl_secs', defaults, 600, type=int,
+        help='How long to trust the registry tag listing before'
+             ' listing the registry again.')
+
+  @staticmethod
+  def get_shared(registry, account=None, ttl_secs=600):
+    """Returns the inventory for the registry shared within this process."""
+    key = (registry, account)
+    with RegistryTagInventory.__INSTANCES_LOCK:
+      inventory = RegistryTagInventory.__INSTANCES.get(key)
+      if inventory is None:
+        inventory = RegistryTagInventory(registry, account=account,
+                                         ttl_secs=ttl_secs)
+        RegistryTagInventory.__INSTANCES[key] = inventory
+      return inventory
+
+  @staticmethod
+  def from_options(options):
+    """Returns the shared inventory for options.docker_registry."""
+    option_dict = vars(options)
+    return RegistryTagInventory.get_shared(
+        options.docker_registry,
+        account=option_dict.get('gcb_service_account'),
+        ttl_secs=option_dict.get('registry_inventory_ttl_secs') or 600)
+
+  @property
+  def registry(self):
+    return self.__registry
+
+  def __init__(self, registry, account=None, ttl_secs=600, max_threads=16):
+    """Constructor.
+
+    Args:
+      registry: [string] The docker registry, e.g. "gcr.io/my-project".
+      account: [string] The gcloud account to query with, if not the default.
+      ttl_secs: [int] How long a listing remains valid.
+      max_threads: [int] The number of images to list tags for at once.
+    """
+    self.__registry = registry
+    self.__account = account
+    self.__ttl_secs = ttl_secs
+    self.__max_threads = max_threads
+    self.__lock = threading.Lock()
+    self.__load_lock = threading.Lock()
+    self.__image_tags = {}       # image name to set of tags
+    self.__stale_images = set()  # images to query again individually
+    self.__loaded_at = None      # when the registry was last listed
+
+  def __run_gcloud(self, command_parts):
+    command_parts = ['gcloud', '--format=json'] + command_parts
+    if self.__account:
+      command_parts.extend(['--account', self.__account])
+    with RepositoryExecutor.resource_slot(GCLOUD_RESOURCE):
+      response = check_subprocess(' '.join(command_parts))
+    return json.JSONDecoder().decode(response or '[]')
+
+  def __image_path(self, image_name):
+    return self.__registry + '/' + image_name
+
+  def __image_name(self, image_path):
+    prefix = self.__registry + '/'
+    if image_path.startswith(prefix):
+      return image_path[len(prefix):]
+    return image_path[image_path.rfind('/') + 1:]
+
+  def list_image_names(self):
+    """Returns the names of the images in the registry from gcloud."""
+    entries = self.__run_gcloud(
+        ['container images list', '--repository', self.__registry,
+         '--limit 10000'])
+    return [self.__image_name(entry['name']) for entry in entries]
+
+  def query_image_tags(self, image_name):
+    """Returns the set of tags for an image from gcloud."""
+    entries = self.__run_gcloud(
+        ['container images list-tags', self.__image_path(image_name),
+         '--limit 10000'])
+    tags = set([])
+    for entry in entries:
+      tags.update(entry.get('tags') or [])
+    return tags
+
+  def __is_stale(self):
+    return (self.__loaded_at is None
+            or time.time() - self.__loaded_at > self.__ttl_secs)
+
+  def load(self):
+    """List the tags of every image in the registry."""
+    logging.debug('Listing the images and tags in %s', self.__registry)
+    start_time = time.time()
+    image_names = self.list_image_names()
+    pool = ThreadPool(max(1, min(self.__max_threads, len(image_names))))
+    try:
+      tag_sets = pool.map(self.query_image_tags, image_names)
+    finally:
+      pool.close()
+      pool.join()
+
+    with self.__lock:
+      self.__image_tags = dict(zip(image_names, tag_sets))
+      self.__stale_images = set()
+      self.__loaded_at = time.time()
+    logging.info('Listed %d images in %s in %.1f secs',
+                 len(image_names), self.__registry, time.time() - start_time)
+
+  def __ensure_loaded(self):
+    # Concurrent callers wait on a single listing rather than each
+    # listing the registry themselves.
+    with self.__load_lock:
+      if self.__is_stale():
+        self.load()
+
+  def image_tags(self, image_name):
+    """Returns the set of tags for the named image.
+
+    The set is empty if the image does not exist in the registry.
+    """
+    self.__ensure_loaded()
+    with self.__lock:
+      stale = image_name in self.__stale_images
+      if not stale:
+        return set(self.__image_tags.get(image_name, []))
+
+    tags = self.query_image_tags(image_name)
+    with self.__lock:
+      self.__image_tags[image_name] = tags
+      self.__stale_images.discard(image_name)
+    return set(tags)
+
+  def tag_map(self):
+    """Returns a dictionary of the sorted tags for each image."""
+    self.__ensure_loaded()
+    with self.__lock:
+      stale_images = list(self.__stale_images)
+    for image_name in stale_images:
+      self.image_tags(image_name)
+    with self.__lock:
+      return {name: sorted(tags) for name, tags in self.__image_tags.items()}
+
+  def has_tag(self, image_name, tag):
+    """Determine if the named image has the given tag in the registry."""
+    return tag in self.image_tags(image_name)
+
+  def invalidate(self, image_name=None):
+    """Forget what we know about an image, or the whole registry.
+
+    Call this after pushing an image so the next question about it
+    reflects the registry rather than the cached listing. Only that image
+    is listed again.
+    """
+    with self.__lock:
+      if image_name is None:
+        self.__loaded_at = None
+        self.__image_tags = {}
+        self.__stale_images = set()
+      else:
+        self.__stale_images.add(image_name)
+
+
+class GceImageInventory(object):
+  """Knows the names of the spinnaker images in a GCE project.
+
+  The image names follow the "spinnaker-<repo>-<version>" convention
+  where the version has its '.' and ':' replaced by '-'.
+  """
+
+  IMAGE_NAME_PREFIX = 'spinnaker-'
+
+  __INSTANCES = {}
+  __INSTANCES_LOCK = threading.Lock()
+
+  @staticmethod
+  def add_parser_args(parser, defaults):
+    """Add parser arguments controlling the image inventory."""
+    if hasattr(parser, 'added_gce_image_inventory'):
+      return
+    parser.added_gce_image_inventory = True
+
+    add_parser_argument(
+        parser, 'gce_image_inventory_ttl_secs', defaults, 600, type=int,
+        help='How long to trust the GCE image listing before'
+             ' listing the project again.')
+
+  @staticmethod
+  def get_shared(project, account=None, ttl_secs=600):
+    """Returns the inventory for the project shared within this process."""
+    key = (project, account)
+    with GceImageInventory.__INSTANCES_LOCK:
+      inventory = GceImageInventory.__INSTANCES.get(key)
+      if inventory is None:
+        inventory = GceImageInventory(project, account=account,
+                                      ttl_secs=ttl_secs)
+        GceImageInventory.__INSTANCES[key] = inventory
+      return inventory
+
+  @staticmethod
+  def make_image_name(repository_name, build_version):
+    """Returns the name of the image for a repository's build version."""
+    return '{prefix}{repo}-{version}'.format(
+        prefix=GceImageInventory.IMAGE_NAME_PREFIX,
+        repo=repository_name,
+        version=build_version.replace('.', '-').replace(':', '-'))
+
+  @property
+  def project(self):
+    return self.__project
+
+  def __init__(self, project, account=None, ttl_secs=600, page_size=500):
+    """Constructor.
+
+    Args:
+      project: [string] The GCE project containing the images.
+      account: [string] The gcloud account to query with, if not the default.
+      ttl_secs: [int] How long a listing remains valid.
+      page_size: [int] The number of images gcloud requests per page.
+    """
+    self.__project = project
+    self.__account = account
+    self.__ttl_secs = ttl_secs
+    self.__page_size = page_size
+    self.__lock = threading.Lock()
+    self.__load_lock = threading.Lock()
+    self.__image_names = set([])
+    self.__loaded_at = None
+
+  def query_image_names(self):
+    """Returns the list of spinnaker image names in the project from gcloud.
+
+    Only the names are requested, and the public standard images are
+    excluded, to keep the listing small.
+    """
+    command_parts = ['gcloud', 'compute images list',
+                     '--project', self.__project,
+                     '--no-standard-images',
+                     '--filter="name~^%s"' % self.IMAGE_NAME_PREFIX,
+                     '--page-size', str(self.__page_size),
+                     '--format="value(name)"', '--quiet']
+    if self.__account:
+      command_parts.extend(['--account', self.__account])
+    with RepositoryExecutor.resource_slot(GCLOUD_RESOURCE):
+      response = check_subprocess(' '.join(command_parts))
+    return [line.strip() for line in response.split('\n') if line.strip()]
+
+  def load(self):
+    """List the spinnaker images in the project."""
+    logging.debug('Listing the spinnaker images in %s', self.__project)
+    start_time = time.time()
+    names = self.query_image_names()
+    with self.__lock:
+      self.__image_names = set(names)
+      self.__loaded_at = time.time()
+    logging.info('Listed %d images in %s in %.1f secs',
+                 len(names), self.__project, time.time() - start_time)
+
+  def __ensure_loaded(self):
+    # Concurrent callers wait on a single listing rather than each
+    # listing the project themselves.
+    with self.__load_lock:
+      if (self.__loaded_at is None
+          or time.time() - self.__loaded_at > self.__ttl_secs):
+        self.load()
+
+  def has_image(self, image_name):
+    """Determine if the named image exists in the project."""
+    self.__ensure_loaded()
+    with self.__lock:
+      return image_name in self.__image_names
+
+  def image_names(self):
+    """Returns the sorted names of the spinnaker images in the project."""
+    self.__ensure_loaded()
+    with self.__lock:
+      return sorted(self.__image_names)
+
+  def invalidate(self, image_name=None):
+    """Forget an image that was deleted, or the whole listing."""
+    with self.__lock:
+      if image_name is None:
+        self.__loaded_at = None
+        self.__image_names = set([])
+      else:
+        self.__image_names.discard(image_name)
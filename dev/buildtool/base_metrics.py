@@ -14,8 +14,10 @@
 
 """Base metrics support is extended for a concrete monitoring system."""
 
+import collections
 import datetime
 import logging
+import math
 import re
 import sys
 import threading
@@ -57,6 +59,13 @@ class Metric(object):
     self.__family = family
     self.__labels = labels
 
+  def reset_after_fork(self):
+    """Replace the mutex inherited by a forked child process.
+
+    Another thread in the parent may have been holding it.
+    """
+    self.__mutex = threading.Lock()
+
   def touch(self, utc=None):
     """Update last modified time"""
     self.__last_modified = utc or datetime.datetime.utcnow()
@@ -118,9 +127,88 @@ class Gauge(Metric):
       self.touch(utc=utc)
 
 
+class LatencyHistogram(object):
+  """A mergeable histogram of latencies for estimating percentiles.
+
+  Observations are counted in logarithmic buckets whose bounds grow by a
+  constant ratio, so any percentile is estimated to within RELATIVE_ACCURACY
+  of the actual observation regardless of its magnitude (the approach taken
+  by DDSketch). Only the non-empty buckets are kept, and histograms from
+  different threads or processes are merged by adding their bucket counts.
+  """
+
+  RELATIVE_ACCURACY = 0.02
+
+  # Observations at or below this many seconds are counted as zero.
+  MIN_SECONDS = 1e-6
+
+  __GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+  __LOG_GAMMA = math.log(__GAMMA)
+
+  # Bucket key for observations at or below MIN_SECONDS.
+  ZERO_BUCKET = None
+
+  @property
+  def count(self):
+    """The number of observations."""
+    return sum(self.__buckets.values())
+
+  @property
+  def buckets(self):
+    """A copy of the non-empty buckets as a dictionary of key to count."""
+    return dict(self.__buckets)
+
+  def __init__(self, buckets=None):
+    self.__buckets = dict(buckets or {})
+
+  def add(self, seconds, count=1):
+    """Add observations of the given number of seconds."""
+    if seconds <= self.MIN_SECONDS:
+      key = self.ZERO_BUCKET
+    else:
+      key = int(math.ceil(math.log(seconds) / self.__LOG_GAMMA))
+    self.__buckets[key] = self.__buckets.get(key, 0) + count
+
+  def merge(self, buckets):
+    """Add the counts of the buckets from another histogram."""
+    for key, count in buckets.items():
+      total = self.__buckets.get(key, 0) + count
+      if total:
+        self.__buckets[key] = total
+      else:
+        self.__buckets.pop(key, None)
+
+  def minus(self, other):
+    """Returns a new histogram of the observations here but not in other."""
+    result = LatencyHistogram(self.__buckets)
+    result.merge({key: -count for key, count in other.buckets.items()})
+    return result
+
+  def percentile(self, percent):
+    """Estimate the given percentile (0..100) in seconds, or None if empty."""
+    total = self.count
+    if not total:
+      return None
+    # The (zero-based) nearest rank.
+    rank = max(0, int(math.ceil(percent / 100.0 * total)) - 1)
+    zero_count = self.__buckets.get(self.ZERO_BUCKET, 0)
+    if rank < zero_count:
+      return 0.0
+    seen = zero_count
+    for key in sorted(key for key in self.__buckets
+                      if key is not self.ZERO_BUCKET):
+      seen += self.__buckets[key]
+      if rank < seen:
+        return 2 * self.__GAMMA ** key / (self.__GAMMA + 1)
+    return 2 * self.__GAMMA ** key / (self.__GAMMA + 1)
+
+
 class Timer(Metric):
   """Observes how long functions take to execute."""
 
+  # The percentiles reported for each timer.
+  PERCENTILES = (50, 90, 99)
+
   @property
   def count(self):
     """The number of timings captured."""
@@ -131,18 +219,50 @@ class Timer(Metric):
     """The total time across all the captured timings."""
     return self.__total
 
+  @property
+  def histogram(self):
+    """A copy of the LatencyHistogram of the captured timings."""
+    with self.mutex:
+      return LatencyHistogram(self.__histogram.buckets)
+
   def __init__(self, family, labels):
     super(Timer, self).__init__(family, labels)
     self.__count = 0
     self.__total = 0
+    self.__histogram = LatencyHistogram()
 
   def observe(self, seconds, utc=None):
     """Capture a timing observation."""
     with self.mutex:
       self.__count += 1
       self.__total += seconds
+      self.__histogram.add(seconds)
+      self.touch(utc=utc)
+
+  def observe_many(self, count, total_seconds, buckets=None, utc=None):
+    """Capture a batch of observations, such as from another process.
+
+    Args:
+      count: [int] The number of observations.
+      total_seconds: [float] The total time across the observations.
+      buckets: [dict] The LatencyHistogram buckets of the observations.
+         If not provided then they are all assumed to be the average.
+    """
+    with self.mutex:
+      self.__count += count
+      self.__total += total_seconds
+      if buckets is not None:
+        self.__histogram.merge(buckets)
+      elif count:
+        self.__histogram.add(float(total_seconds) / count, count=count)
       self.touch(utc=utc)
 
+  def percentiles(self):
+    """Returns a dictionary of the PERCENTILES, such as {'p50': secs}."""
+    histogram = self.histogram
+    return {'p{0}'.format(percent): histogram.percentile(percent)
+            for percent in self.PERCENTILES}
+
 
 class MetricFamily(object):
   """A Factory for a counter or Gauge metric with specifically bound labels."""
@@ -189,6 +309,12 @@ class MetricFamily(object):
     self.__registry = registry
     self.__family_type = family_type
 
+  def reset_after_fork(self):
+    """Replace the mutexes inherited by a forked child process."""
+    self.__mutex = threading.Lock()
+    for metric in self.__instances.values():
+      metric.reset_after_fork()
+
   def get(self, labels):
     """Returns a metric instance with bound labels."""
     key = ''.join('{0}={1}'.format(key, value) for key, value in labels.items())
@@ -210,9 +336,21 @@ class BaseMetricsRegistry(object):
   like practical reasons where there is no easy to use system for our use
   case of short lived batch jobs so there's going to be a lot of maintainence
   here and trials of different systems making this investment more appealing.
+
+  With the monitoring_thread_local_metrics option, counter increments and
+  timer observations are not applied as they happen. Instead each thread
+  appends them to its own queue (without taking any shared locks) and they
+  are merged into the metrics at flush time by
+  merge_thread_local_metrics. This avoids serializing many busy threads on
+  the metric locks, at the cost of counter and timer values lagging until
+  the next merge. A thread whose queue reaches THREAD_LOCAL_MERGE_THRESHOLD
+  merges it itself, so the queues stay bounded even if nothing is flushing.
   """
   # pylint: disable=too-many-public-methods
 
+  # The most updates a thread queues before merging them itself.
+  THREAD_LOCAL_MERGE_THRESHOLD = 1024
+
   @staticmethod
   def default_determine_outcome_labels(result, base_labels):
     """Return the outcome labels for a set of tracking labels."""
@@ -282,6 +420,12 @@ class BaseMetricsRegistry(object):
     self.__updated_metrics = set([])
     self.__update_mutex = threading.Lock()
     self.__inject_labels = self.__make_context_labels(options)
+    self.__thread_local = (
+        threading.local()
+        if vars(options).get('monitoring_thread_local_metrics')
+        else None)
+    self.__thread_updates = []  # (thread, deque of (metric, value))
+    self.__thread_updates_mutex = threading.Lock()
     if self.__inject_labels:
       logging.debug('Injecting additional metric labels %s',
                     self.__inject_labels)
@@ -299,13 +443,95 @@ class BaseMetricsRegistry(object):
     """
     raise NotImplementedError()
 
+  def reset_after_fork(self):
+    """Prepare the registry for use in a forked child process.
+
+    The child inherits the registry's locks in whatever state they were
+    in, but not the threads that may have been holding them (e.g. the
+    pusher thread, exporters, or a PrometheusServer rendering a page).
+    This replaces them all. The child does not push metrics itself.
+    """
+    self.__pusher_thread = None
+    self.__family_mutex = threading.Lock()
+    self.__update_mutex = threading.Lock()
+    self.__thread_updates_mutex = threading.Lock()
+    for family in list(self.__metric_families.values()):
+      family.reset_after_fork()
+
   def queue_update(self, metric):
     """Add metric to list of metrics to push out."""
     with self.__update_mutex:
       self.__updated_metrics.add(metric)
 
+  def __queue_thread_local_update(self, family_type, name, labels, value):
+    """Queue an update to be applied by merge_thread_local_metrics.
+
+    Returns:
+      The metric being updated.
+    """
+    local = self.__thread_local
+    updates = getattr(local, 'updates', None)
+    if updates is None:
+      updates = collections.deque()
+      local.updates = updates
+      local.metrics = {}
+      with self.__thread_updates_mutex:
+        self.__thread_updates.append((threading.current_thread(), updates))
+
+    key = (family_type, name, tuple(sorted(labels.items())))
+    metric = local.metrics.get(key)
+    if metric is None:
+      metric = self.get_metric(family_type, name, labels)
+      local.metrics[key] = metric
+
+    # deque.append and popleft are atomic so this does not need a lock.
+    updates.append((metric, value))
+    if len(updates) >= self.THREAD_LOCAL_MERGE_THRESHOLD:
+      self.__merge_queued_updates([updates])
+    return metric
+
+  def merge_thread_local_metrics(self):
+    """Apply the updates queued by each thread in thread-local mode."""
+    if self.__thread_local is None:
+      return
+
+    with self.__thread_updates_mutex:
+      thread_updates = self.__thread_updates
+      self.__thread_updates = [
+          (thread, updates) for thread, updates in thread_updates
+          if thread.is_alive() or updates]
+    self.__merge_queued_updates(
+        [updates for _, updates in thread_updates])
+
+  @staticmethod
+  def __merge_queued_updates(update_queues):
+    """Apply and remove the updates in the given thread-local queues."""
+    counter_totals = {}
+    timer_histograms = {}
+    for updates in update_queues:
+      while True:
+        try:
+          metric, value = updates.popleft()
+        except IndexError:
+          break
+        if metric.family.family_type == MetricFamily.COUNTER:
+          counter_totals[metric] = counter_totals.get(metric, 0) + value
+        else:
+          histogram, total = timer_histograms.get(
+              metric, (LatencyHistogram(), 0))
+          histogram.add(value)
+          timer_histograms[metric] = (histogram, total + value)
+
+    for counter, amount in counter_totals.items():
+      counter.inc(amount=amount)
+    for timer, (histogram, total) in timer_histograms.items():
+      timer.observe_many(histogram.count, total, buckets=histogram.buckets)
+
   def inc_counter(self, name, labels, **kwargs):
     """Track number of completed calls to the given function."""
+    if self.__thread_local is not None:
+      return self.__queue_thread_local_update(
+          MetricFamily.COUNTER, name, labels, kwargs.get('amount', 1))
     counter = self.get_metric(MetricFamily.COUNTER, name, labels)
     counter.inc(**kwargs)
     return counter
@@ -335,6 +561,9 @@ class BaseMetricsRegistry(object):
 
   def observe_timer(self, name, labels, seconds):
     """Add an observation to the specified timer."""
+    if self.__thread_local is not None:
+      return self.__queue_thread_local_update(
+          MetricFamily.TIMER, name, labels, seconds)
     timer = self.get_metric(MetricFamily.TIMER, name, labels)
     timer.observe(seconds)
     return timer
@@ -355,8 +584,7 @@ class BaseMetricsRegistry(object):
         raise ex
       raise
     finally:
-      timer = self.get_metric(MetricFamily.TIMER, name, outcome_labels)
-      timer.observe(time.time() - start_time)
+      self.observe_timer(name, outcome_labels, time.time() - start_time)
 
   def lookup_family_or_none(self, name):
     return self.__metric_families.get(name)
@@ -461,6 +689,7 @@ class BaseMetricsRegistry(object):
 
   def flush_updated_metrics(self):
     """Push incremental metrics to the metrics server."""
+    self.merge_thread_local_metrics()
     if not self.options.monitoring_enabled:
       logging.warning('Monitoring disabled -- dont push incremental metrics.')
       return
@@ -0,0 +1,331 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A shared client for talking to the Bintray REST API.
+
+Bintray requests used to each open a new connection (and TLS handshake)
+through urlopen. The BintrayClient keeps a bounded pool of keep-alive
+connections per host that is shared by all the threads in the process,
+retries requests that are throttled or fail on the server side, and
+offers a batch API for asking about many package versions at once.
+"""
+
+import base64
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+from multiprocessing.pool import ThreadPool
+
+try:
+  import httplib
+  from urlparse import urlparse
+except ImportError:
+  import http.client as httplib
+  from urllib.parse import urlparse
+
+from buildtool import (
+    add_parser_argument,
+    raise_and_log_error,
+    ResponseError)
+
+
+BINTRAY_API_URL = 'https://api.bintray.com/'
+
+# Responses that are worth trying again after backing off.
+RETRYABLE_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
+
+class BintrayResponse(object):
+  """A completed response from Bintray."""
+  # pylint: disable=too-few-public-methods
+
+  @property
+  def ok(self):
+    return 200 <= self.status < 300
+
+  def __init__(self, url, status, headers, payload):
+    """Constructor.
+
+    Args:
+      url: [string] The url that was requested.
+      status: [int] The HTTP status code.
+      headers: [dict] The response headers keyed by lower-case name.
+      payload: [bytes] The response body.
+    """
+    self.url = url
+    self.status = status
+    self.headers = headers
+    self.payload = payload
+
+  def json(self):
+    return json.JSONDecoder().decode(self.payload.decode('utf-8'))
+
+
+class _ConnectionPool(object):
+  """A bounded set of keep-alive connections to a single host."""
+
+  def __init__(self, scheme, netloc, max_connections, timeout_secs):
+    self.__connection_class = (httplib.HTTPSConnection if scheme == 'https'
+                               else httplib.HTTPConnection)
+    self.__netloc = netloc
+    self.__timeout_secs = timeout_secs
+    self.__semaphore = threading.BoundedSemaphore(max_connections)
+    self.__lock = threading.Lock()
+    self.__idle = []
+
+  def acquire(self):
+    """Returns an idle connection, or a new one if there are none."""
+    self.__semaphore.acquire()
+    with self.__lock:
+      if self.__idle:
+        return self.__idle.pop()
+    return self.__connection_class(self.__netloc, timeout=self.__timeout_secs)
+
+  def release(self, connection, reusable):
+    """Return a connection to the pool, closing it if cannot be reused."""
+    if reusable:
+      with self.__lock:
+        self.__idle.append(connection)
+    else:
+      connection.close()
+    self.__semaphore.release()
+
+  def close(self):
+    """Close the idle connections."""
+    with self.__lock:
+      idle = self.__idle
+      self.__idle = []
+    for connection in idle:
+      connection.close()
+
+
+class BintrayClient(object):
+  """Issues Bintray API requests over pooled keep-alive connections."""
+
+  __SHARED = None
+  __SHARED_LOCK = threading.Lock()
+
+  @staticmethod
+  def add_parser_args(parser, defaults):
+    """Add parser arguments controlling the bintray client."""
+    if hasattr(parser, 'added_bintray_client'):
+      return
+    parser.added_bintray_client = True
+
+    add_parser_argument(
+        parser, 'bintray_max_connections', defaults, 8, type=int,
+        help='Maximum number of concurrent connections to bintray.')
+    add_parser_argument(
+        parser, 'bintray_max_retries', defaults, 4, type=int,
+        help='Number of times to retry a bintray request that was throttled'
+             ' or failed on the server.')
+
+  @staticmethod
+  def get_shared(options=None):
+    """Returns the client shared within this process.
+
+    The credentials come from the BINTRAY_USER and BINTRAY_KEY environment
+    variables, if set.
+    """
+    with BintrayClient.__SHARED_LOCK:
+      if BintrayClient.__SHARED is None:
+        option_dict = vars(options) if options is not None else {}
+        BintrayClient.__SHARED = BintrayClient(
+            user=os.environ.get('BINTRAY_USER'),
+            password=os.environ.get('BINTRAY_KEY'),
+            max_connections=option_dict.get('bintray_max_connections') or 8,
+            max_retries=option_dict.get('bintray_max_retries') or 4)
+      return BintrayClient.__SHARED
+
+  @property
+  def max_connections(self):
+    return self.__max_connections
+
+  def __init__(self, user=None, password=None, max_connections=8,
+               max_retries=4, timeout_secs=60, initial_backoff_secs=0.5,
+               api_url=BINTRAY_API_URL):
+    # pylint: disable=too-many-arguments
+    self.__api_url = api_url
+    self.__max_connections = max(1, max_connections)
+    self.__max_retries = max_retries
+    self.__timeout_secs = timeout_secs
+    self.__initial_backoff_secs = initial_backoff_secs
+    self.__pools = {}
+    self.__pools_lock = threading.Lock()
+    self.__headers = {'Connection': 'keep-alive'}
+    if user and password:
+      encoded_auth = base64.b64encode(
+          '{user}:{password}'.format(user=user, password=password)
+          .encode('utf-8'))
+      self.__headers['Authorization'] = 'Basic ' + encoded_auth.decode()
+
+  def close(self):
+    """Close the pooled connections that are not in use."""
+    with self.__pools_lock:
+      pools = list(self.__pools.values())
+    for pool in pools:
+      pool.close()
+
+  def __get_pool(self, scheme, netloc):
+    key = (scheme, netloc)
+    with self.__pools_lock:
+      pool = self.__pools.get(key)
+      if pool is None:
+        pool = _ConnectionPool(scheme, netloc, self.__max_connections,
+                               self.__timeout_secs)
+        self.__pools[key] = pool
+      return pool
+
+  def __send_once(self, method, url):
+    """Send a single request, returning a BintrayResponse."""
+    parsed = urlparse(url)
+    path = parsed.path + ('?' + parsed.query if parsed.query else '')
+    pool = self.__get_pool(parsed.scheme, parsed.netloc)
+    connection = pool.acquire()
+    reusable = False
+    try:
+      connection.request(method, path, headers=self.__headers)
+      response = connection.getresponse()
+      payload = response.read()
+      reusable = (response.getheader('Connection', '').lower() != 'close'
+                  and not response.will_close)
+      headers = dict([(key.lower(), value)
+                      for key, value in response.getheaders()])
+      return BintrayResponse(url, response.status, headers, payload)
+    finally:
+      pool.release(connection, reusable)
+
+  def __backoff_secs(self, attempt, response):
+    retry_after = response.headers.get('retry-after') if response else None
+    if retry_after and retry_after.isdigit():
+      return min(int(retry_after), 60)
+    return min(self.__initial_backoff_secs * (2 ** attempt), 30)
+
+  def request(self, method, url):
+    """Send a request, retrying throttled and server side failures.
+
+    Args:
+      method: [string] The HTTP method.
+      url: [string] An absolute url, or a path relative to the Bintray API.
+
+    Returns:
+      The final BintrayResponse, which may still be an error response.
+    """
+    if not url.startswith('http'):
+      url = self.__api_url + url
+    attempt = 0
+    while True:
+      response = None
+      try:
+        response = self.__send_once(method, url)
+        if response.status not in RETRYABLE_STATUS_CODES:
+          return response
+        reason = 'HTTP %d' % response.status
+      except (httplib.HTTPException, socket.error) as ex:
+        # This is also how a keep-alive connection that the server
+        # closed while it was idle surfaces, so the retry is immediate.
+        if attempt >= self.__max_retries:
+          raise
+        reason = repr(ex)
+
+      if attempt >= self.__max_retries:
+        return response
+      delay = 0 if response is None and attempt == 0 else (
+          self.__backoff_secs(attempt, response))
+      logging.debug('Retrying %s %s in %s secs after %s',
+                    method, url, delay, reason)
+      time.sleep(delay)
+      attempt += 1
+
+  def check_request(self, method, url, server='bintray.api', allow_404=False):
+    """Send a request and raise a ResponseError if it did not succeed.
+
+    Returns:
+      The BintrayResponse, or None if allow_404 and it was not found.
+    """
+    response = self.request(method, url)
+    if response.ok:
+      return response
+    if allow_404 and response.status == 404:
+      return None
+    raise_and_log_error(
+        ResponseError('Bintray failure: HTTP {0}'.format(response.status),
+                      server=server),
+        'Failed on url=%s: HTTP %d %s' % (response.url, response.status,
+                                           response.payload[:256]))
+
+  @staticmethod
+  def version_path(subject, repo, package, version):
+    """Returns the API path for the given package version."""
+    return 'packages/{subject}/{repo}/{package}/versions/{version}'.format(
+        subject=subject, repo=repo, package=package, version=version)
+
+  def has_version(self, subject, repo, package, version):
+    """Determine if the package version exists in the repository."""
+    return self.check_request(
+        'GET', self.version_path(subject, repo, package, version),
+        server='bintray.check', allow_404=True) is not None
+
+  def delete_version(self, subject, repo, package, version):
+    """Delete the package version if it exists."""
+    self.check_request(
+        'DELETE', self.version_path(subject, repo, package, version),
+        server='bintray.delete', allow_404=True)
+    return True
+
+  def query_existing_versions(self, package_versions):
+    """Determine which of many package versions exist.
+
+    Args:
+      package_versions: [list of (subject, repo, package, version)]
+
+    Returns:
+      A dictionary keyed by each of the package_versions tuples
+      whose value is whether or not that version exists.
+    """
+    package_versions = list(set(package_versions))
+    if not package_versions:
+      return {}
+    pool = ThreadPool(min(self.__max_connections, len(package_versions)))
+    try:
+      found = pool.map(lambda key: self.has_version(*key), package_versions)
+    finally:
+      pool.close()
+      pool.join()
+    return dict(zip(package_versions, found))
+
+  def list_packages(self, subject_repo):
+    """Returns the '<subject>/<repo>/<package>' of each package in a repo."""
+    base_path = 'repos/%s/packages' % subject_repo
+    result = []
+    while True:
+      response = self.check_request(
+          'GET', base_path + '?start_pos=%d' % len(result))
+      content = response.json()
+      total = int(response.headers.get('x-rangelimit-total', 0))
+      result.extend(['%s/%s' % (subject_repo, entry['name'])
+                     for entry in content])
+      if not content or len(result) >= total:
+        break
+    return result
+
+  def query_package_versions(self, package_path):
+    """Returns the (package name, versions) of a '<subject>/<repo>/<package>'."""
+    content = self.check_request('GET', 'packages/' + package_path).json()
+    package_name = package_path[package_path.rfind('/') + 1:]
+    return (package_name, content['versions'])
@@ -228,6 +228,8 @@ class BomBuilder(object):
 class BuildBomCommand(RepositoryCommandProcessor):
   """Implements build_bom."""
 
+  SUPPORTS_PROCESS_EXECUTOR = True
+
   def __init__(self, factory, options, *pos_args, **kwargs):
     super(BuildBomCommand, self).__init__(factory, options, *pos_args, **kwargs)
 
@@ -257,12 +259,16 @@ class BuildBomCommand(RepositoryCommandProcessor):
     self.__builder = BomBuilder(self.options, self.scm, self.metrics, base_bom=base_bom)
 
   def _do_repository(self, repository):
-    source_info = self.scm.refresh_source_info(
+    """Returns the SourceInfo for the repository."""
+    return self.scm.refresh_source_info(
         repository, self.options.build_number)
-    self.__builder.add_repository(repository, source_info)
 
-  def _do_postprocess(self, _):
+  def _do_postprocess(self, result_dict):
     """Construct BOM and write it to the configured path."""
+    repository_map = {repository.name: repository
+                      for repository in self.source_repositories}
+    for name, source_info in sorted(result_dict.items()):
+      self.__builder.add_repository(repository_map[name], source_info)
     bom = self.__builder.build()
     if bom == self.__builder.base_bom:
       logging.info('Bom has not changed from version %s @ %s',
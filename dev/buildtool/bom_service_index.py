@@ -0,0 +1,146 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A persistent record of the boms that have already been analyzed.
+
+Each entry is keyed by the bom url and the generation of the object it was
+read from. It holds just the parts of the bom that the inverse service map
+needs (or why the bom could not be analyzed), so that later runs only
+need to read the boms that were added or rewritten since.
+
+The index is an append-only file of JSON lines. The first line is a
+header; each later line supersedes any earlier entry for the same url.
+The file is rewritten once superseded entries make up most of it.
+"""
+
+import json
+import logging
+import os
+import threading
+
+
+class BomServiceIndex(object):
+  """Remembers the analysis of each bom version between runs."""
+
+  FORMAT_VERSION = 1
+
+  @property
+  def path(self):
+    return self.__path
+
+  def __init__(self, path):
+    """Constructor.
+
+    Args:
+      path: [path] The file holding the index.
+    """
+    self.__path = path
+    self.__lock = threading.Lock()
+    self.__entries = {}      # url to entry dictionary
+    self.__pending = []      # urls with entries not yet written to the file
+    self.__line_count = 0    # entries in the file, including superseded ones
+    self.__load()
+
+  def __load(self):
+    if not os.path.exists(self.__path):
+      return
+    try:
+      with open(self.__path, 'r') as stream:
+        header = json.loads(stream.readline() or '{}')
+        if header.get('version') != self.FORMAT_VERSION:
+          logging.debug('Ignoring stale bom index %s', self.__path)
+          return
+        for line in stream:
+          if not line.strip():
+            continue
+          entry = json.loads(line)
+          self.__entries[entry['url']] = entry
+          self.__line_count += 1
+    except (IOError, ValueError, KeyError) as ex:
+      # A partially written last line only loses that entry.
+      logging.warning('Stopped reading bom index %s: %s', self.__path, ex)
+    logging.debug('Loaded %d bom entries from %s',
+                  len(self.__entries), self.__path)
+
+  def lookup(self, url, generation):
+    """Returns the entry for the given bom generation, or None if unknown.
+
+    The entry has either a 'bom' with the parts of the bom that were
+    retained, or an 'error' describing why the bom was rejected.
+    """
+    with self.__lock:
+      entry = self.__entries.get(url)
+    if entry is None or entry.get('generation') != generation:
+      return None
+    return entry
+
+  def record(self, url, generation, bom=None, error=None):
+    """Remember the analysis of a bom generation."""
+    entry = {'url': url, 'generation': generation}
+    if error is not None:
+      entry['error'] = error
+    else:
+      entry['bom'] = bom
+    with self.__lock:
+      self.__entries[url] = entry
+      if generation:
+        self.__pending.append(url)
+
+  def forget_missing(self, url_prefix, urls):
+    """Forget the boms under url_prefix that are not among the given urls.
+
+    This is for boms that have since been deleted from the bucket.
+    """
+    urls = set(urls)
+    with self.__lock:
+      for url in list(self.__entries.keys()):
+        if url.startswith(url_prefix) and url not in urls:
+          del self.__entries[url]
+
+  def save(self):
+    """Write the new entries to the index file."""
+    with self.__lock:
+      persistent = [entry for entry in self.__entries.values()
+                    if entry.get('generation')]
+      pending = [self.__entries[url] for url in sorted(set(self.__pending))
+                 if url in self.__entries]
+      self.__pending = []
+
+      if (not os.path.exists(self.__path)
+          or self.__line_count + len(pending) > 2 * len(persistent)):
+        self.__rewrite(persistent)
+      elif pending:
+        self.__append(pending)
+
+  @staticmethod
+  def __encode(entry):
+    # Unquoted yaml timestamps load as datetime, so fall back to str.
+    return json.dumps(entry, separators=(',', ':'), default=str) + '\n'
+
+  def __rewrite(self, entries):
+    logging.debug('Writing %d bom entries to %s', len(entries), self.__path)
+    tmp_path = self.__path + '.tmp'
+    with open(tmp_path, 'w') as stream:
+      stream.write(json.dumps({'version': self.FORMAT_VERSION}) + '\n')
+      for entry in sorted(entries, key=lambda entry: entry['url']):
+        stream.write(self.__encode(entry))
+    os.rename(tmp_path, self.__path)
+    self.__line_count = len(entries)
+
+  def __append(self, entries):
+    logging.debug('Adding %d bom entries to %s', len(entries), self.__path)
+    with open(self.__path, 'a') as stream:
+      for entry in entries:
+        stream.write(self.__encode(entry))
+    self.__line_count += len(entries)
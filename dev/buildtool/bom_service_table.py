@@ -0,0 +1,199 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A compact table of which boms each service build appears in.
+
+The inverse bom service map is naturally a nested dictionary of
+  service -> version -> commit -> buildnum -> [bom info]
+but building (and serializing) it that way repeats the bom info for every
+service in every bom, and the yaml round trip between commands is slow.
+
+The BomServiceTable instead keeps one info dictionary per bom and a row per
+(service, version, commit, buildnum, bom) held in parallel columns of
+interned strings. It is exchanged between commands as JSON lines, and only
+expanded into the nested form when something asks for it.
+"""
+
+import json
+import sys
+
+
+if sys.version_info[0] == 2:
+  _INTERN = intern  # pylint: disable=undefined-variable
+else:
+  _INTERN = sys.intern
+
+
+def _intern(value):
+  """Share a single copy of each of the many repeated column values."""
+  return _INTERN(value) if isinstance(value, str) else value
+
+
+class BomServiceTable(object):
+  """Records the service builds referenced by each bom."""
+
+  FORMAT_VERSION = 1
+
+  @property
+  def bom_infos(self):
+    """The info dictionaries for each bom, indexed by row bom_id."""
+    return self.__bom_infos
+
+  @property
+  def service_names(self):
+    """All the service names, including those without any rows."""
+    return sorted(self.__service_names)
+
+  def __init__(self):
+    self.__bom_infos = []
+    self.__service_names = set([])
+    self.__services = []
+    self.__versions = []
+    self.__commits = []
+    self.__buildnums = []
+    self.__bom_ids = []
+
+  def __len__(self):
+    return len(self.__bom_ids)
+
+  def add_service_name(self, name):
+    """Note a service that should appear even if it has no rows."""
+    self.__service_names.add(_intern(name))
+
+  def add_bom(self, info, builds):
+    """Add the builds referenced by a bom.
+
+    Args:
+      info: [dict] The bom info, which includes the 'bom_version'.
+      builds: [list of (service, version, commit, buildnum)]
+    """
+    bom_id = len(self.__bom_infos)
+    self.__bom_infos.append(info)
+    for service, version, commit, buildnum in builds:
+      self.__add_row(service, version, commit, buildnum, bom_id)
+
+  def __add_row(self, service, version, commit, buildnum, bom_id):
+    service = _intern(service)
+    self.__service_names.add(service)
+    self.__services.append(service)
+    self.__versions.append(_intern(version))
+    self.__commits.append(_intern(commit))
+    self.__buildnums.append(_intern(buildnum))
+    self.__bom_ids.append(bom_id)
+
+  def rows(self):
+    """Yields (service, version, commit, buildnum, bom_id) for each row."""
+    # pylint: disable=bad-zip
+    return zip(self.__services, self.__versions, self.__commits,
+               self.__buildnums, self.__bom_ids)
+
+  def bom_versions(self):
+    """Returns the set of bom versions with at least one row."""
+    return set([self.__bom_infos[bom_id]['bom_version']
+                for bom_id in set(self.__bom_ids)])
+
+  def partition(self, released_matcher):
+    """Split into tables of released and unreleased builds.
+
+    A build is released if any bom it appears in is a release, in which
+    case only the released boms are kept for it. Otherwise it is unreleased
+    and keeps all its boms.
+
+    Args:
+      released_matcher: [re] Matches the bom versions that are releases.
+
+    Returns:
+      released, unreleased BomServiceTable
+    """
+    build_bom_ids = {}
+    for service, version, commit, buildnum, bom_id in self.rows():
+      build_bom_ids.setdefault(
+          (service, version, commit, buildnum), []).append(bom_id)
+
+    is_released = [bool(released_matcher.match(info['bom_version']))
+                   for info in self.__bom_infos]
+    released = BomServiceTable()
+    unreleased = BomServiceTable()
+    for table in [released, unreleased]:
+      table.__bom_infos = self.__bom_infos
+      table.__service_names = set(self.__service_names)
+
+    for key, bom_ids in build_bom_ids.items():
+      released_ids = [bom_id for bom_id in bom_ids if is_released[bom_id]]
+      table = released if released_ids else unreleased
+      for bom_id in released_ids or bom_ids:
+        table.__add_row(key[0], key[1], key[2], key[3], bom_id)
+    return released, unreleased
+
+  def to_service_map(self):
+    """Returns the nested service map.
+
+    The map is service -> version -> commit -> buildnum -> [bom info] with
+    each info list sorted by bom timestamp. Services without any builds map
+    to None. The info dictionaries are shared, not copied.
+    """
+    result = {name: None for name in self.__service_names}
+    infos = self.__bom_infos
+    for service, version, commit, buildnum, bom_id in self.rows():
+      version_map = result.get(service)
+      if version_map is None:
+        version_map = {}
+        result[service] = version_map
+      commit_map = version_map.setdefault(version, {})
+      commit_map.setdefault(commit, {}).setdefault(buildnum, []).append(
+          infos[bom_id])
+
+    for version_map in result.values():
+      for commit_map in (version_map or {}).values():
+        for buildnum_map in commit_map.values():
+          for info_list in buildnum_map.values():
+            info_list.sort(key=lambda info: info['bom_timestamp'])
+    return result
+
+  def write(self, stream):
+    """Write the table to the stream as JSON lines.
+
+    The first line is a header, followed by a line for each bom with its
+    info and the rows referencing it.
+    """
+    rows_by_bom = [[] for _ in self.__bom_infos]
+    for service, version, commit, buildnum, bom_id in self.rows():
+      rows_by_bom[bom_id].append([service, version, commit, buildnum])
+
+    encoder = json.JSONEncoder(separators=(',', ':'), default=str)
+    stream.write(encoder.encode({'version': self.FORMAT_VERSION,
+                                 'services': self.service_names}))
+    stream.write('\n')
+    for bom_id, info in enumerate(self.__bom_infos):
+      if rows_by_bom[bom_id]:
+        stream.write(encoder.encode([info, rows_by_bom[bom_id]]))
+        stream.write('\n')
+
+  @staticmethod
+  def read(stream):
+    """Returns a table that was written to the stream."""
+    decoder = json.JSONDecoder()
+    header = decoder.decode(stream.readline())
+    if header.get('version') != BomServiceTable.FORMAT_VERSION:
+      raise ValueError('Unsupported bom service table version {0}'.format(
+          header.get('version')))
+
+    table = BomServiceTable()
+    for name in header.get('services', []):
+      table.add_service_name(name)
+    for line in stream:
+      if line.strip():
+        info, builds = decoder.decode(line)
+        table.add_bom(info, builds)
+    return table
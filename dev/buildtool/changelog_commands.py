@@ -57,6 +57,9 @@ from buildtool import (
     raise_and_log_error,
     write_to_path)
 
+from buildtool.changelog_segments import ChangelogSegmentStore
+from buildtool.commit_classifier import CommitClassifier
+
 
 BUILD_CHANGELOG_COMMAND = 'build_changelog'
 TITLE_LINE_MATCHER = re.compile(r'\W*\w+\(([^\)]+)\)\s*[:-]?(.*)')
@@ -88,44 +91,13 @@ class ChangelogRepositoryData(
     The keys in the dictionary are the type of change.
     The values are a list of git.CommitMessage.
     """
-    partition_types = [
-        ('Breaking Changes',
-         re.compile(r'^\s*'
-                    r'(.*?BREAKING CHANGE.*)',
-                    re.MULTILINE)),
-        ('Features',
-         re.compile(r'^\s*'
-                    r'(?:\*\s+)?'
-                    r'((?:feat|feature)[\(:].*)',
-                    re.MULTILINE)),
-        ('Configuration',
-         re.compile(r'^\s*'
-                    r'(?:\*\s+)?'
-                    r'((?:config)[\(:].*)',
-                    re.MULTILINE)),
-        ('Fixes',
-         re.compile(r'^\s*'
-                    r'(?:\*\s+)?'
-                    r'((?:bug|fix)[\(:].*)',
-                    re.MULTILINE)),
-        ('Other',
-         re.compile(r'.*'))
-    ]
     workspace = {}
     for msg in self.normalized_messages:
-      text = msg.message
-      match = None
-      for section, regex in partition_types:
-        match = regex.search(text)
-        if match:
-          if section not in workspace:
-            workspace[section] = []
-          workspace[section].append(msg)
-          break
+      section = CommitClassifier.classify(msg).section
+      workspace.setdefault(section, []).append(msg)
 
     result = collections.OrderedDict()
-    for spec in partition_types:
-      key = spec[0]
+    for key in CommitClassifier.SECTIONS:
       if key in workspace:
         result[key] = (self._sort_partition(workspace[key])
                        if sort
@@ -141,17 +113,9 @@ class ChangelogRepositoryData(
     component is the <THING> for titles in the form TYPE(<THING>): <MESSAGE>
     """
     thing_dict = {}
-    def get_thing_list(title_line):
-      """Return bucket for title_line, adding new one if needed."""
-      match = TITLE_LINE_MATCHER.match(title_line)
-      thing = match.group(1) if match else ''
-      if not thing in thing_dict:
-        thing_dict[thing] = []
-      return thing_dict[thing]
-
     for message in commit_messages:
-      title_line = message.message.split('\n')[0]
-      get_thing_list(title_line).append(message)
+      thing = CommitClassifier.classify(message).component
+      thing_dict.setdefault(thing, []).append(message)
 
     result = []
     for thing in sorted(thing_dict.keys()):
@@ -166,6 +130,7 @@ class ChangelogBuilder(object):
 
   def __init__(self, **kwargs):
     self.__entries = []
+    self.__rendered_segments = []
     self.__with_partition = kwargs.pop('with_partition', True)
     self.__with_detail = kwargs.pop('with_detail', False)
     self.__write_category_heading = self.__with_partition and self.__with_detail
@@ -193,31 +158,50 @@ class ChangelogBuilder(object):
     self.__entries.append(ChangelogRepositoryData(
         repository, summary, normalized_messages))
 
-  def build(self):
-    """Construct changelog."""
-    report = []
+  def add_rendered_segment(self, repository, text):
+    """Add a repository's changes that build_segment already rendered."""
+    self.__rendered_segments.append((repository, text))
 
-    for entry in sorted(self.__entries):
-      summary = entry.summary
-      repository = entry.repository
-      commit_messages = entry.normalized_messages
-      name = repository.name
+  def render_options(self):
+    """Returns a dictionary of the options affecting the rendered text."""
+    return {'with_partition': self.__with_partition,
+            'with_detail': self.__with_detail,
+            'sort_partitions': self.__sort_partitions}
 
-      if not commit_messages:
-        continue
+  def build_segment(self, entry):
+    """Construct the changelog segment for a single repository.
 
-      report.append('## [{title}](#{name}) {version}'.format(
-          title=name.capitalize(), name=name,
-          version=summary.version))
-      report.append('')
+    Returns:
+      The segment text, which is empty if the repository has no changes.
+    """
+    summary = entry.summary
+    repository = entry.repository
+    commit_messages = entry.normalized_messages
+    name = repository.name
 
-      if self.__with_partition:
-        report.extend(self.build_commits_by_type(entry))
-      if self.__with_detail:
-        report.extend(self.build_commits_by_sequence(entry))
+    if not commit_messages:
+      return ''
 
+    report = []
+    report.append('## [{title}](#{name}) {version}'.format(
+        title=name.capitalize(), name=name,
+        version=summary.version))
+    report.append('')
+
+    if self.__with_partition:
+      report.extend(self.build_commits_by_type(entry))
+    if self.__with_detail:
+      report.extend(self.build_commits_by_sequence(entry))
     return '\n'.join(report)
 
+  def build(self):
+    """Construct changelog."""
+    segments = list(self.__rendered_segments)
+    segments.extend([(entry.repository, self.build_segment(entry))
+                     for entry in self.__entries])
+    segments.sort(key=lambda segment: segment[0])
+    return '\n'.join([text for _, text in segments if text])
+
   def build_commits_by_type(self, entry):
     """Create a section that enumerates changes by partition type.
 
@@ -288,6 +272,8 @@ class ChangelogBuilder(object):
 class BuildChangelogCommand(RepositoryCommandProcessor):
   """Implements the build_changelog."""
 
+  SUPPORTS_PROCESS_EXECUTOR = True
+
   def __init__(self, factory, options, **kwargs):
     # Use own repository to avoid race conditions when commands are
     # running concurrently.
@@ -310,26 +296,78 @@ class BuildChangelogCommand(RepositoryCommandProcessor):
       self.__relative_bom = None
     super(BuildChangelogCommand, self).__init__(factory, options_copy, **kwargs)
 
+    self.__builder = ChangelogBuilder(
+        with_detail=options.include_changelog_details)
+    self.__segment_store = (
+        ChangelogSegmentStore(options.changelog_segment_dir,
+                              self.__builder.render_options())
+        if options.changelog_segment_dir
+        else None)
+    self.__skipped_segments = {}  # repository name to stored segment text
+
+  def __determine_base_commit(self, repository):
+    """Returns the commit the changelog is relative to, if not a tag."""
+    if not self.__relative_bom:
+      return None
+    repo_name = self.scm.repository_name_to_service_name(repository.name)
+    return self.__relative_bom['services'][repo_name]['commit']
+
+  def __determine_head_commit(self, repository):
+    """Returns the commit the changelog is for, according to the bom."""
+    service_name = self.scm.repository_name_to_service_name(repository.name)
+    return self.bom['services'][service_name]['commit']
+
+  def _do_can_skip_repository(self, repository):
+    """Skip repositories whose segment is already known."""
+    if self.__segment_store is None:
+      return False
+    text = self.__segment_store.lookup(
+        repository, self.__determine_head_commit(repository),
+        self.__determine_base_commit(repository))
+    if text is None:
+      return False
+    self.__skipped_segments[repository.name] = text
+    return True
+
+  def _do_skipped_repository(self, repository):
+    """Returns the stored segment for a repository that was skipped."""
+    return None, self.__skipped_segments.pop(repository.name)
+
   def _do_repository(self, repository):
-    """Collect the summary for the given repository."""
-    if self.__relative_bom:
-      repo_name = self.scm.repository_name_to_service_name(repository.name)
-      bom_commit = self.__relative_bom['services'][repo_name]['commit']
-    else:
-      bom_commit = None
-    return self.git.collect_repository_summary(repository.git_dir,
-                                               base_commit_id=bom_commit)
+    """Collect the summary for the given repository.
+
+    Returns:
+      A (summary, segment) tuple where the segment is the rendered text
+      when --changelog_segment_dir is used, otherwise None. These are
+      returned rather than kept on the command so that they survive
+      --repository_executor=process.
+    """
+    base_commit = self.__determine_base_commit(repository)
+    summary = self.git.collect_repository_summary(repository.git_dir,
+                                                  base_commit_id=base_commit)
+    text = None
+    if self.__segment_store is not None:
+      entry = ChangelogRepositoryData(
+          repository, summary,
+          CommitMessage.normalize_message_list(summary.commit_messages))
+      text = self.__builder.build_segment(entry)
+      self.__segment_store.record(
+          repository, summary.commit_id, base_commit,
+          'version-' + summary.prev_version, text)
+    return summary, text
 
   def _do_postprocess(self, result_dict):
     """Construct changelog from the collected summary, then write it out."""
-    options = self.options
     path = os.path.join(self.get_output_dir(), 'changelog.md')
 
-    builder = ChangelogBuilder(with_detail=options.include_changelog_details)
+    builder = self.__builder
     repository_map = {repository.name: repository
                       for repository in self.source_repositories}
-    for name, summary in result_dict.items():
-      builder.add_repository(repository_map[name], summary)
+    for name, (summary, text) in result_dict.items():
+      if text is not None:
+        builder.add_rendered_segment(repository_map[name], text)
+      else:
+        builder.add_repository(repository_map[name], summary)
     changelog_text = builder.build()
     write_to_path(changelog_text, path)
     logging.info('Wrote changelog to %s', path)
@@ -355,6 +393,11 @@ class BuildChangelogFactory(RepositoryCommandFactory):
              ' in time sequence in the changelog.')
 
     HalRunner.add_parser_args(parser, defaults)
+    self.add_argument(
+        parser, 'changelog_segment_dir', defaults, None,
+        help='If set, remember the changelog of each repository in this'
+             ' directory so later builds only analyze the repositories'
+             ' whose commit changed.')
     self.add_argument(
         parser, 'relative_to_bom_path', defaults, None,
         help='If specified then produce the changelog relative to the'
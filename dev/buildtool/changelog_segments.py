@@ -0,0 +1,130 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Remembers the rendered changelog section of each repository.
+
+A changelog is the concatenation of a section per repository, and each
+section only depends on the repository's head commit, what it is relative
+to, and how it is rendered. Successive builds (such as patch releases)
+typically only move a few of the repositories, so the ChangelogSegmentStore
+keeps each rendered section so that the others need not be cloned,
+analyzed or rendered again.
+
+A segment is relative to either a base commit (when the changelog is
+relative to another bom) or, when no base is given, to the most recent
+version tag before the head commit. The tag found is recorded with the
+segment.
+"""
+
+import json
+import logging
+import os
+import threading
+
+from buildtool import ensure_dir_exists
+
+
+class ChangelogSegmentStore(object):
+  """Persists the rendered changelog segment for each repository."""
+
+  FORMAT_VERSION = 1
+
+  # Keep this many of the most recent segments for each repository.
+  MAX_SEGMENTS_PER_REPOSITORY = 8
+
+  def __init__(self, segment_dir, render_options=None):
+    """Constructor.
+
+    Args:
+      segment_dir: [path] The directory to keep the segments in.
+      render_options: [dict] Describes how segments are rendered.
+         Segments rendered with different options are not reused.
+    """
+    self.__segment_dir = segment_dir
+    self.__render_options = dict(render_options or {})
+    self.__lock = threading.Lock()
+
+  def __path(self, repository_name):
+    return os.path.join(self.__segment_dir, repository_name + '.json')
+
+  def __load(self, repository_name):
+    path = self.__path(repository_name)
+    if not os.path.exists(path):
+      return []
+    try:
+      with open(path, 'r') as stream:
+        data = json.load(stream)
+      if data.get('version') != self.FORMAT_VERSION:
+        return []
+      return data['segments']
+    except (IOError, ValueError, KeyError) as ex:
+      logging.warning('Ignoring unreadable changelog segments %s: %s',
+                      path, ex)
+      return []
+
+  def lookup(self, repository, head_commit, base_commit=None):
+    """Returns the segment text for the repository at head_commit or None.
+
+    Args:
+      repository: [GitRepositorySpec] The repository the segment is for.
+      head_commit: [string] The commit the changelog is for.
+      base_commit: [string] The commit the changelog is relative to,
+         or None if relative to the prior version tag.
+    """
+    with self.__lock:
+      segments = self.__load(repository.name)
+    for segment in segments:
+      if (segment['head_commit'] == head_commit
+          and segment['base_commit'] == base_commit
+          and segment['origin'] == repository.origin
+          and segment['render_options'] == self.__render_options):
+        logging.debug('Reusing changelog segment for %s at %s relative to %s',
+                      repository.name, head_commit,
+                      base_commit or segment['base_tag'])
+        return segment['text']
+    return None
+
+  def record(self, repository, head_commit, base_commit, base_tag, text):
+    """Remember the segment text for the repository.
+
+    Args:
+      repository: [GitRepositorySpec] The repository the segment is for.
+      head_commit: [string] The commit the changelog is for.
+      base_commit: [string] The commit the changelog is relative to,
+         or None if relative to the prior version tag.
+      base_tag: [string] The version tag the changelog was relative to.
+      text: [string] The rendered segment.
+    """
+    segment = {
+        'head_commit': head_commit,
+        'base_commit': base_commit,
+        'base_tag': base_tag,
+        'origin': repository.origin,
+        'render_options': self.__render_options,
+        'text': text
+    }
+    path = self.__path(repository.name)
+    with self.__lock:
+      segments = [entry for entry in self.__load(repository.name)
+                  if (entry['head_commit'], entry['base_commit'])
+                  != (head_commit, base_commit)]
+      segments.insert(0, segment)
+      del segments[self.MAX_SEGMENTS_PER_REPOSITORY:]
+
+      ensure_dir_exists(self.__segment_dir)
+      tmp_path = path + '.tmp'
+      with open(tmp_path, 'w') as stream:
+        json.dump({'version': self.FORMAT_VERSION, 'segments': segments},
+                  stream)
+      os.rename(tmp_path, path)
@@ -0,0 +1,133 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Classifies commit messages by the kind of change they describe.
+
+Commit messages follow the convention "TYPE(<thing>): <message>", possibly
+with several such lines in one message. The semantic version implication
+and the changelog section of a commit both follow from the TYPEs it
+mentions (and whether it mentions a BREAKING CHANGE), so the
+CommitClassifier finds these in one pass over the message and decides
+both at once, along with the <thing> the commit title is about.
+
+The same commits are looked at by several repositories, releases and
+commands, so classifications are remembered for the life of the process.
+"""
+
+import collections
+import re
+import threading
+
+
+class CommitClassification(
+    collections.namedtuple('CommitClassification',
+                           ['level', 'section', 'component'])):
+  """How a commit message was classified.
+
+  Attributes:
+    level: [string] MAJOR, MINOR or PATCH for the semantic version component
+       the change implies, or None if the message does not say.
+    section: [string] The changelog section the change belongs in.
+    component: [string] The <thing> in a "TYPE(<thing>): " title or ''.
+  """
+
+
+class CommitClassifier(object):
+  """Classifies commit messages, remembering each classification."""
+
+  MAJOR = 'MAJOR'
+  MINOR = 'MINOR'
+  PATCH = 'PATCH'
+
+  BREAKING_CHANGES_SECTION = 'Breaking Changes'
+  FEATURES_SECTION = 'Features'
+  CONFIGURATION_SECTION = 'Configuration'
+  FIXES_SECTION = 'Fixes'
+  OTHER_SECTION = 'Other'
+
+  # The changelog sections, ordered by significance.
+  SECTIONS = [BREAKING_CHANGES_SECTION, FEATURES_SECTION,
+              CONFIGURATION_SECTION, FIXES_SECTION, OTHER_SECTION]
+
+  _BREAKING_CHANGE_MARKER = 'BREAKING CHANGE'
+
+  # Finds the TYPE at the start of each line, optionally as a "* " bullet.
+  # The second group is empty if the TYPE is directly followed by the
+  # "(" or ":", which the changelog sections require.
+  _TYPE_MATCHER = re.compile(r'^\s*(?:\*\s+)?([A-Za-z]+)(\s*)[\(:]',
+                             re.MULTILINE)
+
+  # Finds the <thing> in a "TYPE(<thing>)" title.
+  _COMPONENT_MATCHER = re.compile(r'\W*\w+\(([^\)]+)\)')
+
+  # The vocabulary for these was taken from what is used in practice
+  # (right or wrong) in the spinnaker repositories.
+  _MINOR_TYPES = frozenset(['feat', 'feature', 'config'])
+  _PATCH_TYPES = frozenset(['fix', 'bug', 'chore', 'doc', 'docs', 'perf',
+                            'refactor', 'test'])
+  _SECTION_TYPES = [(FEATURES_SECTION, frozenset(['feat', 'feature'])),
+                    (CONFIGURATION_SECTION, frozenset(['config'])),
+                    (FIXES_SECTION, frozenset(['bug', 'fix']))]
+
+  __CLASSIFICATIONS = {}
+  __CLASSIFICATIONS_LOCK = threading.Lock()
+
+  @staticmethod
+  def classify(commit_message):
+    """Returns the CommitClassification for the CommitMessage.
+
+    Messages are remembered by their commit id and text since a commit
+    whose message has embedded summaries is normalized into several
+    CommitMessages with the same commit id.
+    """
+    key = (commit_message.commit_id, commit_message.message)
+    with CommitClassifier.__CLASSIFICATIONS_LOCK:
+      classification = CommitClassifier.__CLASSIFICATIONS.get(key)
+    if classification is None:
+      classification = CommitClassifier.classify_text(commit_message.message)
+      with CommitClassifier.__CLASSIFICATIONS_LOCK:
+        CommitClassifier.__CLASSIFICATIONS[key] = classification
+    return classification
+
+  @staticmethod
+  def classify_text(text):
+    """Returns the CommitClassification for a commit message's text."""
+    types = set([])
+    unspaced_types = set([])
+    for match in CommitClassifier._TYPE_MATCHER.finditer(text):
+      types.add(match.group(1))
+      if not match.group(2):
+        unspaced_types.add(match.group(1))
+
+    if text.find(CommitClassifier._BREAKING_CHANGE_MARKER) >= 0:
+      level = CommitClassifier.MAJOR
+      section = CommitClassifier.BREAKING_CHANGES_SECTION
+    else:
+      if types & CommitClassifier._MINOR_TYPES:
+        level = CommitClassifier.MINOR
+      elif types & CommitClassifier._PATCH_TYPES:
+        level = CommitClassifier.PATCH
+      else:
+        level = None
+
+      section = CommitClassifier.OTHER_SECTION
+      for name, section_types in CommitClassifier._SECTION_TYPES:
+        if unspaced_types & section_types:
+          section = name
+          break
+
+    match = CommitClassifier._COMPONENT_MATCHER.match(
+        text.split('\n', 1)[0])
+    component = match.group(1) if match else ''
+    return CommitClassification(level, section, component)
@@ -18,7 +18,6 @@ import copy
 import logging
 import os
 import re
-import subprocess
 
 from buildtool import (
   SPINNAKER_HALYARD_REPOSITORY_NAME,
@@ -26,10 +25,12 @@ from buildtool import (
   BranchSourceCodeManager,
   GradleCommandFactory,
   GradleCommandProcessor,
+  RepositoryExecutor,
+  GCLOUD_RESOURCE,
 
-  check_subprocess,
   check_subprocesses_to_logfile
 )
+from buildtool.artifact_inventory import RegistryTagInventory
 
 
 class BuildContainerCommand(GradleCommandProcessor):
@@ -64,16 +65,10 @@ class BuildContainerCommand(GradleCommandProcessor):
 
   def __gcb_image_exists(self, image_name, version):
     """Determine if gcb image already exists."""
-    options = self.options
-    command = ['gcloud', '--account', options.gcb_service_account,
-               'container', 'images', 'list-tags',
-               options.docker_registry + '/' + image_name,
-               '--filter="%s"' % version,
-               '--format=json']
-    got = check_subprocess(' '.join(command), stderr=subprocess.PIPE)
-    if got.strip() != '[]':
-      return True
-    return False
+    # The first lookup lists the whole registry so that the remaining
+    # repositories are answered from memory.
+    return RegistryTagInventory.from_options(self.options).has_tag(
+        image_name, version)
 
   def __build_with_gcb(self, repository, build_version):
     name = repository.name
@@ -104,10 +99,13 @@ class BuildContainerCommand(GradleCommandProcessor):
 
     logfile = self.get_logfile_path(name + '-gcb-build')
     labels = {'repository': repository.name}
-    self.metrics.time_call(
-        'GcrBuild', labels, self.metrics.default_determine_outcome_labels,
-        check_subprocesses_to_logfile,
-        name + ' container build', logfile, [command], cwd=repository.git_dir)
+    with RepositoryExecutor.resource_slot(GCLOUD_RESOURCE):
+      self.metrics.time_call(
+          'GcrBuild', labels, self.metrics.default_determine_outcome_labels,
+          check_subprocesses_to_logfile,
+          name + ' container build', logfile, [command],
+          cwd=repository.git_dir)
+    RegistryTagInventory.from_options(options).invalidate(service_name)
 
 class BuildContainerFactory(GradleCommandFactory):
   @staticmethod
@@ -127,6 +125,11 @@ class BuildContainerFactory(GradleCommandFactory):
 
     self.add_bom_parser_args(parser, defaults)
     BranchSourceCodeManager.add_parser_args(parser, defaults)
+    RegistryTagInventory.add_parser_args(parser, defaults)
+
+    # The container builds only need the source at the head of the branch.
+    parser.set_defaults(
+        git_clone_policy=defaults.get('git_clone_policy', 'shallow'))
     self.add_argument(
         parser, 'gcb_project', defaults, None,
         help='The GCP project ID that builds the containers when'
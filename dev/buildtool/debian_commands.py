@@ -14,6 +14,7 @@
 
 """Implements debian support commands for buildtool."""
 
+import logging
 import os
 import re
 from threading import Semaphore
@@ -23,6 +24,8 @@ from buildtool import (
     BranchSourceCodeManager,
     GradleCommandProcessor,
     GradleCommandFactory,
+    RepositoryExecutor,
+    GCLOUD_RESOURCE,
 
     check_options_set,
     check_subprocesses_to_logfile,
@@ -47,6 +50,21 @@ class BuildDebianCommand(GradleCommandProcessor):
         options, ['bintray_org', 'bintray_jar_repository',
                   'bintray_debian_repository', 'bintray_publish_wait_secs'])
 
+  def _do_preprocess(self):
+    """Check all the desired debian versions on bintray up front."""
+    repository_versions = []
+    for repository in self.source_repositories:
+      if repository.name in NON_DEBIAN_BOM_REPOSITORIES:
+        continue
+      try:
+        repository_versions.append(
+            (repository,
+             self.scm.get_repository_service_build_version(repository)))
+      except Exception as ex:
+        # Leave it to the repository itself to report the problem.
+        logging.debug('Not prefetching %s: %s', repository.name, ex)
+    self.gradle.prefetch_debian_versions(repository_versions)
+
   def _do_can_skip_repository(self, repository):
     if repository.name in NON_DEBIAN_BOM_REPOSITORIES:
       return True
@@ -83,10 +101,12 @@ class BuildDebianCommand(GradleCommandProcessor):
 
     logfile = self.get_logfile_path(repository.name + '-gcb-build')
     labels = {'repository': repository.name}
-    self.metrics.time_call(
-        'DebBuild', labels, self.metrics.default_determine_outcome_labels,
-        check_subprocesses_to_logfile,
-        repository.name + ' deb build', logfile, [command], cwd=repository.git_dir)
+    with RepositoryExecutor.resource_slot(GCLOUD_RESOURCE):
+      self.metrics.time_call(
+          'DebBuild', labels, self.metrics.default_determine_outcome_labels,
+          check_subprocesses_to_logfile,
+          repository.name + ' deb build', logfile, [command],
+          cwd=repository.git_dir)
 
 
 class BuildDebianFactory(GradleCommandFactory):
@@ -0,0 +1,157 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A local cache of Google Cloud Storage objects.
+
+Reading thousands of small objects with one "gsutil cat" each pays for
+a gsutil startup per object. The GcsObjectCache instead downloads objects
+in batches with a single parallel "gsutil -m cp" per batch.
+
+Objects are cached locally under a name derived from their url and
+generation. An object generation changes whenever the object is
+rewritten, so cached content never needs to be revalidated and a rerun
+only downloads the objects that are new or have changed.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+
+from buildtool import (
+    check_subprocess,
+    ensure_dir_exists,
+    exception_to_message)
+
+
+class GcsObjectCache(object):
+  """Downloads GCS objects into a local cache keyed by object generation."""
+
+  @property
+  def cache_dir(self):
+    return self.__cache_dir
+
+  def __init__(self, cache_dir, batch_size=250):
+    """Constructor.
+
+    Args:
+      cache_dir: [path] The directory to hold the cached objects.
+      batch_size: [int] The number of objects to download per gsutil call.
+         Smaller batches let the caller start processing sooner.
+    """
+    self.__cache_dir = cache_dir
+    self.__batch_size = max(1, batch_size)
+    ensure_dir_exists(cache_dir)
+
+  def list_objects(self, url_prefix, suffix=None):
+    """Returns a list of (url, generation) for the objects with the prefix.
+
+    Args:
+      url_prefix: [string] A gs:// url prefix to list.
+      suffix: [string] If provided, only objects ending with this are listed.
+    """
+    # "-a" includes the generation. It also lists non-current versions in
+    # a versioned bucket, so keep only the latest generation of each.
+    response = check_subprocess('gsutil ls -a ' + url_prefix)
+    latest = {}
+    for line in response.split('\n'):
+      line = line.strip()
+      if not line.startswith(url_prefix):
+        continue
+      url, _, generation = line.partition('#')
+      if suffix and not url.endswith(suffix):
+        continue
+      if generation and int(generation) > int(latest.get(url) or 0):
+        latest[url] = generation
+      else:
+        latest.setdefault(url, generation or None)
+    return sorted(latest.items())
+
+  def cache_path(self, url, generation):
+    """Returns the local path for the given version of an object."""
+    digest = hashlib.sha1(
+        '{0}#{1}'.format(url, generation).encode('utf-8')).hexdigest()
+    extension = os.path.splitext(url)[1]
+    return os.path.join(self.__cache_dir, digest[:2], digest + extension)
+
+  def fetch(self, url_generations):
+    """Make each of the objects available locally.
+
+    This is a generator so the caller can process each object as soon as
+    it is available. Objects already in the cache are yielded first,
+    then the remainder as each batch downloads.
+
+    Args:
+      url_generations: [list of (url, generation)] The objects to fetch.
+         A generation of None means the current object, which is always
+         downloaded.
+
+    Yields:
+      (url, path) where path is None if the object could not be fetched.
+    """
+    missing = []
+    for url, generation in url_generations:
+      path = self.cache_path(url, generation) if generation else None
+      if path and os.path.exists(path):
+        yield url, path
+      else:
+        missing.append((url, generation))
+
+    logging.info('Downloading %d of %d objects into %s',
+                 len(missing), len(url_generations), self.__cache_dir)
+    for start in range(0, len(missing), self.__batch_size):
+      batch = missing[start:start + self.__batch_size]
+      for result in self.__fetch_batch(batch):
+        yield result
+
+  def __fetch_batch(self, batch):
+    """Download a batch of objects with a single gsutil call.
+
+    Returns:
+      A list of (url, path) for each object in the batch.
+    """
+    result = []
+    staging_dir = tempfile.mkdtemp(prefix='staging', dir=self.__cache_dir)
+    try:
+      list_path = os.path.join(staging_dir, 'urls.txt')
+      with open(list_path, 'w') as stream:
+        for url, generation in batch:
+          stream.write(url + ('#' + generation if generation else '') + '\n')
+
+      download_dir = os.path.join(staging_dir, 'objects')
+      ensure_dir_exists(download_dir)
+      try:
+        with open(list_path, 'r') as stream:
+          check_subprocess('gsutil -m -q cp -I ' + download_dir, stdin=stream)
+      except Exception as ex:
+        # Some of the objects may have been downloaded so keep going.
+        logging.warning('Failed to download some objects: %s',
+                        exception_to_message(ex))
+
+      for url, generation in batch:
+        downloaded = os.path.join(download_dir, url[url.rfind('/') + 1:])
+        if not os.path.exists(downloaded):
+          logging.warning('Could not download %s', url)
+          result.append((url, None))
+          continue
+        # Without a generation the object is refetched every time, but it
+        # still needs to outlive the staging directory.
+        path = self.cache_path(url, generation)
+        ensure_dir_exists(os.path.dirname(path))
+        os.rename(downloaded, path)
+        result.append((url, path))
+    finally:
+      shutil.rmtree(staging_dir, ignore_errors=True)
+    return result
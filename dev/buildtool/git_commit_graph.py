@@ -0,0 +1,376 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An in-process index over the commit graph of a local git repository.
+
+Answering ancestry questions (merge-base, branch --contains, tag lookup)
+by forking git for each question is expensive when there are hundreds of
+tags to consider. The CommitGraphIndex loads the parent relationships once
+from "git rev-list --parents" and then answers these questions in process.
+
+The index is persisted within the repository's .git directory so that
+subsequent buildtool invocations only need to add the commits that were
+introduced since the index was last written (e.g. by a fetch).
+
+The history of a shallow clone is truncated at its shallow boundary, and
+deepening it adds history beneath commits already in the index, which an
+incremental refresh would not see. So the index of a shallow repository is
+rebuilt whenever the boundary changes and is never persisted.
+"""
+
+import json
+import logging
+import os
+import threading
+
+
+class CommitGraphIndex(object):
+  """Answers ancestry queries for a local repository without forking git.
+
+  The index tracks the parents of every commit reachable from the
+  repository references along with the commit each reference resolves to.
+  Annotated tags are peeled to the commit they refer to.
+  """
+
+  FORMAT_VERSION = 1
+  INDEX_BASENAME = 'buildtool_commit_graph.json'
+
+  @property
+  def git_dir(self):
+    return self.__git_dir
+
+  @property
+  def refs(self):
+    """A dictionary of the commit each full refname resolves to."""
+    return self.__refs
+
+  def __init__(self, git, git_dir):
+    """Constructor.
+
+    Args:
+      git: [GitRunner] Used to run the git commands that populate the index.
+      git_dir: [path] The local repository to index.
+    """
+    self.__git = git
+    self.__git_dir = git_dir
+    self.__lock = threading.RLock()
+    self.__parents = {}
+    self.__refs = {}
+    self.__children = None
+    self.__generation = None
+
+    dot_git = os.path.join(git_dir, '.git')
+    if os.path.isdir(dot_git):
+      self.__index_path = os.path.join(dot_git, self.INDEX_BASENAME)
+      self.__shallow_path = os.path.join(dot_git, 'shallow')
+    else:
+      self.__index_path = None
+      self.__shallow_path = os.path.join(git_dir, 'shallow')
+    self.__shallow = self.__read_shallow()
+    if not self.__shallow:
+      self.__load()
+
+  def __read_shallow(self):
+    """Returns the shallow boundary commits, or empty if not shallow."""
+    try:
+      with open(self.__shallow_path, 'r') as stream:
+        return stream.read()
+    except IOError:
+      return ''
+
+  def __load(self):
+    """Load the persisted index, if any."""
+    if not self.__index_path or not os.path.exists(self.__index_path):
+      return
+    try:
+      with open(self.__index_path, 'r') as stream:
+        data = json.load(stream)
+      if data.get('version') != self.FORMAT_VERSION:
+        logging.debug('Ignoring stale commit graph index %s',
+                      self.__index_path)
+        return
+      self.__parents = {commit: tuple(parents)
+                        for commit, parents in data['parents'].items()}
+      self.__refs = data['refs']
+    except (IOError, ValueError, KeyError) as ex:
+      logging.warning('Ignoring unreadable commit graph index %s: %s',
+                      self.__index_path, ex)
+      self.__parents = {}
+      self.__refs = {}
+
+  def __save(self):
+    """Persist the index so later runs need only add new commits."""
+    if not self.__index_path or self.__shallow:
+      return
+    data = {'version': self.FORMAT_VERSION,
+            'refs': self.__refs,
+            'parents': self.__parents}
+    tmp_path = self.__index_path + '.tmp'
+    try:
+      with open(tmp_path, 'w') as stream:
+        json.dump(data, stream, separators=(',', ':'))
+      os.rename(tmp_path, self.__index_path)
+    except (IOError, OSError) as ex:
+      logging.warning('Could not write commit graph index %s: %s',
+                      self.__index_path, ex)
+
+  def __query_refs(self):
+    """Returns dictionary of the commit each refname currently points at."""
+    stdout = self.__git.check_run(
+        self.__git_dir,
+        'for-each-ref --format="%(objectname) %(*objectname) %(refname)"')
+    refs = {}
+    for line in stdout.split('\n'):
+      if not line:
+        continue
+      object_id, peeled_id, refname = line.split(' ', 2)
+      refs[refname] = peeled_id or object_id
+    return refs
+
+  def __add_history(self, tips):
+    """Add the history leading to each of the tips into the index.
+
+    Commits already in the index are used as a boundary so only the new
+    portion of the graph is read from git.
+
+    Returns:
+      False if git could not walk the history from the known boundary.
+    """
+    boundary = sorted(set([commit for commit in self.__refs.values()
+                           if commit in self.__parents]))
+    command = 'rev-list --parents ' + ' '.join(sorted(tips))
+    if boundary:
+      command += ' --not ' + ' '.join(boundary)
+    retcode, stdout = self.__git.run_git(self.__git_dir, command)
+    if retcode != 0:
+      logging.debug('Could not extend commit graph in %s: %s',
+                    self.__git_dir, stdout)
+      return False
+
+    added = 0
+    for line in stdout.split('\n'):
+      ids = line.split()
+      if ids:
+        self.__parents[ids[0]] = tuple(ids[1:])
+        added += 1
+    if added:
+      self.__children = None
+      self.__generation = None
+    logging.debug('Added %d commits to commit graph index for %s',
+                  added, self.__git_dir)
+    return True
+
+  def __rebuild(self, refs):
+    logging.debug('Building commit graph index for %s', self.__git_dir)
+    self.__parents = {}
+    self.__refs = {}
+    self.__children = None
+    self.__generation = None
+    stdout = self.__git.check_run(
+        self.__git_dir, 'rev-list --parents --all')
+    for line in stdout.split('\n'):
+      ids = line.split()
+      if ids:
+        self.__parents[ids[0]] = tuple(ids[1:])
+    self.__refs = refs
+
+  def refresh(self):
+    """Bring the index up to date with the repository's references.
+
+    This costs a single "git for-each-ref" when nothing has changed,
+    otherwise only the newly introduced history is read.
+    """
+    with self.__lock:
+      refs = self.__query_refs()
+      shallow = self.__read_shallow()
+      if refs == self.__refs and shallow == self.__shallow:
+        return
+      new_tips = set(refs.values()) - set(self.__parents.keys())
+      if not self.__parents or shallow != self.__shallow:
+        self.__shallow = shallow
+        self.__rebuild(refs)
+      elif new_tips and not self.__add_history(new_tips):
+        self.__rebuild(refs)
+      else:
+        self.__refs = refs
+      self.__save()
+
+  def ensure_commits(self, commit_ids):
+    """Make sure the history of the given commits is in the index.
+
+    This is needed for commits that are not reachable from any reference,
+    such as a detached HEAD.
+    """
+    with self.__lock:
+      missing = set(commit_ids) - set(self.__parents.keys())
+      if missing and self.__add_history(missing):
+        self.__save()
+
+  def has_commit(self, commit_id):
+    return commit_id in self.__parents
+
+  def resolve_ref(self, name):
+    """Returns the commit for the given ref name, or None if not known.
+
+    Like "git show-ref", the name may be any suffix of the full refname
+    that starts at a '/' boundary (e.g. "origin/master").
+    """
+    commit = self.__refs.get(name)
+    if commit:
+      return commit
+    suffix = '/' + name
+    for refname in sorted(self.__refs.keys()):
+      if refname.endswith(suffix):
+        return self.__refs[refname]
+    return None
+
+  def query_tag_commit(self, tag):
+    """Returns the commit the tag refers to, or None if not known."""
+    return self.__refs.get('refs/tags/' + tag)
+
+  def ancestors(self, commit_id):
+    """Returns the set of commits reachable from commit_id, inclusive."""
+    parents = self.__parents
+    result = set()
+    stack = [commit_id]
+    while stack:
+      commit = stack.pop()
+      if commit in result:
+        continue
+      result.add(commit)
+      stack.extend(parents.get(commit, ()))
+    return result
+
+  def descendants(self, commit_id):
+    """Returns the set of commits that reach commit_id, inclusive."""
+    children = self.__determine_children()
+    result = set()
+    stack = [commit_id]
+    while stack:
+      commit = stack.pop()
+      if commit in result:
+        continue
+      result.add(commit)
+      stack.extend(children.get(commit, ()))
+    return result
+
+  def query_branches_containing(self, commit_id, ref_prefix='refs/remotes/'):
+    """Returns the names of the branches that contain the given commit.
+
+    This is the equivalent of "git branch -r --contains <commit_id>" for
+    the default ref_prefix. The names returned have the prefix removed.
+    """
+    descendants = self.descendants(commit_id)
+    return sorted([refname[len(ref_prefix):]
+                   for refname, commit in self.__refs.items()
+                   if refname.startswith(ref_prefix)
+                   and not refname.endswith('/HEAD')
+                   and commit in descendants])
+
+  def merge_base(self, first, second, first_ancestors=None):
+    """Returns the best common ancestor of two commits, or None if none.
+
+    This is the equivalent of "git merge-base <first> <second>".
+    When there are multiple best common ancestors, the most recent one by
+    generation number is returned.
+
+    Args:
+      first: [string] A commit id.
+      second: [string] Another commit id.
+      first_ancestors: [set] The ancestors of first, if already known.
+         Passing this in avoids recomputing it across repeated calls.
+    """
+    if first_ancestors is None:
+      first_ancestors = self.ancestors(first)
+    if second in first_ancestors:
+      return second
+
+    # Walk back from second until we reach the history shared with first.
+    parents = self.__parents
+    frontier = set()
+    visited = set()
+    stack = [second]
+    while stack:
+      commit = stack.pop()
+      if commit in visited:
+        continue
+      visited.add(commit)
+      if commit in first_ancestors:
+        frontier.add(commit)
+      else:
+        stack.extend(parents.get(commit, ()))
+
+    if len(frontier) > 1:
+      frontier = self.__remove_reachable(frontier)
+    if not frontier:
+      return None
+    generation = self.__determine_generation()
+    return max(frontier, key=lambda commit: (generation.get(commit, 0), commit))
+
+  def __remove_reachable(self, candidates):
+    """Remove candidates that are ancestors of other candidates."""
+    generation = self.__determine_generation()
+    lowest = min(generation.get(commit, 0) for commit in candidates)
+    parents = self.__parents
+    reachable = set()
+    stack = [parent for commit in candidates
+             for parent in parents.get(commit, ())]
+    while stack:
+      commit = stack.pop()
+      if commit in reachable or generation.get(commit, 0) < lowest:
+        continue
+      reachable.add(commit)
+      stack.extend(parents.get(commit, ()))
+    return candidates - reachable
+
+  def __determine_children(self):
+    with self.__lock:
+      if self.__children is None:
+        children = {}
+        for commit, parents in self.__parents.items():
+          for parent in parents:
+            children.setdefault(parent, []).append(commit)
+        self.__children = children
+      return self.__children
+
+  def __determine_generation(self):
+    """Compute the generation number of each commit.
+
+    A root commit has generation 1, and every other commit is one more
+    than the maximum generation of its parents.
+    """
+    with self.__lock:
+      if self.__generation is not None:
+        return self.__generation
+
+      parents = self.__parents
+      generation = {}
+      for start in parents:
+        if start in generation:
+          continue
+        stack = [start]
+        while stack:
+          commit = stack[-1]
+          pending = [parent for parent in parents.get(commit, ())
+                     if parent not in generation and parent in parents]
+          if pending:
+            stack.extend(pending)
+            continue
+          stack.pop()
+          if commit not in generation:
+            generation[commit] = 1 + max(
+                [generation.get(parent, 0)
+                 for parent in parents.get(commit, ())] or [0])
+      self.__generation = generation
+      return generation
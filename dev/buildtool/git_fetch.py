@@ -0,0 +1,204 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Avoids fetching into local repositories when nothing has changed.
+
+The commands in a build flow each refresh the same local repositories,
+usually when nothing has changed since the previous command did. Listing
+the remote's refs ("git ls-remote") is much cheaper than a fetch, so the
+FetchCoordinator remembers what the remote advertised (and what the local
+refs were) after each fetch, and skips the next fetch if neither has
+changed. This is remembered in the repository's git directory so it
+carries over between commands.
+
+The remote's refs come from the GitRunner's RemoteRefResolver so that a
+listing made for other purposes (e.g. skip checks) is not repeated. The
+resolver forgets a remote once it has been fetched from so the next
+fetch lists it again.
+
+Concurrent requests to fetch the same repository are coalesced so that
+a request waiting on a fetch that started after it was made simply takes
+that fetch's result.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from buildtool.git_refs import LocalRepositoryQueryRegistry
+from buildtool.metrics import MetricsManager
+
+
+class _FetchState(object):
+  """The most recent fetch of a repository within this process."""
+  # pylint: disable=too-few-public-methods
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.started_sequence = None
+    self.result = None
+
+
+class FetchCoordinator(object):
+  """Fetches into local repositories only when the remote has changed."""
+
+  STATE_BASENAME = 'buildtool_fetch_state.json'
+
+  def __init__(self, git):
+    """Constructor.
+
+    Args:
+      git: [GitRunner] Used to run the git commands.
+    """
+    self.__git = git
+    self.__lock = threading.Lock()
+    self.__states = {}  # (git_dir, command) to _FetchState
+    self.__sequence = 0
+
+  def __next_sequence(self):
+    with self.__lock:
+      self.__sequence += 1
+      return self.__sequence
+
+  def __fetch_state(self, key):
+    with self.__lock:
+      state = self.__states.get(key)
+      if state is None:
+        state = _FetchState()
+        self.__states[key] = state
+    return state
+
+  def fetch(self, git_dir, remote_name='origin', fetch_args='--tags'):
+    """Fetch from the remote into git_dir, unless nothing changed.
+
+    Args:
+      git_dir: [path] The local repository, which may be bare.
+      remote_name: [string] The remote to fetch from.
+      fetch_args: [string] Additional arguments to "git fetch".
+
+    Returns:
+      The output of the fetch, or '' if it was not needed.
+    """
+    command = 'fetch {remote} {args}'.format(remote=remote_name,
+                                             args=fetch_args).strip()
+    requested_sequence = self.__next_sequence()
+    state = self.__fetch_state((os.path.abspath(git_dir), command))
+    with state.lock:
+      if (state.started_sequence is not None
+          and state.started_sequence > requested_sequence):
+        logging.debug('Reusing the concurrent "%s" in %s', command, git_dir)
+        self.__record_metrics('coalesced', 0, 0)
+        return state.result
+
+      # Only publish the fetch once it succeeds, otherwise the waiters
+      # coalesced onto it would take the failure to be up to date.
+      started_sequence = self.__next_sequence()
+      result = self.__fetch_if_changed(git_dir, remote_name, command)
+      state.started_sequence = started_sequence
+      state.result = result
+      return result
+
+  def __state_path(self, git_dir):
+    dot_git = os.path.join(git_dir, '.git')
+    return os.path.join(dot_git if os.path.isdir(dot_git) else git_dir,
+                        self.STATE_BASENAME)
+
+  def __load_state(self, path):
+    if not os.path.exists(path):
+      return {}
+    try:
+      with open(path, 'r') as stream:
+        return json.load(stream)
+    except (IOError, ValueError) as ex:
+      logging.warning('Ignoring unreadable fetch state %s: %s', path, ex)
+      return {}
+
+  def __save_state(self, path, data):
+    tmp_path = path + '.tmp'
+    try:
+      with open(tmp_path, 'w') as stream:
+        json.dump(data, stream)
+      os.rename(tmp_path, path)
+    except (IOError, OSError) as ex:
+      logging.warning('Could not write fetch state %s: %s', path, ex)
+
+  def __remote_url(self, git_dir, remote_name):
+    query = LocalRepositoryQueryRegistry.get(git_dir)
+    remote_urls = query.query_remote_urls() if query else None
+    if remote_urls is not None and remote_name in remote_urls:
+      return remote_urls[remote_name]
+    return self.__git.check_run(git_dir, 'remote get-url ' + remote_name)
+
+  def __remote_fingerprint(self, url):
+    refs = self.__git.remote_refs().query_refs(url)
+    text = '\n'.join(sorted(['{0} {1}'.format(commit, name)
+                             for name, commit in refs.items()]))
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+  def __local_fingerprint(self, git_dir):
+    query = LocalRepositoryQueryRegistry.get(git_dir)
+    if query is not None:
+      text = '\n'.join(sorted(['{0} {1}'.format(object_id, name)
+                               for name, object_id
+                               in query.list_refs().items()]))
+    else:
+      text = self.__git.check_run(
+          git_dir, 'for-each-ref --format="%(objectname) %(refname)"')
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+  def __object_kib(self, git_dir):
+    """Returns the KiB used by the repository's own objects."""
+    stdout = self.__git.check_run(git_dir, 'count-objects -v')
+    total = 0
+    for line in stdout.split('\n'):
+      name, _, value = line.partition(':')
+      if name.strip() in ['size', 'size-pack']:
+        total += int(value.strip())
+    return total
+
+  def __fetch_if_changed(self, git_dir, remote_name, command):
+    start_time = time.time()
+    path = self.__state_path(git_dir)
+    data = self.__load_state(path)
+    remote_url = self.__remote_url(git_dir, remote_name)
+    remote_fingerprint = self.__remote_fingerprint(remote_url)
+    if data.get(command) == [remote_fingerprint,
+                             self.__local_fingerprint(git_dir)]:
+      logging.debug('Skipping "%s" in %s because nothing changed.',
+                    command, git_dir)
+      self.__record_metrics('unchanged', time.time() - start_time, 0)
+      return ''
+
+    before_kib = self.__object_kib(git_dir)
+    result = self.__git.check_network_run(git_dir, command)
+    fetched_kib = max(0, self.__object_kib(git_dir) - before_kib)
+    self.__git.remote_refs().invalidate(remote_url)
+
+    data[command] = [remote_fingerprint, self.__local_fingerprint(git_dir)]
+    self.__save_state(path, data)
+    self.__record_metrics('fetched', time.time() - start_time,
+                          fetched_kib * 1024)
+    return result
+
+  @staticmethod
+  def __record_metrics(outcome, secs, fetched_bytes):
+    metrics = MetricsManager.singleton()
+    labels = {'outcome': outcome}
+    metrics.inc_counter('GitFetch', labels)
+    metrics.observe_timer('GitFetch_Time', labels, secs)
+    if fetched_bytes:
+      metrics.inc_counter('GitFetch_Bytes', {}, amount=fetched_bytes)
@@ -0,0 +1,124 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Persistent bare mirrors of the repositories that buildtool clones.
+
+Each buildtool invocation clones the repositories it works on into a fresh
+directory. Rather than fetching the full history of each from the remote
+every time, the GitMirrorCache keeps one bare mirror per origin that is
+brought up to date with a single fetch. Clones then borrow the mirror's
+objects through git alternates ("clone --reference") so they only need
+to transfer (and store) what the mirror does not already have.
+
+Because the clones refer to the mirror's objects, the mirror directory
+must outlive the clones made from it.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import threading
+
+from buildtool import (
+    ensure_dir_exists,
+    exception_to_message)
+
+
+class GitMirrorCache(object):
+  """Maintains a bare mirror of each remote repository to clone from."""
+
+  @property
+  def mirror_dir(self):
+    return self.__mirror_dir
+
+  def __init__(self, git, mirror_dir):
+    """Constructor.
+
+    Args:
+      git: [GitRunner] Used to run the git commands that maintain mirrors.
+      mirror_dir: [path] The directory holding the mirrors.
+    """
+    self.__git = git
+    self.__mirror_dir = mirror_dir
+    self.__lock = threading.Lock()
+    self.__path_locks = {}
+    self.__refreshed = set([])  # Mirrors already updated by this process.
+
+  def mirror_path(self, normalized_url):
+    """Returns the path to the mirror for the given repository.
+
+    Args:
+      normalized_url: [tuple or string] The GitRunner.normalize_repo_url
+         so that ssh and https urls for a repository share a mirror.
+    """
+    if isinstance(normalized_url, tuple):
+      return os.path.join(self.__mirror_dir, *normalized_url) + '.git'
+
+    # A local path, typically for testing.
+    digest = hashlib.sha1(normalized_url.encode('utf-8')).hexdigest()
+    return os.path.join(
+        self.__mirror_dir, 'local',
+        '{0}-{1}.git'.format(os.path.basename(normalized_url), digest[:12]))
+
+  def __path_lock(self, path):
+    with self.__lock:
+      lock = self.__path_locks.get(path)
+      if lock is None:
+        lock = threading.Lock()
+        self.__path_locks[path] = lock
+    return lock
+
+  def ensure_mirror(self, pull_url, normalized_url):
+    """Create or update the mirror for the repository.
+
+    The mirror is updated at most once per process, so later clones of the
+    same repository do not contact the remote again here.
+
+    Returns:
+      The path to the mirror or None if it could not be made current.
+    """
+    path = self.mirror_path(normalized_url)
+    with self.__path_lock(path):
+      if path in self.__refreshed:
+        return path
+      try:
+        if os.path.exists(os.path.join(path, 'HEAD')):
+          logging.debug('Updating mirror %s from %s', path, pull_url)
+          self.__git.fetch_coordinator().fetch(path, 'origin', '--prune --tags')
+        else:
+          self.__create_mirror(pull_url, path)
+      except Exception as ex:
+        logging.warning('Cloning %s without mirror %s: %s',
+                        pull_url, path, exception_to_message(ex))
+        return None
+      self.__refreshed.add(path)
+    return path
+
+  def __create_mirror(self, pull_url, path):
+    logging.info('Creating mirror of %s in %s', pull_url, path)
+    parent_dir = os.path.dirname(path)
+    ensure_dir_exists(parent_dir)
+
+    # Build the mirror aside so an interrupted clone is not mistaken for one.
+    tmp_path = path + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    self.__git.check_network_run(
+        parent_dir, 'clone --bare {url} {dir}'.format(url=pull_url,
+                                                      dir=tmp_path))
+    # A bare clone does not track the remote branches, so later fetches
+    # would not update them otherwise.
+    self.__git.check_run(
+        tmp_path, 'config remote.origin.fetch "+refs/heads/*:refs/heads/*"')
+    os.rename(tmp_path, path)
@@ -0,0 +1,332 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Answers read-only queries about a local repository without forking git.
+
+Most of what buildtool asks a local repository (the HEAD commit, the
+current branch, the tags, the remotes) is a matter of reading a few small
+files in the .git directory. The LocalRepositoryQuery reads these directly
+and, for questions that need the object database such as peeling an
+annotated tag, keeps a single "git cat-file --batch-check" process per
+repository rather than forking git for each question.
+
+Nothing is cached other than the parsed packed-refs file, which is reread
+whenever its modification time, size or inode changes, so answers are
+always current.
+"""
+
+import atexit
+import logging
+import os
+import re
+import subprocess
+import threading
+
+
+class LocalRepositoryQuery(object):
+  """Reads the refs and config of a local repository directly."""
+
+  # Matches a config section header such as [remote "origin"].
+  _CONFIG_SECTION_MATCHER = re.compile(r'^\[\s*([^\s\]"]+)(?:\s+"(.*)")?\s*\]')
+
+  @staticmethod
+  def find_dot_git(git_dir):
+    """Returns the repository's .git directory or None if not a plain clone.
+
+    Worktrees, submodules and other layouts are left to git itself.
+    """
+    dot_git = os.path.join(git_dir, '.git')
+    if not (os.path.isdir(dot_git)
+            and os.path.exists(os.path.join(dot_git, 'HEAD'))):
+      return None
+    for unsupported in ['commondir', 'reftable']:
+      if os.path.exists(os.path.join(dot_git, unsupported)):
+        return None
+    return dot_git
+
+  @property
+  def git_dir(self):
+    return self.__git_dir
+
+  @property
+  def dot_git_inode(self):
+    """Identifies the .git directory in case the repository is recreated."""
+    return self.__dot_git_inode
+
+  def __init__(self, git_dir, dot_git):
+    """Constructor.
+
+    Args:
+      git_dir: [path] The local repository.
+      dot_git: [path] The repository's find_dot_git directory.
+    """
+    self.__git_dir = git_dir
+    self.__dot_git = dot_git
+    self.__dot_git_inode = os.stat(dot_git).st_ino
+    self.__lock = threading.Lock()
+    self.__packed_refs = {}
+    self.__packed_peeled = {}
+    self.__packed_refs_key = None
+    self.__cat_file = None
+
+  def close(self):
+    """Stop the cat-file process, if one was started."""
+    with self.__lock:
+      process = self.__cat_file
+      self.__cat_file = None
+    if process is not None:
+      process.stdin.close()
+      process.wait()
+      process.stdout.close()
+
+  @staticmethod
+  def __discard_process(process):
+    """Reap a cat-file process that stopped responding."""
+    # pylint: disable=broad-except
+    try:
+      process.kill()
+    except Exception:
+      pass
+    process.wait()
+    for stream in [process.stdin, process.stdout]:
+      try:
+        stream.close()
+      except Exception:
+        pass
+
+  def __read_file(self, *path_parts):
+    try:
+      with open(os.path.join(self.__dot_git, *path_parts), 'r') as stream:
+        return stream.read()
+    except IOError:
+      return None
+
+  def __stat_packed_refs(self):
+    """Identifies the current packed-refs file, or None if there is none.
+
+    The modification time alone is not enough on filesystems with coarse
+    timestamps, where the file may be rewritten within the same second.
+    """
+    try:
+      stat = os.stat(os.path.join(self.__dot_git, 'packed-refs'))
+    except OSError:
+      return None
+    return (getattr(stat, 'st_mtime_ns', stat.st_mtime),
+            stat.st_size, stat.st_ino)
+
+  def __load_packed_refs(self):
+    key = self.__stat_packed_refs()
+    with self.__lock:
+      if key == self.__packed_refs_key:
+        return self.__packed_refs, self.__packed_peeled
+
+    refs = {}
+    peeled = {}
+    text = self.__read_file('packed-refs') or ''
+    last_ref = None
+    for line in text.split('\n'):
+      if not line or line.startswith('#'):
+        continue
+      if line.startswith('^'):
+        if last_ref:
+          peeled[last_ref] = line[1:].strip()
+        continue
+      commit_id, _, last_ref = line.strip().partition(' ')
+      refs[last_ref] = commit_id
+
+    with self.__lock:
+      self.__packed_refs = refs
+      self.__packed_peeled = peeled
+      self.__packed_refs_key = key
+    return refs, peeled
+
+  def list_refs(self, prefix='refs/'):
+    """Returns a dictionary of the object id of each ref under the prefix.
+
+    As with "git show-ref", annotated tags are not peeled.
+    """
+    packed, _ = self.__load_packed_refs()
+    refs = {name: object_id for name, object_id in packed.items()
+            if name.startswith(prefix)}
+
+    # Loose refs take precedence over packed ones.
+    base_dir = os.path.join(self.__dot_git, 'refs')
+    for dir_path, _, filenames in os.walk(base_dir):
+      for filename in filenames:
+        path = os.path.join(dir_path, filename)
+        name = 'refs/' + os.path.relpath(path, base_dir).replace(os.sep, '/')
+        if not name.startswith(prefix) or filename.endswith('.lock'):
+          continue
+        object_id = (self.__read_file(*name.split('/')) or '').strip()
+        if not object_id or object_id.startswith('ref: '):
+          # Either removed since the walk, or a symbolic ref such as
+          # refs/remotes/origin/HEAD.
+          continue
+        refs[name] = object_id
+    return refs
+
+  def resolve_ref(self, name):
+    """Returns the object id the full refname refers to, or None."""
+    content = self.__read_file(*name.split('/'))
+    if content is not None:
+      content = content.strip()
+      if content.startswith('ref: '):
+        return self.resolve_ref(content[5:])
+      return content
+    packed, _ = self.__load_packed_refs()
+    return packed.get(name)
+
+  def query_head(self):
+    """Returns the (symbolic ref or None, commit id or None) for HEAD."""
+    content = (self.__read_file('HEAD') or '').strip()
+    if content.startswith('ref: '):
+      symbolic = content[5:]
+      return symbolic, self.resolve_ref(symbolic)
+    return None, content or None
+
+  def query_remote_urls(self):
+    """Returns a dictionary of the fetch url of each remote.
+
+    Returns None if the config rewrites urls, which is left to git.
+    """
+    urls = {}
+    section = None
+    text = self.__read_file('config') or ''
+    if text.lower().find('insteadof') >= 0:
+      return None
+    for line in text.split('\n'):
+      line = line.strip()
+      match = self._CONFIG_SECTION_MATCHER.match(line)
+      if match:
+        section = (match.group(1).lower(), match.group(2))
+        continue
+      if section is None or section[0] != 'remote' or not section[1]:
+        continue
+      key, _, value = line.partition('=')
+      if key.strip().lower() == 'url':
+        urls.setdefault(section[1], value.strip())
+    return urls
+
+  def __start_cat_file(self):
+    return subprocess.Popen(
+        ['git', '-C', self.__git_dir, 'cat-file', '--batch-check'],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        universal_newlines=True)
+
+  def __ask_cat_file(self, request):
+    """Returns the cat-file response to the request, or None if it failed.
+
+    If the cat-file process has died, it is restarted once.
+    The caller must hold the lock.
+    """
+    for _ in range(2):
+      process = self.__cat_file
+      try:
+        if process is None:
+          process = self.__start_cat_file()
+          self.__cat_file = process
+        process.stdin.write(request + '\n')
+        process.stdin.flush()
+        response = process.stdout.readline()
+        if response:
+          return response.strip()
+        logging.debug('cat-file in %s exited', self.__git_dir)
+      except (IOError, OSError) as ex:
+        # e.g. BrokenPipeError if the process died.
+        logging.debug('cat-file in %s failed: %s', self.__git_dir, ex)
+      self.__cat_file = None
+      if process is not None:
+        self.__discard_process(process)
+    return None
+
+  def __rev_parse_commit(self, name):
+    """Returns the commit id for the name using "git rev-parse", or None."""
+    process = subprocess.Popen(
+        ['git', '-C', self.__git_dir, 'rev-parse', '--verify', '--quiet',
+         name + '^{commit}'],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    stdout, _ = process.communicate()
+    if process.returncode != 0:
+      logging.debug('%s has no commit "%s"', self.__git_dir, name)
+      return None
+    return stdout.strip()
+
+  def peel_to_commit(self, name):
+    """Returns the commit id that the revision name refers to, or None.
+
+    This asks the repository's "cat-file --batch-check" process, starting
+    it if necessary, and falls back on "git rev-parse" if that fails.
+    """
+    with self.__lock:
+      response = self.__ask_cat_file(name + '^{commit}')
+    if response is None:
+      return self.__rev_parse_commit(name)
+
+    parts = response.split(' ')
+    if len(parts) != 3 or parts[1] != 'commit':
+      logging.debug('%s has no commit "%s": %s',
+                    self.__git_dir, name, response)
+      return None
+    return parts[0]
+
+
+class LocalRepositoryQueryRegistry(object):
+  """Shares a LocalRepositoryQuery for each repository within the process."""
+
+  __QUERIES = {}
+  __LOCK = threading.Lock()
+
+  @staticmethod
+  def get(git_dir):
+    """Returns the LocalRepositoryQuery for git_dir, or None if unsupported."""
+    dot_git = LocalRepositoryQuery.find_dot_git(git_dir)
+    if dot_git is None:
+      return None
+    key = os.path.abspath(git_dir)
+    stale = None
+    with LocalRepositoryQueryRegistry.__LOCK:
+      query = LocalRepositoryQueryRegistry.__QUERIES.get(key)
+      if query is not None and query.dot_git_inode != os.stat(dot_git).st_ino:
+        # The repository was removed and cloned again since.
+        stale = query
+        query = None
+      if query is None:
+        query = LocalRepositoryQuery(key, dot_git)
+        LocalRepositoryQueryRegistry.__QUERIES[key] = query
+    if stale is not None:
+      stale.close()
+    return query
+
+  @staticmethod
+  def close_all():
+    """Stop all the cat-file processes."""
+    with LocalRepositoryQueryRegistry.__LOCK:
+      queries = list(LocalRepositoryQueryRegistry.__QUERIES.values())
+      LocalRepositoryQueryRegistry.__QUERIES.clear()
+    for query in queries:
+      query.close()
+
+  @staticmethod
+  def forget_all():
+    """Drop the queries without stopping their cat-file processes.
+
+    This is for a forked child process, whose inherited queries are talking
+    to cat-file processes that belong to its parent.
+    """
+    with LocalRepositoryQueryRegistry.__LOCK:
+      LocalRepositoryQueryRegistry.__QUERIES.clear()
+
+
+atexit.register(LocalRepositoryQueryRegistry.close_all)
@@ -0,0 +1,161 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Resolves the branches and tags of remote repositories.
+
+Asking a remote repository what a branch points to used to take a separate
+"git ls-remote" (and TLS session) per question. The RemoteRefResolver
+instead lists all the heads and tags of a repository once, answers later
+questions about that repository from memory, and can list many
+repositories concurrently up front using the shared RepositoryExecutor.
+
+The refs can also be remembered on disk for a short time so that commands
+run back to back do not need to ask again.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from buildtool import add_parser_argument
+from buildtool.repository_executor import RepositoryExecutor
+
+
+class RemoteRefResolver(object):
+  """Caches the heads and tags of remote repositories."""
+
+  @staticmethod
+  def add_parser_args(parser, defaults):
+    """Add the parser options used by the RemoteRefResolver."""
+    if hasattr(parser, 'added_remote_ref_resolver'):
+      return
+    parser.added_remote_ref_resolver = True
+
+    add_parser_argument(
+        parser, 'git_remote_refs_cache_path', defaults, None,
+        help='If set, remember the refs of remote repositories in this file'
+             ' so later commands can reuse them.')
+    add_parser_argument(
+        parser, 'git_remote_refs_cache_ttl_secs', defaults, 300, type=int,
+        help='How long the refs in --git_remote_refs_cache_path'
+             ' remain valid.')
+
+  def __init__(self, git, cache_path=None, ttl_secs=300, max_threads=16):
+    """Constructor.
+
+    Args:
+      git: [GitRunner] Used to query the remote repositories.
+      cache_path: [path] If set, a file to remember the refs in.
+      ttl_secs: [int] How long the refs in the cache_path remain valid.
+      max_threads: [int] The number of repositories to list concurrently.
+    """
+    self.__git = git
+    self.__cache_path = cache_path
+    self.__ttl_secs = ttl_secs
+    self.__max_threads = max_threads
+    self.__lock = threading.Lock()
+    self.__url_locks = {}
+    self.__url_refs = {}  # url to (timestamp, {ref: commit})
+    self.__load()
+
+  def __load(self):
+    if not self.__cache_path or not os.path.exists(self.__cache_path):
+      return
+    try:
+      with open(self.__cache_path, 'r') as stream:
+        entries = json.load(stream)
+    except (IOError, ValueError) as ex:
+      logging.warning('Ignoring unreadable remote refs cache %s: %s',
+                      self.__cache_path, ex)
+      return
+
+    oldest = time.time() - self.__ttl_secs
+    self.__url_refs = {url: (timestamp, refs)
+                       for url, (timestamp, refs) in entries.items()
+                       if timestamp >= oldest}
+    logging.debug('Reusing remote refs for %d repositories from %s',
+                  len(self.__url_refs), self.__cache_path)
+
+  def save(self):
+    """Write the known refs to the cache_path, if any."""
+    if not self.__cache_path:
+      return
+    with self.__lock:
+      entries = dict(self.__url_refs)
+    tmp_path = self.__cache_path + '.tmp'
+    with open(tmp_path, 'w') as stream:
+      json.dump(entries, stream)
+    os.rename(tmp_path, self.__cache_path)
+
+  def __url_lock(self, url):
+    with self.__lock:
+      lock = self.__url_locks.get(url)
+      if lock is None:
+        lock = threading.Lock()
+        self.__url_locks[url] = lock
+    return lock
+
+  def query_refs(self, url):
+    """Returns a dictionary of the commit for each head and tag at the url."""
+    with self.__url_lock(url):
+      with self.__lock:
+        entry = self.__url_refs.get(url)
+      if entry is None:
+        entry = (time.time(), self.__git.query_remote_refs(url))
+        with self.__lock:
+          self.__url_refs[url] = entry
+    return entry[1]
+
+  def prefetch(self, urls):
+    """List all the repositories at the urls concurrently."""
+    with self.__lock:
+      missing = sorted(set([url for url in urls
+                            if url not in self.__url_refs]))
+    if missing:
+      logging.debug('Listing refs of %d remote repositories', len(missing))
+      # Each listing also holds a GIT_NETWORK_RESOURCE slot while it runs.
+      outcomes = RepositoryExecutor.singleton().map_unordered(
+          self.query_refs, missing, name_func=lambda url: url,
+          max_concurrency=self.__max_threads)
+      failures = [outcome for outcome in outcomes if not outcome.ok]
+      if failures:
+        raise failures[0].error
+    self.save()
+
+  def resolve(self, url, name):
+    """Returns the commit for a branch or tag at the url, or None if unknown.
+
+    Args:
+      url: [string] The remote repository.
+      name: [string] Either a full refname or a branch or tag name.
+         Branches take precedence over tags of the same name.
+    """
+    refs = self.query_refs(url)
+    for ref in [name, 'refs/heads/' + name, 'refs/tags/' + name]:
+      if ref in refs:
+        return refs[ref]
+    return None
+
+  def invalidate(self, url):
+    """Forget the refs for the url, such as after pushing to it.
+
+    This also removes them from the cache_path, if any, so that later
+    commands do not reuse them either.
+    """
+    with self.__lock:
+      known = self.__url_refs.pop(url, None) is not None
+    if known:
+      self.save()
@@ -0,0 +1,120 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Remembers the repository summaries computed for a local repository.
+
+A RepositorySummary only depends on the commit being summarized, the
+version tags, the remote branches used to tell which release branch a
+tag is on, and the optional base commit. Several commands summarize the
+same commit, so the summary is kept in the repository's .git directory
+keyed by a fingerprint of all of these. The summary is then reused by
+later commands and runs until one of them changes.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+
+class RepositorySummaryCache(object):
+  """Caches the summary dictionaries of a local repository."""
+
+  FORMAT_VERSION = 1
+  CACHE_BASENAME = 'buildtool_summary_cache.json'
+
+  # Keep this many of the most recently computed summaries.
+  MAX_ENTRIES = 16
+
+  def __init__(self, git, git_dir):
+    """Constructor.
+
+    Args:
+      git: [GitRunner] Used to query the repository refs.
+      git_dir: [path] The local repository.
+    """
+    self.__git = git
+    self.__git_dir = git_dir
+    self.__lock = threading.Lock()
+    self.__entries = {}  # key to summary dictionary
+    self.__order = []    # keys from least to most recently added
+
+    dot_git = os.path.join(git_dir, '.git')
+    self.__cache_path = (os.path.join(dot_git, self.CACHE_BASENAME)
+                         if os.path.isdir(dot_git)
+                         else None)
+    self.__load()
+
+  def __load(self):
+    if not self.__cache_path or not os.path.exists(self.__cache_path):
+      return
+    try:
+      with open(self.__cache_path, 'r') as stream:
+        data = json.load(stream)
+      if data.get('version') != self.FORMAT_VERSION:
+        return
+      for key, summary in data['entries']:
+        self.__entries[key] = summary
+        self.__order.append(key)
+    except (IOError, ValueError, KeyError) as ex:
+      logging.warning('Ignoring unreadable summary cache %s: %s',
+                      self.__cache_path, ex)
+      self.__entries = {}
+      self.__order = []
+
+  def __save(self):
+    if not self.__cache_path:
+      return
+    data = {'version': self.FORMAT_VERSION,
+            'entries': [[key, self.__entries[key]] for key in self.__order]}
+    tmp_path = self.__cache_path + '.tmp'
+    try:
+      with open(tmp_path, 'w') as stream:
+        json.dump(data, stream, separators=(',', ':'))
+      os.rename(tmp_path, self.__cache_path)
+    except (IOError, OSError) as ex:
+      logging.warning('Could not write summary cache %s: %s',
+                      self.__cache_path, ex)
+
+  def make_key(self, commit_id, base_commit_id=None):
+    """Returns the key for summarizing commit_id in the repository's state.
+
+    The key changes when any version tag or remote branch does.
+    """
+    stdout = self.__git.check_run(
+        self.__git_dir,
+        'for-each-ref --format="%(objectname) %(*objectname) %(refname)"'
+        ' refs/tags/version-* refs/remotes/')
+    digest = hashlib.sha1()
+    for part in [commit_id, base_commit_id or '', stdout]:
+      digest.update(part.encode('utf-8'))
+      digest.update(b'\0')
+    return digest.hexdigest()
+
+  def lookup(self, key):
+    """Returns the summary dictionary for the key or None if not known."""
+    with self.__lock:
+      return self.__entries.get(key)
+
+  def record(self, key, summary):
+    """Remember the summary dictionary for the key."""
+    with self.__lock:
+      if key in self.__entries:
+        self.__order.remove(key)
+      self.__entries[key] = summary
+      self.__order.append(key)
+      while len(self.__order) > self.MAX_ENTRIES:
+        del self.__entries[self.__order.pop(0)]
+      self.__save()
@@ -23,6 +23,7 @@ import logging
 import os
 import re
 import tempfile
+import threading
 import time
 
 # pylint: disable=no-name-in-module
@@ -40,7 +41,17 @@ from buildtool import (
     raise_and_log_error,
     ConfigError,
     ExecutionError,
-    UnexpectedError)
+    UnexpectedError,
+    GIT_NETWORK_RESOURCE,
+    RepositoryExecutor)
+
+from buildtool.commit_classifier import CommitClassifier
+from buildtool.git_commit_graph import CommitGraphIndex
+from buildtool.git_fetch import FetchCoordinator
+from buildtool.git_mirror import GitMirrorCache
+from buildtool.git_refs import LocalRepositoryQueryRegistry
+from buildtool.git_remote_refs import RemoteRefResolver
+from buildtool.git_summary_cache import RepositorySummaryCache
 
 
 class GitRepositorySpec(object):
@@ -296,6 +307,11 @@ class CommitMessage(
     collections.namedtuple('CommitMessage',
                            ['commit_id', 'author', 'date', 'message'])):
   """Denotes an individual entry in 'git log --pretty'."""
+  # The fields of each entry in "git log -z --format=<LOG_FORMAT>".
+  # These are NUL delimited, as are the entries themselves.
+  LOG_FORMAT = '%H%x00%an <%ae>%x00%ad%x00%B'
+  _LOG_FORMAT_FIELD_COUNT = 4
+
   _MEDIUM_PRETTY_COMMIT_MATCHER = re.compile(
       '(.+)\n(?:Merge: .*?\n)?Author: *(.+)\nDate: *(.*)\n', re.MULTILINE)
 
@@ -341,6 +357,12 @@ class CommitMessage(
                  re.MULTILINE)
   ]
 
+  _SEMVER_LEVEL_INDEX = {
+      CommitClassifier.MAJOR: SemanticVersion.MAJOR_INDEX,
+      CommitClassifier.MINOR: SemanticVersion.MINOR_INDEX,
+      CommitClassifier.PATCH: SemanticVersion.PATCH_INDEX
+  }
+
   @staticmethod
   def make_list_from_result(response_text):
     """Returns a list of CommitMessage from the command response.
@@ -354,6 +376,52 @@ class CommitMessage(
       response.append(CommitMessage.make(entry))
     return response
 
+  @staticmethod
+  def iter_formatted_log(response_text):
+    """Yields the CommitMessage for each entry in the command response.
+
+    Unlike make_list_from_result, this walks the response once and does not
+    need to match each entry against a pattern.
+
+    Args:
+      response_text: [string] result of "git log -z --format=<LOG_FORMAT>"
+    """
+    field_count = CommitMessage._LOG_FORMAT_FIELD_COUNT
+    fields = []
+    start = 0
+    end = len(response_text)
+    while start < end:
+      stop = response_text.find('\0', start)
+      if stop < 0:
+        stop = end
+      fields.append(response_text[start:stop])
+      start = stop + 1
+      if len(fields) == field_count:
+        yield CommitMessage.make_from_fields(*fields)
+        fields = []
+
+    if fields and ''.join(fields).strip():
+      raise_and_log_error(
+          UnexpectedError('Unexpected commit entry {0}'.format(fields)))
+
+  @staticmethod
+  def make_list_from_formatted_log(response_text):
+    """Returns a list of CommitMessage from the command response.
+
+    Args:
+      response_text: [string] result of "git log -z --format=<LOG_FORMAT>"
+    """
+    return list(CommitMessage.iter_formatted_log(response_text))
+
+  @staticmethod
+  def make_from_fields(commit_id, author, date, body):
+    """Create a new CommitMessage from the LOG_FORMAT fields of an entry."""
+    # Indent the body the way "--pretty=medium" does so that the messages
+    # are the same regardless of which format they were read from.
+    text = '\n'.join(['    ' + line for line in body.split('\n')])
+    return CommitMessage._make_with_text(
+        commit_id.strip(), author, date, text)
+
   @staticmethod
   def make(entry):
     """Create a new CommitMessage from an individual entry"""
@@ -362,8 +430,13 @@ class CommitMessage(
       raise_and_log_error(
           UnexpectedError('Unexpected commit entry {0}'.format(entry)))
 
-    text = entry[match.end(3):]
+    return CommitMessage._make_with_text(
+        match.group(1), match.group(2), match.group(3),
+        entry[match.end(3):])
 
+  @staticmethod
+  def _make_with_text(commit_id, author, date, text):
+    """Create a new CommitMessage with the message text cleaned up."""
     # strip trailing spaces on each line
     lines = [line.rstrip() for line in text.split('\n')]
 
@@ -376,7 +449,7 @@ class CommitMessage(
     # new string may have initial spacing but no leading/trailing blank lines.
     text = '\n'.join(lines)
 
-    return CommitMessage(match.group(1), match.group(2), match.group(3), text)
+    return CommitMessage(commit_id, author, date, text)
 
   @staticmethod
   def normalize_message_list(msg_list):
@@ -401,7 +474,9 @@ class CommitMessage(
     result = []
     for commit_message in msg_list:
       text = commit_message.message
-      found = CommitMessage._EMBEDDED_COMMIT_MATCHER.search(text)
+      found = (CommitMessage._EMBEDDED_COMMIT_MATCHER.search(text)
+               if text.find('commit ') >= 0
+               else None)
       if not found:
         result.append(commit_message)
         continue
@@ -498,6 +573,16 @@ class CommitMessage(
       The SemanticVersion.*_INDEX of the affected idealized version component
       that will need to be incremented to accomodate this change.
     """
+    if major_regexs is None and minor_regexs is None and patch_regexs is None:
+      # The defaults are what the CommitClassifier implements.
+      level = CommitClassifier.classify(self).level
+      if level is None:
+        logging.debug('Commit is considered #%d by DEFAULT: message was "%s"',
+                      default_semver_index, self.message)
+        return default_semver_index
+      logging.debug('Commit %s is considered "%s"', self.commit_id, level)
+      return self._SEMVER_LEVEL_INDEX[level]
+
     def is_compliant(spec):
       """Determine if the commit message satisfies the specification."""
       if not spec:
@@ -591,13 +676,17 @@ class RepositorySummary(collections.namedtuple(
                   prev=self.prev_version, current=self.version)))
     return True
 
+  def to_dict(self):
+    """Convert the summary to a dictionary that from_dict accepts."""
+    data = dict(self._asdict())
+    data['commit_messages'] = [dict(m._asdict())
+                               for m in data['commit_messages']]
+    return data
+
   def to_yaml(self, with_commit_messages=True):
     """Convert the summary to a yaml string."""
-    data = dict(self._asdict())
-    if with_commit_messages:
-      data['commit_messages'] = [dict(m._asdict())
-                                 for m in data['commit_messages']]
-    else:
+    data = self.to_dict()
+    if not with_commit_messages:
       del data['commit_messages']
 
     return yaml.safe_dump(data, default_flow_style=False)
@@ -616,11 +705,78 @@ class RepositorySummary(collections.namedtuple(
     ])
 
 
+class RefTransaction(object):
+  """A batch of ref changes to apply to a local repository all at once.
+
+  The changes are applied by GitRunner.apply_ref_transaction using a single
+  "git update-ref --stdin", so either all of them take effect or none do.
+  """
+
+  @property
+  def commands(self):
+    """The update-ref --stdin commands in the order they were added."""
+    return list(self.__commands)
+
+  def __init__(self):
+    self.__commands = []
+
+  def __len__(self):
+    return len(self.__commands)
+
+  def create(self, ref, new_value):
+    """Create the ref, failing if it already exists."""
+    self.__commands.append('create {0} {1}'.format(ref, new_value))
+
+  def update(self, ref, new_value, old_value=None):
+    """Set the ref, failing if old_value is given and no longer current."""
+    old_values = [old_value] if old_value else []
+    self.__commands.append(' '.join(['update', ref, new_value] + old_values))
+
+  def delete(self, ref, old_value=None):
+    """Delete the ref, failing if old_value is given and no longer current."""
+    old_values = [old_value] if old_value else []
+    self.__commands.append(' '.join(['delete', ref] + old_values))
+
+  def to_stdin_text(self):
+    """Returns the input for "git update-ref --stdin"."""
+    return ''.join([command + '\n' for command in self.__commands])
+
+
 class GitRunner(object):
   """Helper class for interacting with Git"""
 
   __GITHUB_TOKEN = None
 
+  # When a shallow clone needs more history, it is first deepened by this
+  # many commits then by increasingly more up to the max before giving up
+  # and fetching all of it.
+  SHALLOW_DEEPEN_INITIAL_DEPTH = 32
+  SHALLOW_DEEPEN_MAX_DEPTH = 2048
+
+  # Commit graph indexes keyed by absolute git_dir path.
+  # These are shared across GitRunner instances within the process.
+  __COMMIT_GRAPHS = {}
+  __COMMIT_GRAPHS_LOCK = threading.Lock()
+
+  # The --git_clone_policy values.
+  CLONE_POLICIES = ['full', 'blobless', 'shallow']
+
+  # Mirror caches keyed by absolute mirror directory.
+  __MIRROR_CACHES = {}
+  __MIRROR_CACHES_LOCK = threading.Lock()
+
+  # RepositorySummaryCaches keyed by absolute git_dir path.
+  __SUMMARY_CACHES = {}
+  __SUMMARY_CACHES_LOCK = threading.Lock()
+
+  # RemoteRefResolvers keyed by cache path.
+  __REMOTE_REF_RESOLVERS = {}
+  __REMOTE_REF_RESOLVERS_LOCK = threading.Lock()
+
+  # The FetchCoordinator shared within the process.
+  __FETCH_COORDINATOR = None
+  __FETCH_COORDINATOR_LOCK = threading.Lock()
+
   @staticmethod
   def add_parser_args(parser, defaults):
     """Add standard parser options used by GitRunner."""
@@ -655,6 +811,21 @@ class GitRunner(object):
         help='If True then do not require a baseline tag when searching back'
              ' from a commit to the previous version. Normally this would not'
              ' be allowed.')
+    add_parser_argument(
+        parser, 'git_clone_policy', defaults, 'blobless',
+        choices=GitRunner.CLONE_POLICIES,
+        help='How much of each repository to clone.'
+             ' "full" clones all the history and file content.'
+             ' "blobless" clones all the history but only fetches file content'
+             ' as it is checked out. "shallow" clones just the branch head and'
+             ' fetches more history only when it is needed.')
+    add_parser_argument(
+        parser, 'git_mirror_dir', defaults, None,
+        help='If set, keep a bare mirror of each repository in this directory'
+             ' and clone by reference to it so that clones only fetch what'
+             ' the mirror does not already have. Clones depend on the mirror'
+             ' so it must not be removed while they are in use.')
+    RemoteRefResolver.add_parser_args(parser, defaults)
 
   @staticmethod
   def add_publishing_parser_args(parser, defaults):
@@ -751,6 +922,50 @@ class GitRunner(object):
     new_env.update(self.__auth_env)
     keyword_args_to_modify['env'] = new_env
 
+  def commit_graph(self, git_dir):
+    """Returns the up-to-date CommitGraphIndex for the local repository."""
+    key = os.path.abspath(git_dir)
+    with GitRunner.__COMMIT_GRAPHS_LOCK:
+      graph = GitRunner.__COMMIT_GRAPHS.get(key)
+      if graph is None:
+        graph = CommitGraphIndex(self, git_dir)
+        GitRunner.__COMMIT_GRAPHS[key] = graph
+    graph.refresh()
+    return graph
+
+  def mirror_cache(self):
+    """Returns the GitMirrorCache for --git_mirror_dir or None if not set."""
+    mirror_dir = self.__options.git_mirror_dir
+    if not mirror_dir:
+      return None
+    key = os.path.abspath(mirror_dir)
+    with GitRunner.__MIRROR_CACHES_LOCK:
+      cache = GitRunner.__MIRROR_CACHES.get(key)
+      if cache is None:
+        cache = GitMirrorCache(self, key)
+        GitRunner.__MIRROR_CACHES[key] = cache
+    return cache
+
+  def remote_refs(self):
+    """Returns the RemoteRefResolver shared within this process."""
+    options = self.__options
+    key = options.git_remote_refs_cache_path
+    with GitRunner.__REMOTE_REF_RESOLVERS_LOCK:
+      resolver = GitRunner.__REMOTE_REF_RESOLVERS.get(key)
+      if resolver is None:
+        resolver = RemoteRefResolver(
+            self, cache_path=key,
+            ttl_secs=options.git_remote_refs_cache_ttl_secs)
+        GitRunner.__REMOTE_REF_RESOLVERS[key] = resolver
+    return resolver
+
+  def fetch_coordinator(self):
+    """Returns the FetchCoordinator shared within this process."""
+    with GitRunner.__FETCH_COORDINATOR_LOCK:
+      if GitRunner.__FETCH_COORDINATOR is None:
+        GitRunner.__FETCH_COORDINATOR = FetchCoordinator(self)
+      return GitRunner.__FETCH_COORDINATOR
+
   def run_git(self, git_dir, command, **kwargs):
     """Wrapper around run_subprocess."""
     self.__inject_auth(kwargs)
@@ -765,6 +980,14 @@ class GitRunner(object):
         'git -C "{dir}" {command}'.format(dir=git_dir, command=command),
         **kwargs)
 
+  def check_network_run(self, git_dir, command, **kwargs):
+    """A variant of check_run for commands that talk to a remote.
+
+    These are bounded by the shared GIT_NETWORK_RESOURCE limit.
+    """
+    with RepositoryExecutor.resource_slot(GIT_NETWORK_RESOURCE):
+      return self.check_run(git_dir, command, **kwargs)
+
   def check_run_sequence(self, git_dir, commands):
     """Check a sequence of git commands.
 
@@ -809,6 +1032,10 @@ class GitRunner(object):
       base_commit_id [string]: If base_commit_id is provided then rather than
           use it ias the base commit id for determining recent commits.
     """
+    self.deepen_to_version_tag(git_dir, commit_id)
+    graph = self.commit_graph(git_dir)
+    graph.ensure_commits([commit_id])
+
     # Find the starting commit, which is most recent tag in our direct history.
     # For the example in the function docs, this would be tag 0.1.0
     retcode, most_recent_ancestor_tag = self.run_git(
@@ -820,7 +1047,8 @@ class GitRunner(object):
       start_commit = self.check_run(git_dir, 'rev-list --max-parents=0 HEAD')
     else:
       start_tag = most_recent_ancestor_tag
-      start_commit = self.check_run(git_dir, 'rev-list -n 1 ' + start_tag)
+      start_commit = (graph.query_tag_commit(start_tag)
+                      or self.__peel_to_commit(git_dir, start_tag))
 
     if start_commit == commit_id:
       logging.debug(
@@ -830,29 +1058,34 @@ class GitRunner(object):
     # Get the master commit so we can use it in the merge-base call below.
     # If we checked out some branch other than master, we might not have
     # the actual branch so cannot use the symbolic name.
-    master_commit = self.check_run(git_dir, 'show-ref origin/master').split(' ')[0]
+    master_commit = graph.resolve_ref('origin/master')
     logging.debug('  master_commit=%s may be used to locate the branch.', master_commit)
 
     # Find branch our commit is on. There could be multiple branches.
     # We'll remember them all. These should be the same in practice, but
     # could be different if a branch spawned another for some reason.
-    # We use -r here because the branches arent known to the original git clone.
-    remote_commit_branches = self.check_run(
-        git_dir, 'branch -r --contains {id}'.format(id=commit_id))
+    # We use remote branches because they arent known to the original git clone.
+    remote_commit_branches = graph.query_branches_containing(commit_id)
 
     commit_branch_nodes = set([])
-    for remote_commit_branch in remote_commit_branches.split('\n'):
-      remote_commit_branch = remote_commit_branch.strip()
+    master_ancestors = (graph.ancestors(master_commit)
+                        if master_commit else None)
+    for remote_commit_branch in remote_commit_branches:
       if not remote_commit_branch.startswith('origin/release-'):
         logging.debug('   skipping non-release branch %r', remote_commit_branch)
         continue
+      if master_commit is None:
+        logging.warning('%s has no origin/master to locate branch %s from.',
+                        git_dir, remote_commit_branch)
+        continue
 
       # Find place our branch diverges from master. We'll be using this to
       # detect if a tag we consider was after our branch. We'll do this by
       # checking if the common point between us is it is here.
-      node = self.check_run(
-          git_dir, 'merge-base {branch} {master}'.format(
-              branch=remote_commit_branch, master=master_commit))
+      node = graph.merge_base(
+          master_commit,
+          graph.resolve_ref('refs/remotes/' + remote_commit_branch),
+          first_ancestors=master_ancestors)
       commit_branch_nodes.add(node)
       logging.debug('   adding branching node=%r', node)
 
@@ -861,6 +1094,9 @@ class GitRunner(object):
 
     # Now there could be other versions that were created in branches between
     # that first commit and our commit, such as tag 0.2.0 in the above.
+    # Rather than forking "git merge-base" for each of these tags,
+    # walk the commit graph index from our commit's known ancestry.
+    commit_ancestors = graph.ancestors(commit_id)
     start_version = LooseVersion(start_tag)
     for tag_entry in reversed(sorted(commit_tags)):
       tag = tag_entry.tag
@@ -869,8 +1105,13 @@ class GitRunner(object):
         break
 
       # Find where in our commit history the branch this tag is on intersects
-      tag_intersect = self.check_run(git_dir, 'merge-base {id} {tag}'.format(
-          id=commit_id, tag=tag))
+      tag_commit = graph.query_tag_commit(tag)
+      if tag_commit and graph.has_commit(tag_commit):
+        tag_intersect = graph.merge_base(
+            commit_id, tag_commit, first_ancestors=commit_ancestors)
+      else:
+        tag_intersect = self.check_run(git_dir, 'merge-base {id} {tag}'.format(
+            id=commit_id, tag=tag))
       if tag_intersect in commit_branch_nodes:
         logging.debug('tag %s intersects branch at %s', tag, tag_intersect)
         continue
@@ -879,6 +1120,34 @@ class GitRunner(object):
 
     return start_tag, start_commit
 
+  def is_shallow_repository(self, git_dir):
+    """Determine if the local repository is a shallow clone."""
+    return self.check_run(
+        git_dir, 'rev-parse --is-shallow-repository') == 'true'
+
+  def deepen_to_version_tag(self, git_dir, commit_id='HEAD'):
+    """Fetch the history of a shallow clone back to its nearest version tag.
+
+    This has no effect on a repository that is not shallow. The history is
+    deepened in increasing steps so that recently tagged commits only fetch
+    a little more, falling back on the full history if no tag is found.
+    """
+    depth = self.SHALLOW_DEEPEN_INITIAL_DEPTH
+    while self.is_shallow_repository(git_dir):
+      retcode, _ = self.run_git(
+          git_dir, 'describe --abbrev=0 --tags --match version-* ' + commit_id)
+      if retcode == 0:
+        return
+      if depth > self.SHALLOW_DEEPEN_MAX_DEPTH:
+        logging.debug('Fetching the full history of %s', git_dir)
+        self.check_network_run(git_dir, 'fetch --unshallow origin')
+        return
+      logging.debug('Deepening %s by %d commits to find a version tag',
+                    git_dir, depth)
+      self.check_network_run(
+          git_dir, 'fetch --deepen={depth} origin'.format(depth=depth))
+      depth *= 4
+
   def query_local_repository_commits_to_existing_tag_from_id(
       self, git_dir, commit_id, commit_tags, base_commit_id=None):
     """Returns the list of commit messages to the local repository."""
@@ -888,15 +1157,47 @@ class GitRunner(object):
         git_dir, commit_id, commit_tags)
 
     base_commit = base_commit_id or found_commit
-    commit_history = self.check_run(
-        git_dir,
-        'log --pretty=medium {base_commit}..{id}'.format(
-            base_commit=base_commit, id=commit_id))
-    messages = CommitMessage.make_list_from_result(commit_history)
+    messages = self.query_commit_messages(
+        git_dir, '{base_commit}..{id}'.format(base_commit=base_commit,
+                                              id=commit_id))
     return tag, messages
 
+  def query_commit_messages(self, git_dir, revision_range):
+    """Returns the list of CommitMessage for the commits in revision_range.
+
+    The log is read in a single NUL delimited pass rather than as
+    "--pretty=medium" text so large ranges are cheap to parse.
+
+    Args:
+      git_dir: [path] The local repository.
+      revision_range: [string] A "git log" revision range, such as "A..B".
+    """
+    commit_history = self.check_run(
+        git_dir, 'log -z --format="{format}" {range}'.format(
+            format=CommitMessage.LOG_FORMAT, range=revision_range))
+    return CommitMessage.make_list_from_formatted_log(commit_history)
+
+  def __peel_to_commit(self, git_dir, revision):
+    """Returns the commit id for the revision, such as an annotated tag."""
+    query = LocalRepositoryQueryRegistry.get(git_dir)
+    commit_id = query.peel_to_commit(revision) if query else None
+    return commit_id or self.check_run(git_dir, 'rev-list -n 1 ' + revision)
+
   def query_commit_at_tag(self, git_dir, tag):
     """Return the commit for the given tag, or None if tag is not known."""
+    query = LocalRepositoryQueryRegistry.get(git_dir)
+    if query is not None:
+      # Match refs the way "git show-ref -- <tag>" would.
+      matches = sorted(
+          [(name, object_id) for name, object_id in query.list_refs().items()
+           if name == tag or name.endswith('/' + tag)])
+      if len(matches) > 1:
+        raise_and_log_error(
+            UnexpectedError('"{tag}" -> "{msg}"'.format(
+                tag=tag, msg='\n'.join(['{0} {1}'.format(object_id, name)
+                                        for name, object_id in matches]))))
+      return matches[0][1] if matches else None
+
     retcode, stdout = self.run_git(git_dir, 'show-ref -- ' + tag)
     if retcode != 0:
       return None
@@ -908,18 +1209,56 @@ class GitRunner(object):
 
   def query_local_repository_commit_id(self, git_dir):
     """Returns the current commit for the repository at git_dir."""
+    query = LocalRepositoryQueryRegistry.get(git_dir)
+    if query is not None:
+      _, commit_id = query.query_head()
+      if commit_id:
+        return commit_id
     result = self.check_run(git_dir, 'rev-parse HEAD')
     return result
 
   def query_remote_repository_commit_id(self, url, branch):
-    """Returns the current commit for the remote repository."""
+    """Returns the current commit for the remote repository.
+
+    This is answered from the remote_refs, so asking about other branches
+    of the same repository does not contact it again.
+
+    Returns:
+      The commit id or None if the branch is not known.
+    """
+    return self.remote_refs().resolve(url, branch)
+
+  def query_remote_refs(self, url):
+    """Returns a dictionary of the commit for each head and tag at the url.
+
+    Annotated tags are peeled to the commit they refer to.
+    """
     args = {}
     self.__inject_auth(args)
-    result = check_subprocess('git ls-remote %s %s' % (url, branch), **args)
-    return result.split('\t')[0]
+    with RepositoryExecutor.resource_slot(GIT_NETWORK_RESOURCE):
+      result = check_subprocess('git ls-remote --heads --tags ' + url, **args)
+
+    refs = {}
+    for line in result.split('\n'):
+      commit, _, ref = line.partition('\t')
+      if not ref:
+        continue
+      if ref.endswith('^{}'):
+        refs[ref[:-3]] = commit
+      else:
+        refs.setdefault(ref, commit)
+    return refs
 
   def query_local_repository_branch(self, git_dir):
     """Returns the branch for the repository at git_dir."""
+    query = LocalRepositoryQueryRegistry.get(git_dir)
+    if query is not None:
+      symbolic_ref, commit_id = query.query_head()
+      if symbolic_ref is None and commit_id:
+        return 'HEAD'  # detached
+      if commit_id and symbolic_ref.startswith('refs/heads/'):
+        return symbolic_ref[len('refs/heads/'):]
+
     returncode, stdout = self.run_git(git_dir, 'rev-parse --abbrev-ref HEAD')
     if returncode:
       raise_and_log_error(
@@ -937,7 +1276,13 @@ class GitRunner(object):
               dir=git_dir, branch=branch))
       return
     logging.warning('Deleting origin branch="%s" for %s', branch, git_dir)
-    self.check_run(git_dir, 'push origin --delete ' + branch)
+    self.check_network_run(git_dir, 'push origin --delete ' + branch)
+    self.__invalidate_origin_refs(git_dir)
+
+  def __invalidate_origin_refs(self, git_dir):
+    """Forget the remote refs of the origin, which we just changed."""
+    origin = self.determine_git_repository_spec(git_dir).origin
+    self.remote_refs().invalidate(origin)
 
   def push_branch_to_origin(self, git_dir, branch, force=False):
     """Push the given local repository back up to the origin.
@@ -959,7 +1304,53 @@ class GitRunner(object):
       return
 
     force_flag = ' -f' if force else ''
-    self.check_run(git_dir, 'push origin ' + branch + force_flag)
+    self.check_network_run(git_dir, 'push origin ' + branch + force_flag)
+    self.__invalidate_origin_refs(git_dir)
+
+  def push_refs_to_origin(self, git_dir, refspecs, force=False):
+    """Push several branches and/or tags to the origin at once.
+
+    This is a single "push --atomic" so the origin either accepts all of
+    the refspecs or none of them.
+
+    Args:
+      git_dir: [path] The local repository.
+      refspecs: [list of string] The branches, tags or refspecs to push.
+      force: [bool] Whether to force the update.
+    """
+    if not refspecs:
+      return
+
+    force_flag = ' -f' if force else ''
+    command = 'push --atomic origin {refspecs}{force}'.format(
+        refspecs=' '.join(refspecs), force=force_flag)
+    if self.options.git_never_push:
+      logging.warning(
+          'SKIP pushing refs because --git_never_push=true.'
+          '\nCommand would have been: %s',
+          'git -C "{dir}" {command}'.format(dir=git_dir, command=command))
+      return
+
+    logging.debug('Pushing %s to origin in %s', refspecs, git_dir)
+    self.check_network_run(git_dir, command)
+    self.__invalidate_origin_refs(git_dir)
+
+  def apply_ref_transaction(self, git_dir, transaction):
+    """Apply the RefTransaction to the local repository.
+
+    Raises:
+      ExecutionError if any of the changes could not be made,
+      in which case none of them were.
+    """
+    if not len(transaction):
+      return
+
+    logging.debug('Applying %d ref changes in %s', len(transaction), git_dir)
+    with tempfile.TemporaryFile(mode='w+') as stream:
+      stream.write(transaction.to_stdin_text())
+      stream.flush()
+      stream.seek(0)
+      self.check_run(git_dir, 'update-ref --stdin', stdin=stream)
 
   def push_tag_to_origin(self, git_dir, tag):
     """Push the given tag back up to the origin."""
@@ -971,7 +1362,8 @@ class GitRunner(object):
       return
 
     logging.debug('Pushing tag "%s" and pushing to origin in %s', tag, git_dir)
-    self.check_run(git_dir, 'push origin ' + tag)
+    self.check_network_run(git_dir, 'push origin ' + tag)
+    self.__invalidate_origin_refs(git_dir)
 
   def fetch_tags(self, git_dir, remote_name='origin'):
     """Fetches the tags in the given remote as a list.
@@ -984,7 +1376,11 @@ class GitRunner(object):
       A list of tags.
     """
     logging.debug('Fetching tags for %s from remote %s', git_dir, remote_name)
-    self.check_run(git_dir, 'fetch --tags')
+    self.fetch_coordinator().fetch(git_dir, remote_name, '--tags')
+    query = LocalRepositoryQueryRegistry.get(git_dir)
+    if query is not None:
+      return sorted([name[len('refs/tags/'):]
+                     for name in query.list_refs('refs/tags/').keys()])
     raw_tags = self.check_run(git_dir, 'tag')
     return [s.strip() for s in raw_tags.split('\n')]
 
@@ -1007,17 +1403,17 @@ class GitRunner(object):
 
     logging.debug('Refreshing %s from %s',
                   git_dir, remote_name)
-    command = 'fetch {remote_name} --tags'.format(
-        remote_name=remote_name)
-    result = self.check_run(git_dir, command)
-    logging.info('%s:\n%s', repository.name, result)
+    result = self.fetch_coordinator().fetch(git_dir, remote_name, '--tags')
+    logging.info('%s:\n%s', repository.name,
+                 result or '{0} is unchanged.'.format(remote_name))
 
   def __check_clone_branch(self, remote_url, base_dir, clone_command, branches):
     remaining_branches = list(branches)
     while True:
       branch = remaining_branches.pop(0)
       cmd = '{clone} -b {branch}'.format(clone=clone_command, branch=branch)
-      retcode, stdout = self.run_git(base_dir, cmd)
+      with RepositoryExecutor.resource_slot(GIT_NETWORK_RESOURCE):
+        retcode, stdout = self.run_git(base_dir, cmd)
       if not retcode:
         return
 
@@ -1052,9 +1448,15 @@ class GitRunner(object):
     git_dir = git_dir or repository.git_dir
 
     logging.debug('Clearing all non-version tags from %s', git_dir)
-    all_tags = self.check_run(git_dir, 'tag').split('\n')
+    all_tags = [tag for tag in self.check_run(git_dir, 'tag').split('\n')
+                if tag]
     tags_to_remove = [tag for tag in all_tags if not tag_matcher.match(tag)]
-    self.check_run(git_dir, 'tag -d ' + ' '.join(tags_to_remove))
+
+    # There can be thousands of these, more than fit on a command line.
+    transaction = RefTransaction()
+    for tag in tags_to_remove:
+      transaction.delete('refs/tags/' + tag)
+    self.apply_ref_transaction(git_dir, transaction)
     logging.debug('%d of %d tags removed', len(tags_to_remove), len(all_tags))
 
   def determine_pull_url(self, origin):
@@ -1092,14 +1494,26 @@ class GitRunner(object):
     parent_dir = os.path.dirname(git_dir)
     ensure_dir_exists(parent_dir)
 
-    clone_command = 'clone ' + pull_url
+    mirror_cache = self.mirror_cache()
+    mirror_path = (mirror_cache.ensure_mirror(
+        pull_url, self.normalize_repo_url(pull_url))
+                   if mirror_cache
+                   else None)
+    if mirror_path:
+      clone_command = 'clone --reference {mirror} {url}'.format(
+          mirror=mirror_path, url=pull_url)
+    else:
+      clone_command = 'clone {args}{url}'.format(
+          args=self.__determine_clone_policy_args(pull_url, commit),
+          url=pull_url)
+
     if branch:
       branches = [branch]
       if default_branch:
         branches.append(default_branch)
       self.__check_clone_branch(pull_url, parent_dir, clone_command, branches)
     else:
-      self.check_run(parent_dir, clone_command)
+      self.check_network_run(parent_dir, clone_command)
     logging.info('Cloned %s into %s', pull_url, parent_dir)
 
     if commit:
@@ -1127,6 +1541,22 @@ class GitRunner(object):
 
     logging.debug('Finished cloning %s', pull_url)
 
+  def __determine_clone_policy_args(self, pull_url, commit):
+    """Returns the clone arguments implementing --git_clone_policy."""
+    if os.path.exists(pull_url):
+      # Local clones already share objects, and git ignores these anyway.
+      return ''
+
+    policy = self.__options.git_clone_policy
+    if policy == 'shallow' and commit:
+      # The commit may be anywhere in the history, so settle for blobless.
+      policy = 'blobless'
+    if policy == 'shallow':
+      return '--depth 1 '
+    if policy == 'blobless':
+      return '--filter=blob:none '
+    return ''
+
   def checkout(self, repository, commit):
     self.check_run(repository.git_dir, 'checkout -q ' + commit, echo=True)
 
@@ -1139,7 +1569,14 @@ class GitRunner(object):
 
       Returns: list of CommitTag sorted most recent first.
     """
-    retcode, stdout = self.run_git(git_dir, 'show-ref --tags')
+    query = LocalRepositoryQueryRegistry.get(git_dir)
+    if query is not None:
+      retcode = 0
+      stdout = '\n'.join(
+          ['{0} {1}'.format(object_id, name)
+           for name, object_id in query.list_refs('refs/tags/').items()])
+    else:
+      retcode, stdout = self.run_git(git_dir, 'show-ref --tags')
     if retcode and stdout:
       raise_and_log_error(
           ExecutionError('git failed in %s' % git_dir, program='git'),
@@ -1153,11 +1590,14 @@ class GitRunner(object):
 
   def determine_git_repository_spec(self, git_dir):
     """Infer GitRepositorySpec from a local git repository."""
-    git_text = self.check_run(git_dir, 'remote -v')
-    remote_urls = {
-        match.group(1): match.group(2)
-        for match in re.finditer(r'(\w+)\s+(\S+)\s+\(fetch\)', git_text)
-    }
+    query = LocalRepositoryQueryRegistry.get(git_dir)
+    remote_urls = query.query_remote_urls() if query else None
+    if remote_urls is None:
+      git_text = self.check_run(git_dir, 'remote -v')
+      remote_urls = {
+          match.group(1): match.group(2)
+          for match in re.finditer(r'(\w+)\s+(\S+)\s+\(fetch\)', git_text)
+      }
     origin_url = remote_urls.get('origin')
     if not origin_url:
       raise_and_log_error(
@@ -1167,13 +1607,41 @@ class GitRunner(object):
                              origin=origin_url,
                              upstream=remote_urls.get('upstream'))
 
+  def summary_cache(self, git_dir):
+    """Returns the RepositorySummaryCache for the local repository."""
+    key = os.path.abspath(git_dir)
+    with GitRunner.__SUMMARY_CACHES_LOCK:
+      cache = GitRunner.__SUMMARY_CACHES.get(key)
+      if cache is None:
+        cache = RepositorySummaryCache(self, git_dir)
+        GitRunner.__SUMMARY_CACHES[key] = cache
+    return cache
+
   def collect_repository_summary(self, git_dir, base_commit_id=None):
-    """Collects RepsitorySummary from local repository directory."""
+    """Collects RepsitorySummary from local repository directory.
+
+    Summaries are remembered by the summary_cache so summarizing the same
+    commit again is cheap until the version tags or remote branches change.
+    """
+    current_id = self.query_local_repository_commit_id(git_dir)
+    cache = self.summary_cache(git_dir)
+    cache_key = cache.make_key(current_id, base_commit_id)
+    cached = cache.lookup(cache_key)
+    if cached is not None:
+      logging.debug('Reusing summary of %s at %s', git_dir, current_id)
+      return RepositorySummary.from_dict(cached)
+
+    summary = self.__analyze_repository_summary(
+        git_dir, current_id, base_commit_id)
+    cache.record(cache_key, summary.to_dict())
+    return summary
+
+  def __analyze_repository_summary(self, git_dir, current_id, base_commit_id):
     start_time = time.time()
     logging.debug('Begin analyzing %s', git_dir)
+    self.deepen_to_version_tag(git_dir)
     all_tags = self.query_tag_commits(
         git_dir, r'^version-[0-9]+\.[0-9]+\.[0-9]+$')
-    current_id = self.query_local_repository_commit_id(git_dir)
     tag, msgs = self.query_local_repository_commits_to_existing_tag_from_id(
         git_dir, current_id, all_tags, base_commit_id=base_commit_id)
 
@@ -1204,12 +1672,17 @@ class GitRunner(object):
 
     This will fail if the branch exists and the git_dir is currently in it.
     """
-    result = self.check_run(git_dir, 'branch -l')
-    branches = []
-    for elem in result.split('\n'):
-      if elem.startswith('*'):
-        elem = elem[1:].strip()
-      branches.append(elem)
+    query = LocalRepositoryQueryRegistry.get(git_dir)
+    if query is not None:
+      branches = [name[len('refs/heads/'):]
+                  for name in query.list_refs('refs/heads/').keys()]
+    else:
+      result = self.check_run(git_dir, 'branch -l')
+      branches = []
+      for elem in result.split('\n'):
+        if elem.startswith('*'):
+          elem = elem[1:].strip()
+        branches.append(elem)
 
     if branch in branches:
       logging.info('Deleting existing branch %s from %s', branch, git_dir)
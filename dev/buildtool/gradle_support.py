@@ -14,29 +14,23 @@
 
 """Helper module for running gradle commands."""
 
-import base64
 import logging
 import os
 import re
-
-try:
-  from urllib2 import urlopen, Request
-  from urllib2 import HTTPError
-except ImportError:
-  from urllib.request import urlopen, Request
-  from urllib.error import HTTPError
+import threading
 
 from buildtool import (
     RepositoryCommandFactory,
     RepositoryCommandProcessor,
+    RepositoryExecutor,
     GitRunner,
+    GRADLE_RESOURCE,
 
     add_parser_argument,
     check_subprocesses_to_logfile,
     raise_and_log_error,
-    exception_to_message,
-    ConfigError,
-    ResponseError)
+    ConfigError)
+from buildtool.bintray_support import BintrayClient
 
 
 class GradleMetricsUpdater(object):
@@ -168,6 +162,7 @@ class GradleRunner(object):
     add_parser_argument(
         parser, 'bintray_jar_repository', defaults, None,
         help='bintray repository in the bintray_org to publish jar files into.')
+    BintrayClient.add_parser_args(parser, defaults)
     add_parser_argument(
         parser, 'gradle_cache_path', defaults,
         '{home}/.gradle'.format(home=os.environ['HOME'])
@@ -196,43 +191,59 @@ class GradleRunner(object):
     self.__metrics = metrics
     self.__git = GitRunner(options)
     self.__scm = scm
+    self.__bintray = BintrayClient.get_shared(options)
+
+    # Bintray package versions we already know about, keyed by
+    # (subject, repo, package, version).
+    self.__known_versions = {}
+    self.__known_versions_lock = threading.Lock()
 
-  def __to_bintray_url(self, repo, package_name, repository, build_version):
-    """Return the url for the desired versioned repository in bintray repo."""
-    bintray_path = (
-        'packages/{subject}/{repo}/{package}/versions/{version}'.format(
-            subject=self.__options.bintray_org,
-            package=package_name, repo=repo, version=build_version))
-    return 'https://api.bintray.com/' + bintray_path
-
-  def __add_bintray_auth_header(self, request):
-    """Adds bintray authentication header to the request."""
-    user = os.environ['BINTRAY_USER']
-    password = os.environ['BINTRAY_KEY']
-    encoded_auth = base64.b64encode('{user}:{password}'.format(user=user, password=password))
-    request.add_header('Authorization', 'Basic ' + bytes.decode(encoded_auth))
+  def __bintray_key(self, repo, package_name, build_version):
+    """Return the key identifying the package version in a bintray repo."""
+    return (self.__options.bintray_org, repo, package_name, build_version)
 
   def bintray_repo_has_version(self, repo, package_name, repository,
                                build_version):
     """See if the given bintray repository has the package version to build."""
-    try:
-      bintray_url = self.__to_bintray_url(repo, package_name, repository,
-                                          build_version)
-      logging.debug('Checking for %s', bintray_url)
-      request = Request(url=bintray_url)
-      self.__add_bintray_auth_header(request)
-      urlopen(request)
-      return True
-    except HTTPError as ex:
-      if ex.code == 404:
-        return False
-      raise_and_log_error(
-          ResponseError('Bintray failure: {}'.format(ex),
-                        server='bintray.check'),
-          'Failed on url=%s: %s' % (bintray_url, exception_to_message(ex)))
-    except Exception as ex:
-      raise
+    # pylint: disable=unused-argument
+    key = self.__bintray_key(repo, package_name, build_version)
+    with self.__known_versions_lock:
+      if key in self.__known_versions:
+        return self.__known_versions[key]
+    logging.debug('Checking for %s',
+                  BintrayClient.version_path(*key))
+    return self.__bintray.has_version(*key)
+
+  def determine_debian_package_name(self, repository):
+    """Return the name of the debian package built by the repository."""
+    package_name = repository.name
+    if package_name == 'spinnaker-monitoring':
+      package_name = 'spinnaker-monitoring-daemon'
+    elif not package_name.startswith('spinnaker'):
+      package_name = 'spinnaker-' + package_name
+    return package_name
+
+  def prefetch_debian_versions(self, repository_versions):
+    """Check which of the desired debian versions are already on bintray.
+
+    The checks are made concurrently and remembered so that the
+    consider_debian_on_bintray calls for the individual repositories
+    do not need to go back to bintray.
 
+    Args:
+      repository_versions: [list of (GitRepositorySpec, build_version)]
+    """
+    repo = self.__options.bintray_debian_repository
+    keys = [self.__bintray_key(repo,
+                               self.determine_debian_package_name(repository),
+                               build_version)
+            for repository, build_version in repository_versions]
+    found = self.__bintray.query_existing_versions(keys)
+    logging.debug('%d of %d debian versions are already on bintray',
+                  len([key for key, exists in found.items() if exists]),
+                  len(found))
+    with self.__known_versions_lock:
+      self.__known_versions.update(found)
 
   def consider_debian_on_bintray(self, repository, build_version):
     """Check whether desired version already exists on bintray."""
@@ -247,10 +258,7 @@ class GradleRunner(object):
 #                         options.bintray_jar_repository]:
       package_name = repository.name
       if bintray_repo == options.bintray_debian_repository:
-        if package_name == 'spinnaker-monitoring':
-          package_name = 'spinnaker-monitoring-daemon'
-        elif not package_name.startswith('spinnaker'):
-          package_name = 'spinnaker-' + package_name
+        package_name = self.determine_debian_package_name(repository)
       if self.bintray_repo_has_version(
           bintray_repo, package_name, repository, build_version):
         exists.append(bintray_repo)
@@ -282,29 +290,18 @@ class GradleRunner(object):
   def bintray_repo_delete_version(self, repo, package_name, repository,
                                   build_version=None):
     """Delete the given bintray repository version if it exsts."""
-    try:
-      bintray_url = self.__to_bintray_url(repo, package_name, repository,
-                                          build_version)
-      logging.debug('Checking for %s', bintray_url)
-      request = Request(url=bintray_url)
-      request.get_method = lambda: 'DELETE'
-      self.__add_bintray_auth_header(request)
-
-      labels = {
-          'repo': repo,
-          'repository': repository.name,
-          'artifact': 'debian'
-      }
-      self.__metrics.count_call(
-          'DeleteArtifact', labels, urlopen, request)
-      return True
-    except HTTPError as ex:
-      if ex.code == 404:
-        return True
-      raise_and_log_error(
-          ResponseError('Bintray failure: {}'.format(ex),
-                        server='bintray.delete'),
-          'Failed on url=%s: %s' % (bintray_url, exception_to_message(ex)))
+    key = self.__bintray_key(repo, package_name, build_version)
+    logging.debug('Deleting %s', BintrayClient.version_path(*key))
+    labels = {
+        'repo': repo,
+        'repository': repository.name,
+        'artifact': 'debian'
+    }
+    self.__metrics.count_call(
+        'DeleteArtifact', labels, self.__bintray.delete_version, *key)
+    with self.__known_versions_lock:
+      self.__known_versions[key] = False
+    return True
 
   def get_common_args(self):
     """Return standard gradle args."""
@@ -378,12 +375,13 @@ class GradleRunner(object):
         'context': context,
         'target': target
     }
-    self.__metrics.time_call(
-        'GradleBuild', labels, self.__metrics.default_determine_outcome_labels,
-        check_subprocesses_to_logfile,
-        name + ' gradle ' + context, logfile, [cmd], cwd=gradle_dir,
-        postprocess_hook=GradleMetricsUpdater(self.__metrics,
-                                              repository, target))
+    with RepositoryExecutor.resource_slot(GRADLE_RESOURCE):
+      self.__metrics.time_call(
+          'GradleBuild', labels, self.__metrics.default_determine_outcome_labels,
+          check_subprocesses_to_logfile,
+          name + ' gradle ' + context, logfile, [cmd], cwd=gradle_dir,
+          postprocess_hook=GradleMetricsUpdater(self.__metrics,
+                                                repository, target))
 
   def __is_plugin_version_6(self, repository):
     return not self.__has_init_publish_file(
@@ -230,6 +230,10 @@ class BuildHalyardCommand(GradleCommandProcessor):
     else:
       commit_id = self.git.query_remote_repository_commit_id(
           repository.origin, self.options.git_branch)
+      if commit_id is None:
+        logging.warning('%s has no branch "%s"',
+                        repository.origin, self.options.git_branch)
+        return None
     commits = self.load_halyard_version_commits().split('\n')
     commits.reverse()
     postfix = ' ' + commit_id
@@ -238,6 +242,11 @@ class BuildHalyardCommand(GradleCommandProcessor):
         return line
     return None
 
+  def _do_preprocess(self):
+    """Resolve the remote branches needed to check for existing builds."""
+    if self.options.skip_existing:
+      self.prefetch_remote_refs()
+
   def _do_can_skip_repository(self, repository):
     if self.options.skip_existing:
       entry = self.find_commit_version_entry(repository)
@@ -39,6 +39,7 @@ from buildtool import (
     raise_and_log_error,
     ConfigError,
     UnexpectedError)
+from buildtool.artifact_inventory import GceImageInventory
 
 
 # TODO(ewiseblatt): 20180203
@@ -116,16 +117,13 @@ class BuildGceComponentImages(RepositoryCommandProcessor):
       build_version = services[service_name]['version']
 
     options = self.options
-    image_name = 'spinnaker-{repo}-{version}'.format(
-        repo=repository.name,
-        version=build_version.replace('.', '-').replace(':', '-'))
-    lookup_command = ['gcloud', '--account', options.build_gce_service_account,
-                      'compute', 'images', 'list', '--filter', image_name,
-                      '--project', self.__image_project,
-                      '--quiet', '--format=json']
+    image_name = GceImageInventory.make_image_name(
+        repository.name, build_version)
     logging.debug('Checking for existing image for "%s"', repository.name)
-    got = check_subprocess(' '.join(lookup_command))
-    if got.strip() == '[]':
+    inventory = GceImageInventory.get_shared(
+        self.__image_project, account=options.build_gce_service_account,
+        ttl_secs=options.gce_image_inventory_ttl_secs)
+    if not inventory.has_image(image_name):
       return False
     labels = {'repository': repository.name, 'artifact': 'gce-image'}
     if self.options.skip_existing:
@@ -145,6 +143,7 @@ class BuildGceComponentImages(RepositoryCommandProcessor):
         'DeleteArtifact', labels,
         'Attempts to delete existing GCE images.',
         check_subprocess, ' '.join(delete_command))
+    inventory.invalidate(image_name)
     return False
 
   def ensure_local_repository(self, repository):
@@ -222,6 +221,7 @@ class BuildGceComponentImagesFactory(RepositoryCommandFactory):
     super(BuildGceComponentImagesFactory, self).init_argparser(
         parser, defaults)
     HalRunner.add_parser_args(parser, defaults)
+    GceImageInventory.add_parser_args(parser, defaults)
 
     self.add_argument(
         parser, 'halyard_release_track', defaults, 'stable',
@@ -0,0 +1,333 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Delivers InfluxDB line protocol in the background without losing it.
+
+The metrics pusher hands each flush to an InfluxDbExporter, which sends it
+from its own thread so a slow or unavailable metrics endpoint never stalls
+the build. The lines are split into size-bounded batches and gzipped, then
+written over a single keep-alive connection, retrying server side failures
+with backoff.
+
+Batches that still cannot be delivered are spooled to disk. The spool is
+replayed (oldest first) before the next flush is sent, including by the
+next buildtool run using the same spool directory, so build telemetry is
+delayed rather than lost when the endpoint is flaky. A batch being
+replayed is claimed by renaming it with the process id, and is returned to
+the spool by a later exporter if that process died before finishing.
+"""
+
+import errno
+import logging
+import os
+import socket
+import threading
+import time
+import zlib
+
+try:
+  import httplib
+  from urlparse import urlparse
+except ImportError:
+  import http.client as httplib
+  from urllib.parse import urlparse
+
+try:
+  from Queue import Queue, Empty
+except ImportError:
+  from queue import Queue, Empty
+
+from buildtool import ensure_dir_exists
+
+
+# Responses that are worth trying again after backing off.
+RETRYABLE_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
+SPOOL_SUFFIX = '.lp.gz'
+
+
+def gzip_bytes(data):
+  """Returns the data compressed in gzip format."""
+  # A wbits of 16 + MAX_WBITS writes the gzip header.
+  compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+  return compressor.compress(data) + compressor.flush()
+
+
+class InfluxDbExporter(object):
+  """Sends line protocol to an InfluxDB database from a background thread."""
+
+  def __init__(self, url, database, spool_dir, **kwargs):
+    """Constructor.
+
+    Args:
+      url: [string] The InfluxDB server url.
+      database: [string] The database to write into.
+      spool_dir: [path] Where to keep batches that could not be sent.
+      batch_bytes: [int] The most uncompressed bytes to send in a request.
+      max_attempts: [int] How many times to try sending a batch.
+      timeout_secs: [int] The socket timeout for requests.
+      max_spool_files: [int] The most batches to keep in the spool.
+      initial_backoff_secs: [float] The delay before the first retry.
+    """
+    parsed = urlparse(url)
+    self.__connection_class = (httplib.HTTPSConnection
+                               if parsed.scheme == 'https'
+                               else httplib.HTTPConnection)
+    self.__netloc = parsed.netloc
+    self.__write_path = '{prefix}/write?db={db}'.format(
+        prefix=parsed.path.rstrip('/'), db=database)
+    self.__spool_dir = spool_dir
+    self.__batch_bytes = kwargs.pop('batch_bytes', 512 * 1024)
+    self.__max_attempts = max(1, kwargs.pop('max_attempts', 4))
+    self.__timeout_secs = kwargs.pop('timeout_secs', 10)
+    self.__max_spool_files = kwargs.pop('max_spool_files', 1000)
+    self.__initial_backoff_secs = kwargs.pop('initial_backoff_secs', 0.5)
+    if kwargs:
+      # This module is loaded before buildtool.errors, which needs metrics.
+      raise TypeError('Unexpected arguments {0}'.format(list(kwargs.keys())))
+
+    self.__connection = None
+    self.__queue = Queue()
+    self.__lock = threading.Lock()
+    self.__thread = None
+    self.__closing = False
+    self.__spool_sequence = 0
+    self.__recover_claimed_spool()
+
+  def submit(self, lines):
+    """Queue the lines to be sent. This does not block.
+
+    Args:
+      lines: [list of string] Line protocol entries. This may be empty
+         to just replay any spooled batches.
+    """
+    with self.__lock:
+      if self.__thread is None:
+        self.__thread = threading.Thread(
+            name='InfluxDbExporter', target=self.__export_loop)
+        self.__thread.daemon = True
+        self.__thread.start()
+    self.__queue.put(list(lines))
+
+  def close(self, timeout_secs):
+    """Wait up to timeout_secs for queued lines to be sent.
+
+    Whatever has not been sent by then is spooled for a later run.
+    """
+    with self.__lock:
+      thread = self.__thread
+      self.__thread = None
+    if thread is not None:
+      self.__queue.put(None)
+      thread.join(timeout_secs)
+      if thread.is_alive():
+        logging.warning('Spooling metrics not sent to InfluxDB after %s secs',
+                        timeout_secs)
+        # Stop retrying so the thread spools what it is working on.
+        self.__closing = True
+        while True:
+          try:
+            lines = self.__queue.get_nowait()
+          except Empty:
+            break
+          if lines:
+            for batch in self.__make_batches(lines):
+              self.__spool(batch)
+        return
+
+    if self.__connection is not None:
+      self.__connection.close()
+      self.__connection = None
+
+  def __export_loop(self):
+    while True:
+      lines = self.__queue.get()
+      if lines is None:
+        return
+      # pylint: disable=broad-except
+      try:
+        self.export(lines)
+      except Exception as ex:
+        logging.error('Failed to export metrics: %s', ex)
+
+  def export(self, lines):
+    """Send the spool then the lines, spooling what could not be sent.
+
+    This is normally called from the background thread.
+    """
+    healthy = self.__replay_spool()
+    for batch in self.__make_batches(lines):
+      if healthy:
+        healthy = self.__send_with_retry(batch)
+        if healthy:
+          continue
+      # Once the endpoint fails, dont stall trying the remaining batches.
+      self.__spool(batch)
+
+  def __make_batches(self, lines):
+    """Join the lines into gzipped batches of at most batch_bytes."""
+    batch = []
+    batch_size = 0
+    for line in lines:
+      data = line.encode('utf-8')
+      if batch and batch_size + len(data) + 1 > self.__batch_bytes:
+        yield gzip_bytes(b'\n'.join(batch))
+        batch = []
+        batch_size = 0
+      batch.append(data)
+      batch_size += len(data) + 1
+    if batch:
+      yield gzip_bytes(b'\n'.join(batch))
+
+  def __send_once(self, body):
+    """Post a gzipped batch, returning the HTTP status."""
+    if self.__connection is None:
+      self.__connection = self.__connection_class(
+          self.__netloc, timeout=self.__timeout_secs)
+    try:
+      self.__connection.request(
+          'POST', self.__write_path, body,
+          {'Content-Encoding': 'gzip',
+           'Content-Type': 'text/plain; charset=utf-8'})
+      response = self.__connection.getresponse()
+      payload = response.read()
+    except:
+      self.__connection.close()
+      self.__connection = None
+      raise
+    if response.will_close:
+      self.__connection.close()
+      self.__connection = None
+    if response.status >= 300:
+      logging.debug('InfluxDB responded HTTP %d: %s',
+                    response.status, payload[:256])
+    return response.status
+
+  def __send_with_retry(self, body, max_attempts=None):
+    """Send a gzipped batch.
+
+    Returns:
+      True if the batch was handled, False if it should be tried again later.
+      Batches the server rejects as invalid are logged and dropped.
+    """
+    max_attempts = max_attempts or self.__max_attempts
+    for attempt in range(max_attempts):
+      if attempt:
+        if self.__closing:
+          return False
+        time.sleep(min(self.__initial_backoff_secs * (2 ** (attempt - 1)),
+                       30))
+      try:
+        status = self.__send_once(body)
+      except (httplib.HTTPException, socket.error) as ex:
+        logging.debug('Failed to send metrics to %s: %r', self.__netloc, ex)
+        continue
+      if status < 300:
+        return True
+      if status not in RETRYABLE_STATUS_CODES:
+        logging.error('InfluxDB rejected %d bytes of metrics with HTTP %d',
+                      len(body), status)
+        return True
+
+    logging.warning('Could not send metrics to %s after %d attempts',
+                    self.__netloc, max_attempts)
+    return False
+
+  def __spool(self, batch):
+    """Write a batch that could not be sent into the spool directory."""
+    # After a close timeout, both close and the export thread may spool.
+    with self.__lock:
+      self.__spool_sequence += 1
+      sequence = self.__spool_sequence
+    name = '{millis:013d}-{pid}-{seq:06d}{suffix}'.format(
+        millis=int(time.time() * 1000), pid=os.getpid(),
+        seq=sequence, suffix=SPOOL_SUFFIX)
+    try:
+      ensure_dir_exists(self.__spool_dir)
+      tmp_path = os.path.join(self.__spool_dir, name + '.tmp')
+      with open(tmp_path, 'wb') as stream:
+        stream.write(batch)
+      os.rename(tmp_path, os.path.join(self.__spool_dir, name))
+    except (IOError, OSError) as ex:
+      logging.error('Lost %d bytes of metrics because cannot spool them: %s',
+                    len(batch), ex)
+      return
+
+    spooled = self.__list_spool()
+    for stale in spooled[:max(0, len(spooled) - self.__max_spool_files)]:
+      logging.warning('Dropping oldest spooled metrics %s', stale)
+      self.__remove(os.path.join(self.__spool_dir, stale))
+
+  def __list_spool(self):
+    if not os.path.isdir(self.__spool_dir):
+      return []
+    return sorted(name for name in os.listdir(self.__spool_dir)
+                  if name.endswith(SPOOL_SUFFIX))
+
+  @staticmethod
+  def __is_process_alive(pid):
+    try:
+      os.kill(pid, 0)
+    except OSError as ex:
+      return ex.errno == errno.EPERM
+    return True
+
+  def __recover_claimed_spool(self):
+    """Return batches claimed by replays that died to the spool."""
+    if not os.path.isdir(self.__spool_dir):
+      return
+    for name in os.listdir(self.__spool_dir):
+      path, _, pid = name.rpartition('.')
+      if (not path.endswith(SPOOL_SUFFIX) or not pid.isdigit()
+          or int(pid) == os.getpid() or self.__is_process_alive(int(pid))):
+        continue
+      logging.info('Recovering spooled metrics %s claimed by process %s',
+                   path, pid)
+      try:
+        os.rename(os.path.join(self.__spool_dir, name),
+                  os.path.join(self.__spool_dir, path))
+      except OSError as ex:
+        logging.debug('Could not recover %s: %s', name, ex)
+
+  @staticmethod
+  def __remove(path):
+    try:
+      os.remove(path)
+    except OSError:
+      pass
+
+  def __replay_spool(self):
+    """Send the spooled batches, oldest first.
+
+    Returns:
+      False if the endpoint is still failing.
+    """
+    for name in self.__list_spool():
+      path = os.path.join(self.__spool_dir, name)
+      claimed_path = '{0}.{1}'.format(path, os.getpid())
+      try:
+        # Claim it so concurrent runs sharing the spool dont both send it.
+        os.rename(path, claimed_path)
+        with open(claimed_path, 'rb') as stream:
+          batch = stream.read()
+      except (IOError, OSError):
+        continue
+
+      # The endpoint already had its chances when this was spooled.
+      if not self.__send_with_retry(batch, max_attempts=1):
+        os.rename(claimed_path, path)
+        return False
+      logging.debug('Replayed spooled metrics %s', name)
+      self.__remove(claimed_path)
+    return True
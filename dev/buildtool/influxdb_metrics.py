@@ -33,13 +33,10 @@ To create a database:
 
 import datetime
 import logging
-
-try:
-  from urllib2 import urlopen, Request
-except ImportError:
-  from urllib.request import urlopen, Request
+import os
 
 from buildtool import add_parser_argument
+from buildtool.influxdb_exporter import InfluxDbExporter
 from buildtool.inmemory_metrics import InMemoryMetricsRegistry
 
 
@@ -70,6 +67,22 @@ class InfluxDbMetricsRegistry(InMemoryMetricsRegistry):
         help='Reiterate gauge values for the specified period of seconds.'
              ' This is because when they get chunked into time blocks, the'
              'values become lost, in particular settling back to 0.')
+    add_parser_argument(
+        parser, 'influxdb_batch_bytes', defaults, 512 * 1024, type=int,
+        help='The most bytes of line protocol to send in one request.')
+    add_parser_argument(
+        parser, 'influxdb_max_attempts', defaults, 4, type=int,
+        help='How many times to try sending a batch before spooling it.')
+    add_parser_argument(
+        parser, 'influxdb_spool_dir', defaults, None,
+        help='Where to keep metrics that could not be sent to influxdb so'
+             ' they can be sent later, possibly by a later run.'
+             ' The default is an "influxdb_spool" directory in the metrics'
+             ' directory.')
+    add_parser_argument(
+        parser, 'influxdb_shutdown_secs', defaults, 10, type=int,
+        help='How long to wait for metrics to be sent when shutting down'
+             ' before spooling them for a later run.')
 
   def __init__(self, *pos_args, **kwargs):
     super(InfluxDbMetricsRegistry, self).__init__(*pos_args, **kwargs)
@@ -80,9 +93,21 @@ class InfluxDbMetricsRegistry(InMemoryMetricsRegistry):
     }
     self.__recent_gauges = set([])
 
+    options = self.options
+    self.__exporter = None
+    if options.monitoring_enabled:
+      spool_dir = options.influxdb_spool_dir or os.path.join(
+          options.metrics_dir or os.path.join(options.output_dir, 'metrics'),
+          'influxdb_spool')
+      self.__exporter = InfluxDbExporter(
+          options.influxdb_url, options.influxdb_database, spool_dir,
+          batch_bytes=options.influxdb_batch_bytes,
+          max_attempts=options.influxdb_max_attempts)
+
   def _do_flush_final_metrics(self):
     """Implements interface."""
     self.flush_updated_metrics()
+    self.__exporter.close(self.options.influxdb_shutdown_secs)
 
   def _do_flush_updated_metrics(self, updated_metrics):
     """Implements interface.
@@ -109,18 +134,10 @@ class InfluxDbMetricsRegistry(InMemoryMetricsRegistry):
 
     if not payload:
       logging.debug('No metrics updated.')
-      return
-
-    url = '{prefix}/write?db={db}'.format(
-        prefix=self.options.influxdb_url, db=self.options.influxdb_database)
-    payload_text = '\n'.join(payload)
-    request = Request(url, data=str.encode(payload_text))
-    request.get_method = lambda: 'POST'
-    try:
-      urlopen(request)
-      logging.debug('Updated %d metrics to %s', len(payload), url)
-    except IOError as ioex:
-      logging.error('Cannot write metrics to %s:\n%s', url, ioex)
+
+    # This is sent in the background. Even if there is nothing new,
+    # it gives the exporter a chance to send anything it has spooled.
+    self.__exporter.submit(payload)
 
   def __to_label_text(self, metric):
     return ','.join(['%s=%s' % (key, value)
@@ -133,7 +150,7 @@ class InfluxDbMetricsRegistry(InMemoryMetricsRegistry):
         now - datetime.timedelta(0, self.options.influxdb_reiterate_gauge_secs))
 
     for gauge in gauges:
-      current = gauge.timeseries[-1]
+      current = gauge.timeseries.last()
       if gauge.value != 0 or current.utc > keep_if_newer_than:
         # Gauge is still lingering in our reporting
         self.__recent_gauges.add(gauge)
@@ -192,3 +209,11 @@ class InfluxDbMetricsRegistry(InMemoryMetricsRegistry):
       payload.append(
           self.__to_payload_line('AvgSecs', name, label_text,
                                  avg_secs, entry.utc))
+
+    histogram = metric.mark_histogram()
+    if prev_count and histogram.count:
+      # The percentiles of the timings since the previous flush.
+      for percent in metric.PERCENTILES:
+        payload.append(
+            self.__to_payload_line('p{0}'.format(percent), name, label_text,
+                                   histogram.percentile(percent), entry.utc))
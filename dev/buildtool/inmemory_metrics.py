@@ -27,15 +27,15 @@ For what it is worth, these correspond to the process ids in the log
 files which could help identify the context of the metrics. In addition
 the CLI argv parameters are added into the files to help give context.
 
-All the state changes are recorded and held for the lifetime of the process.
-Although some scripts take a long time to execute, they shouldnt be producing
-many state changes in metrics so this should not be a big deal. Keeping
-all the values is almost as simple as having a single aggregation, but provides
-some insight into sequencing and other flow details. Keeping all the data
-provides high resolution for timing but is motivated by simplicity.
+The state changes are recorded for the lifetime of the process, which
+provides some insight into sequencing and other flow details. Long running
+or highly concurrent jobs can produce a great many state changes, so each
+metric keeps a bounded TimeSeries that thins out its older points rather
+than growing without bound.
 """
 
 
+from array import array
 import collections
 import datetime
 import json
@@ -52,6 +52,7 @@ from buildtool.base_metrics import (
     BaseMetricsRegistry,
     Counter,
     Gauge,
+    LatencyHistogram,
     Timer,
     MetricFamily)
 
@@ -66,6 +67,135 @@ class DataPoint(collections.namedtuple('DataPoint', ['value', 'utc'])):
   pass
 
 
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _to_micros(utc):
+  delta = utc - EPOCH
+  return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _to_number(value):
+  """Returns integral values as ints so they are written as ints."""
+  return int(value) if value.is_integer() else value
+
+
+class TimeSeries(object):
+  """A bounded series of timestamped values.
+
+  The points are kept in flat arrays of doubles rather than as objects.
+  When the series fills up, the older half of the points are thinned out
+  by dropping every other one, so the memory used stays bounded while the
+  whole lifetime of the metric remains covered (at a lower resolution for
+  older points). Counter and timer values are cumulative, so thinning them
+  does not lose any of the counts; a gauge loses the dropped samples.
+
+  The series also has a mark cursor so that exporters can consume the
+  points added since the last time they looked, even if some of those
+  points were thinned out in the meantime.
+  """
+
+  DEFAULT_CAPACITY = 1024
+
+  def __init__(self, num_values, capacity=None):
+    """Constructor.
+
+    Args:
+      num_values: [int] The number of values in each point.
+      capacity: [int] The most points to keep.
+    """
+    self.__capacity = max(4, capacity or self.DEFAULT_CAPACITY)
+    self.__micros = array('d')
+    self.__values = [array('d') for _ in range(num_values)]
+    self.__mark = 0
+    self.__marked_value = tuple([0] * num_values)
+    self.__mutex = threading.Lock()
+
+  def __len__(self):
+    return len(self.__micros)
+
+  def __point(self, index):
+    utc = EPOCH + datetime.timedelta(microseconds=int(self.__micros[index]))
+    values = tuple(_to_number(series[index]) for series in self.__values)
+    return DataPoint(values[0] if len(values) == 1 else values, utc)
+
+  def reset_after_fork(self):
+    """Replace the mutex inherited by a forked child process."""
+    self.__mutex = threading.Lock()
+
+  def append(self, utc, *values):
+    """Add a point."""
+    with self.__mutex:
+      if len(self.__micros) >= self.__capacity:
+        self.__thin_older_half()
+      self.__micros.append(_to_micros(utc))
+      for series, value in zip(self.__values, values):
+        series.append(value)
+
+  def __thin_older_half(self):
+    """Drop every other point from the older half, keeping the newest."""
+    half = len(self.__micros) // 2
+    start = (half - 1) % 2
+    self.__micros = self.__micros[start:half:2] + self.__micros[half:]
+    self.__values = [series[start:half:2] + series[half:]
+                     for series in self.__values]
+    if self.__mark <= half:
+      self.__mark = len(range(start, self.__mark, 2))
+    else:
+      self.__mark -= half - len(range(start, half, 2))
+
+  def last(self):
+    """Returns the most recent DataPoint or None."""
+    with self.__mutex:
+      return self.__point(-1) if self.__micros else None
+
+  def points(self):
+    """Returns all the DataPoints."""
+    with self.__mutex:
+      return [self.__point(index) for index in range(len(self.__micros))]
+
+  def mark(self):
+    """Returns the DataPoints added since the last mark.
+
+    Returns:
+      A tuple (points, marked_value) where marked_value is the value
+      of the last point returned by the previous mark (or 0).
+    """
+    with self.__mutex:
+      marked_value = self.__marked_value
+      count = len(self.__micros)
+      result = [self.__point(index) for index in range(self.__mark, count)]
+      self.__mark = count
+      if count:
+        self.__marked_value = tuple(_to_number(series[-1])
+                                    for series in self.__values)
+    if len(marked_value) == 1:
+      marked_value = marked_value[0]
+    return result, marked_value
+
+  def to_snapshot_values(self, value_names):
+    """Returns the points as a list of dictionaries for a JSON snapshot.
+
+    Args:
+      value_names: [list of string] The key to use for each value.
+    """
+    with self.__mutex:
+      micros = self.__micros.tolist()
+      columns = [series.tolist() for series in self.__values]
+    times = [(EPOCH + datetime.timedelta(microseconds=int(value))).isoformat()
+             for value in micros]
+    columns = [[_to_number(value) for value in column] for column in columns]
+    result = [{'time': time} for time in times]
+    for name, column in zip(value_names, columns):
+      for entry, value in zip(result, column):
+        entry[name] = value
+    return result
+
+
+def _timeseries_capacity(family):
+  return vars(family.registry.options).get('metrics_timeseries_capacity')
+
+
 class InMemoryCounter(Counter):
   """Specializes for in memory tracking.
 
@@ -82,45 +212,38 @@ class InMemoryCounter(Counter):
 
   CATEGORY = SNAPSHOT_CATEGORY[MetricFamily.COUNTER]
 
+  @property
+  def timeseries(self):
+    return self.__timeseries
+
   def __init__(self, family, labels):
     super(InMemoryCounter, self).__init__(family, labels)
-    self.__timeseries = []
-    self.__timeseries_mutex = threading.Lock()
-    self.__mark = (0, 0)
+    self.__timeseries = TimeSeries(1, _timeseries_capacity(family))
 
   def mark(self):
     """Return the slice of changes since the last mark."""
-    with self.__timeseries_mutex:
-      count = len(self.__timeseries)
-      start = self.__mark[0]
-      self.__mark = (count, self.__timeseries[-1][0])
-    return self.__timeseries[start:count]
+    return self.__timeseries.mark()[0]
 
   def mark_as_delta(self):
     """Return the slice of changes since the last mark.
 
     Return values as delta since previous known value.
     """
-    with self.__timeseries_mutex:
-      prev_value = self.__mark[1]
-    raw_result = self.mark()
-    result = []
-    for entry in raw_result:
-      delta = entry.value - prev_value
-      result.append(DataPoint(delta, entry.utc))
+    raw_result, prev_value = self.__timeseries.mark()
+    return [DataPoint(entry.value - prev_value, entry.utc)
+            for entry in raw_result]
 
-    return result
+  def reset_after_fork(self):
+    super(InMemoryCounter, self).reset_after_fork()
+    self.__timeseries.reset_after_fork()
 
   def touch(self, utc=None):
     super(InMemoryCounter, self).touch(utc=utc)
-    with self.__timeseries_mutex:
-      self.__timeseries.append(DataPoint(self.count, self.last_modified))
+    self.__timeseries.append(self.last_modified, self.count)
 
   def append_to_metrics_snapshot(self, snapshot):
     """Add this counter to the given tsnapshot."""
-    with self.__timeseries_mutex:
-      values = [{'time': point.utc.isoformat(), 'value': point.value}
-                for point in self.__timeseries]
+    values = self.__timeseries.to_snapshot_values(['value'])
     family_timeseries = snapshot[self.CATEGORY][self.name]['collectors']
     family_timeseries.append({
         'labels': self.labels,
@@ -140,33 +263,26 @@ class InMemoryGauge(Gauge):
 
   def __init__(self, family, labels):
     super(InMemoryGauge, self).__init__(family, labels)
-    self.__timeseries = []
-    self.__timeseries_mutex = threading.Lock()
-    self.__mark = 0
+    self.__timeseries = TimeSeries(1, _timeseries_capacity(family))
 
   def mark(self):
     """Return the slice of changes since the last mark."""
-    with self.__timeseries_mutex:
-      count = len(self.__timeseries)
-      start = self.__mark
-      self.__mark = count
-    return self.__timeseries[start:count]
+    return self.__timeseries.mark()[0]
 
   def mark_as_delta(self):
     return self.mark()
 
+  def reset_after_fork(self):
+    super(InMemoryGauge, self).reset_after_fork()
+    self.__timeseries.reset_after_fork()
+
   def touch(self, utc=None):
     super(InMemoryGauge, self).touch(utc=utc)
-    data_point = DataPoint(self.value, self.last_modified)
-    with self.__timeseries_mutex:
-      self.__timeseries.append(data_point)
+    self.__timeseries.append(self.last_modified, self.value)
 
   def append_to_metrics_snapshot(self, snapshot):
     """Add this gauge to the given snapshot."""
-    with self.__timeseries_mutex:
-      values = [{'time': point.utc.isoformat(), 'value': point.value}
-                for point in self.__timeseries]
-
+    values = self.__timeseries.to_snapshot_values(['value'])
     family_timeseries = snapshot[self.CATEGORY][self.name]['collectors']
     family_timeseries.append({
         'labels': self.labels,
@@ -180,56 +296,52 @@ class InMemoryTimer(Timer):
 
   CATEGORY = SNAPSHOT_CATEGORY[MetricFamily.TIMER]
 
+  @property
+  def timeseries(self):
+    return self.__timeseries
+
   def __init__(self, family, labels):
     super(InMemoryTimer, self).__init__(family, labels)
-    self.__timeseries = []
-    self.__timeseries_mutex = threading.Lock()
-    self.__mark = (0, 0, 0)
+    self.__timeseries = TimeSeries(2, _timeseries_capacity(family))
+    self.__marked_histogram = LatencyHistogram()
+
+  def mark_histogram(self):
+    """Return the LatencyHistogram of the timings since the last call."""
+    histogram = self.histogram
+    delta = histogram.minus(self.__marked_histogram)
+    self.__marked_histogram = histogram
+    return delta
 
   def mark(self):
     """Return the slice of changes since the last mark."""
-    with self.__timeseries_mutex:
-      count = len(self.__timeseries)
-      start = self.__mark[0]
-      self.__mark = (count,
-                     self.__timeseries[-1][0][0],
-                     self.__timeseries[-1][0][1])
-    return self.__timeseries[start:count]
+    return self.__timeseries.mark()[0]
 
   def mark_as_delta(self):
     """Return the slice of changes since the last mark.
 
     Return values as delta since previous known value.
     """
-    with self.__timeseries_mutex:
-      prev_count = self.__mark[1]
-      prev_total = self.__mark[2]
-
-    raw_result = self.mark()
-    result = []
-    for entry in raw_result:
-      delta_count = entry.value[0] - prev_count
-      delta_total = entry.value[1] - prev_total
-      result.append(DataPoint((delta_count, delta_total), entry.utc))
+    raw_result, (prev_count, prev_total) = self.__timeseries.mark()
+    return [DataPoint((entry.value[0] - prev_count,
+                       entry.value[1] - prev_total), entry.utc)
+            for entry in raw_result]
 
-    return result
+  def reset_after_fork(self):
+    super(InMemoryTimer, self).reset_after_fork()
+    self.__timeseries.reset_after_fork()
 
   def touch(self, utc=None):
     super(InMemoryTimer, self).touch(utc=utc)
-    with self.__timeseries_mutex:
-      self.__timeseries.append(DataPoint((self.count, self.total_seconds),
-                                         self.last_modified))
+    self.__timeseries.append(self.last_modified,
+                             self.count, self.total_seconds)
 
   def append_to_metrics_snapshot(self, snapshot):
-    """Add this gauge to the given snapshot."""
-    with self.__timeseries_mutex:
-      values = [{'time': point.utc.isoformat(),
-                 'count': point.value[0],
-                 'totalSecs': point.value[1]}
-                for point in self.__timeseries]
+    """Add this timer to the given snapshot."""
+    values = self.__timeseries.to_snapshot_values(['count', 'totalSecs'])
     family_timeseries = snapshot[self.CATEGORY][self.name]['collectors']
     family_timeseries.append({
         'labels': self.labels,
+        'percentiles': self.percentiles(),
         'values': values})
     return len(values)
 
@@ -246,6 +358,11 @@ class InMemoryMetricsRegistry(BaseMetricsRegistry):
     add_parser_argument(
         parser, 'metrics_dir', defaults, None,
         help='Path to file to write metrics into')
+    add_parser_argument(
+        parser, 'metrics_timeseries_capacity', defaults,
+        TimeSeries.DEFAULT_CAPACITY, type=int,
+        help='The most data points to keep for each metric. Once full,'
+             ' older data points are thinned out to make room.')
     parser.added_inmemory = True
 
   def __init__(self, options):
@@ -285,6 +402,7 @@ class InMemoryMetricsRegistry(BaseMetricsRegistry):
 
   def make_snapshot(self):
     """Writes metrics to file."""
+    self.merge_thread_local_metrics()
     snapshot = dict(self.__metrics_snapshot_prototype)
     snapshot['end_time'] = datetime.datetime.utcnow().isoformat()
 
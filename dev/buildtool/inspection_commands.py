@@ -46,23 +46,14 @@
       done
 """
 
-from threading import current_thread
 from multiprocessing.pool import ThreadPool
 
-import base64
-import json
 import logging
 import os
 import re
 import sys
 import yaml
 
-try:
-  from urllib2 import urlopen, HTTPError, Request
-except ImportError:
-  from urllib.request import urlopen, Request
-  from urllib.error import HTTPError
-
 
 from buildtool import (
     CommandFactory,
@@ -71,13 +62,24 @@ from buildtool import (
     check_options_set,
     check_path_exists,
     check_subprocess,
+    ensure_dir_exists,
     exception_to_message,
     maybe_log_exception,
     raise_and_log_error,
     write_to_path,
     ConfigError,
-    UnexpectedError,
-    ResponseError)
+    UnexpectedError)
+from buildtool.artifact_inventory import (
+    GceImageInventory,
+    RegistryTagInventory)
+from buildtool.bintray_support import BintrayClient
+from buildtool.bom_service_index import BomServiceIndex
+from buildtool.bom_service_table import BomServiceTable
+from buildtool.gcs_cache import GcsObjectCache
+
+
+# The libyaml based loader is much faster, but is not always available.
+YAML_SAFE_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
 
 
 def my_unicode_representer(self, data):
@@ -105,11 +107,14 @@ class CollectBomVersions(CommandProcessor):
   Emits files:
      bom_list.txt: A list of all the boms, released and unreleased
      bad_boms.txt: A list of malformed boms with what makes it malformed.
-     all_bom_sevice_map.yml: The inverse service version mapping of all the boms
-     released_bom_service_map.yml: The subset of all_bom_service_map for boms
-        that were released.
-     unreleased_bom_service_map.yml: The subset of all_bom_service_map for
+     all_bom_service_map.jsonl: The inverse service version mapping of all
+        the boms as a BomServiceTable.
+     released_bom_service_map.jsonl: The subset of all_bom_service_map for
+        boms that were released.
+     unreleased_bom_service_map.jsonl: The subset of all_bom_service_map for
         service versions that only appear in unreleased boms.
+     *_bom_service_map.yml: The above maps expanded into yaml, but only
+        with --bom_service_map_yaml.
      nonstandard_boms.txt: A list of boms whose artifactSources do not match
        the values specified via options. Unspecified options match anything.
      config.yml: The configuration values used to determine standard compliance.
@@ -134,10 +139,7 @@ class CollectBomVersions(CommandProcessor):
     self.__bad_files = {}
     self.__non_standard_boms = {}
 
-    # We're going to have a bunch of threads each writing into different keys
-    # in order to deconflict with one another lockless. Then we'll aggregate
-    # it all together when we're done processing for a single aggregate result.
-    self.__per_thread_result_map = {}
+    self.__service_table = BomServiceTable()
 
     self.__expect_docker_registry = options.docker_registry
     self.__expect_debian_repository = (
@@ -146,21 +148,42 @@ class CollectBomVersions(CommandProcessor):
         if options.bintray_org
         else None)
 
+    # The generation of each bom url, when known, so that it can be cached.
+    self.__bom_generations = {}
+
     super(CollectBomVersions, self).__init__(
         factory, options, **kwargs)
+    self.__bom_cache = GcsObjectCache(
+        options.bom_cache_dir
+        or os.path.join(self.get_input_dir(), 'bom_cache'))
+    self.__bom_index = BomServiceIndex(
+        os.path.join(self.__bom_cache.cache_dir, 'bom_service_index.jsonl'))
 
   def load_bom_from_url(self, url):
     """Returns the bom specification dict from a gcs url."""
     logging.debug('Loading %s', url)
     try:
       text = check_subprocess('gsutil cat ' + url)
-      return yaml.safe_load(text)
+      return yaml.load(text, Loader=YAML_SAFE_LOADER)
     except Exception as ex:
       self.__bad_files[self.url_to_bom_name(url)] = exception_to_message(ex)
       maybe_log_exception('load_from_from_url', ex,
                           action_msg='Skipping %s' % url)
       return None
 
+  def load_bom_from_path(self, url, path):
+    """Returns the bom specification dict from a local copy of url."""
+    try:
+      if path is None:
+        raise_and_log_error(UnexpectedError('Could not download ' + url))
+      with open(path, 'r') as stream:
+        return yaml.load(stream, Loader=YAML_SAFE_LOADER)
+    except Exception as ex:
+      self.__bad_files[self.url_to_bom_name(url)] = exception_to_message(ex)
+      maybe_log_exception('load_bom_from_path', ex,
+                          action_msg='Skipping %s' % url)
+      return None
+
   def extract_bom_info(self, bom):
     """Return a minimal dict identifying this BOM.
 
@@ -192,16 +215,12 @@ class CollectBomVersions(CommandProcessor):
     return info
 
   def analyze_bom(self, bom):
-    """Analyzes one bom and breaks it down into this threads result_map.
+    """Analyzes one bom and adds its service builds to the service table.
 
-    Boms are processed within a single thread, but multiple boms can be
-    processed in different threads.
+    This assumes a single threaded environment.
     """
-    tid = current_thread().name
-    thread_service_map = self.__per_thread_result_map.get(tid, {})
-    self.__per_thread_result_map[tid] = thread_service_map
-
     bom_info = self.extract_bom_info(bom)
+    builds = []
     for name, entry in bom['services'].items():
       if name == 'defaultArtifact':
         continue
@@ -214,105 +233,113 @@ class CollectBomVersions(CommandProcessor):
         version, buildnum = parts
 
       commit = entry.get('commit', 'NotRecorded')
-      service_record = thread_service_map.get(name)
-      if service_record is None:
-        service_record = {}
-        thread_service_map[name] = service_record
-      version_map = service_record.get(version)
-      if version_map is None:
-        version_map = {}
-        service_record[version] = version_map
-      commit_map = version_map.get(commit)
-      if commit_map is None:
-        commit_map = {}
-        version_map[commit] = commit_map
-      build_list = commit_map.get(buildnum)
-      if build_list is None:
-        build_list = []
-        commit_map[buildnum] = build_list
-
-      build_list.append(bom_info)
+      builds.append((name, version, commit, buildnum))
+
+    self.__service_table.add_bom(bom_info, builds)
 
   def ingest_bom(self, line):
     """Function to ingest a single bom into the result map."""
-    bom = self.load_bom_from_url(line)
+    self.ingest_loaded_bom(line, self.load_bom_from_url(line))
+
+  def ingest_bom_file(self, url_and_path):
+    """Function to ingest a single downloaded bom into the result map."""
+    url, path = url_and_path
+    self.ingest_loaded_bom(url, self.load_bom_from_path(url, path))
+
+  def make_bom_skeleton(self, bom):
+    """Return just the parts of the bom that analyze_bom looks at."""
+    skeleton = {'version': bom['version'], 'services': {}}
+    if 'timestamp' in bom:
+      skeleton['timestamp'] = bom['timestamp']
+    artifact_sources = bom.get('artifactSources')
+    if artifact_sources is not None:
+      skeleton['artifactSources'] = {
+          name: artifact_sources[name]
+          for name in ['dockerRegistry', 'debianRepository']}
+    for name, entry in bom['services'].items():
+      if name == 'defaultArtifact':
+        continue
+      service = {'version': entry['version']}
+      if 'commit' in entry:
+        service['commit'] = entry['commit']
+      skeleton['services'][name] = service
+    return skeleton
+
+  def ingest_loaded_bom(self, line, bom):
+    """Record the bom that was loaded from the given url into the index.
+
+    The bom itself is analyzed later, along with the boms from prior runs.
+    """
     if not bom:
       return
+    generation = self.__bom_generations.get(line)
     try:
       if bom['version'] + '.yml' != line[line.rfind('/') + 1:]:
         message = 'BOM version "%s" != filename "%s"' % (bom['version'], line)
-        self.__bad_files[self.url_to_bom_name(line.strip())] = message
         logging.warning(message)
         raise_and_log_error(UnexpectedError(message))
-      self.analyze_bom(bom)
+      self.__bom_index.record(line, generation,
+                              bom=self.make_bom_skeleton(bom))
     except Exception as ex:
-      self.__bad_files[self.url_to_bom_name(line.strip())] = (
-          exception_to_message(ex))
+      self.__bom_index.record(line, generation,
+                              error=exception_to_message(ex))
       maybe_log_exception('analyze_bom', ex,
                           action_msg='Skipping %s' % line)
 
-  def join_result_maps(self):
-    """Join the individual thread result maps into a single one.
+  def ingest_bom_list(self, bom_list):
+    """Ingest each of the boms.
 
-    This assumes a single threaded environment.
-    """
-    def join_buildnums(commit_buildnums, result_buildnums):
-      for buildnum, info_list in commit_buildnums.items():
-        result_info_list = result_buildnums.get(buildnum)
-        if result_info_list is None:
-          result_info_list = []
-          result_buildnums[buildnum] = result_info_list
-        result_info_list.extend(info_list)
-        result_info_list.sort(key=lambda info: info['bom_timestamp'])
-
-    def join_commits(commit_map, result_commits):
-      for commit, commit_buildnums in commit_map.items():
-        result_buildnums = result_commits.get(commit)
-        if result_buildnums is None:
-          result_buildnums = {}
-          result_commits[commit] = result_buildnums
-        join_buildnums(commit_buildnums, result_buildnums)
-
-    def join_versions(version_map, result_versions):
-      for version, commit_map in version_map.items():
-        result_commits = result_versions.get(version)
-        if result_commits is None:
-          result_commits = {}
-          result_versions[version] = result_commits
-        join_commits(commit_map, result_commits)
-
-    def join_results(thread_results, result_map):
-      for name, version_map in thread_results.items():
-        result_versions = result_map.get(name)
-        if result_versions is None:
-          result_versions = {}
-          result_map[name] = result_versions
-        join_versions(version_map, result_versions)
-
-    result_map = {}
-    for thread_results in self.__per_thread_result_map.values():
-      join_results(thread_results, result_map)
-    return result_map
+    Only boms that are not already in the index from a previous run are
+    read. These are downloaded in batches and each is ingested as soon as
+    it is available locally rather than waiting for all of them.
 
-  def ingest_bom_list(self, bom_list):
-    """Ingest each of the boms."""
-    max_threads = 1 if self.options.one_at_a_time else 64
-    pool = ThreadPool(min(max_threads, len(bom_list)))
-    pool.map(self.ingest_bom, bom_list)
-    pool.close()
-    pool.join()
-    return self.join_result_maps()
+    Returns:
+      The BomServiceTable for all the boms.
+    """
+    generations = self.__bom_generations
+    new_boms = [url for url in bom_list
+                if self.__bom_index.lookup(url, generations.get(url)) is None]
+    logging.info('Ingesting %d new boms and reusing %d from %s',
+                 len(new_boms), len(bom_list) - len(new_boms),
+                 self.__bom_index.path)
+    if new_boms:
+      max_threads = 1 if self.options.one_at_a_time else 16
+      fetched = self.__bom_cache.fetch(
+          [(url, generations.get(url)) for url in new_boms])
+      pool = ThreadPool(min(max_threads, len(new_boms)))
+      for _ in pool.imap_unordered(self.ingest_bom_file, fetched):
+        pass
+      pool.close()
+      pool.join()
+
+    for url in bom_list:
+      entry = self.__bom_index.lookup(url, generations.get(url))
+      if entry is None:
+        continue  # It could not be loaded so is already a bad file.
+      if 'error' in entry:
+        self.__bad_files[self.url_to_bom_name(url)] = entry['error']
+        continue
+      try:
+        self.analyze_bom(entry['bom'])
+      except Exception as ex:
+        self.__bad_files[self.url_to_bom_name(url)] = exception_to_message(ex)
+        maybe_log_exception('analyze_bom', ex,
+                            action_msg='Skipping %s' % url)
+    return self.__service_table
 
   def list_bom_urls(self, gcs_dir_url_prefix):
     """Get a list of all the bom versions that exist."""
-    result = check_subprocess('gsutil ls ' + gcs_dir_url_prefix)
-    return [line for line in result.split('\n')
-            if line.startswith(gcs_dir_url_prefix) and line.endswith('.yml')]
+    result = []
+    for url, generation in self.__bom_cache.list_objects(
+        gcs_dir_url_prefix, suffix='.yml'):
+      self.__bom_generations[url] = generation
+      result.append(url)
+    return result
 
   def _do_command(self):
     """Reads the list of boms, then concurrently processes them.
 
-    Ultimately it will write out the analysis into bom_service_map.yml
+    Ultimately it will write out the analysis into *_bom_service_map.jsonl
     """
     options = self.options
     url_prefix = 'gs://%s/bom/' % options.halyard_bom_bucket
@@ -322,19 +349,16 @@ class CollectBomVersions(CommandProcessor):
     results = self.list_bom_urls(url_prefix)
     write_to_path('\n'.join(sorted(results)),
                   os.path.join(self.get_output_dir(), 'bom_list.txt'))
-    result_map = self.ingest_bom_list(results)
-
-    path = os.path.join(self.get_output_dir(), 'all_bom_service_map.yml')
-    logging.info('Writing bom analysis to %s', path)
-    write_to_path(yaml.safe_dump(result_map, default_flow_style=False), path)
+    service_table = self.ingest_bom_list(results)
+    self.__bom_index.forget_missing(url_prefix, results)
+    self.__bom_index.save()
 
-    partition_names = ['released', 'unreleased']
-    partitions = self.partition_service_map(result_map)
-    for index, data in enumerate(partitions):
-      path = os.path.join(self.get_output_dir(),
-                          partition_names[index] + '_bom_service_map.yml')
-      logging.info('Writing bom analysis to %s', path)
-      write_to_path(yaml.safe_dump(data, default_flow_style=False), path)
+    released, unreleased = service_table.partition(
+        self.RELEASED_VERSION_MATCHER)
+    for name, table in [('all', service_table),
+                        ('released', released),
+                        ('unreleased', unreleased)]:
+      self.write_service_table(name + '_bom_service_map', table)
 
     if self.__bad_files:
       path = os.path.join(self.get_output_dir(), 'bad_boms.txt')
@@ -358,65 +382,24 @@ class CollectBomVersions(CommandProcessor):
     logging.info('Writing to %s', path)
     write_to_path(yaml.safe_dump(config, default_flow_style=False), path)
 
-  def partition_service_map(self, result_map):
-    def partition_info_list(info_list):
-      released = []
-      unreleased = []
-      for info in info_list:
-        if self.RELEASED_VERSION_MATCHER.match(info['bom_version']):
-          released.append(info)
-        else:
-          unreleased.append(info)
-
-      if released:
-        # If we released this somewhere, then it isnt unreleased.
-        unreleased = []
-
-      return released, unreleased
-
-    def partition_buildnum_map(buildnum_map):
-      released = {}
-      unreleased = {}
-      for buildnum, info_list in buildnum_map.items():
-        results = partition_info_list(info_list)
-        if results[0]:
-          released[buildnum] = results[0]
-        if results[1]:
-          unreleased[buildnum] = results[1]
-      return released, unreleased
-
-    def partition_commit_map(commit_map):
-      released = {}
-      unreleased = {}
-      for commit, buildnum_map in commit_map.items():
-        results = partition_buildnum_map(buildnum_map)
-        if results[0]:
-          released[commit] = results[0]
-        if results[1]:
-          unreleased[commit] = results[1]
-      return released, unreleased
-
-    def partition_version_map(version_map):
-      released = {}
-      unreleased = {}
-      for version, commit_map in version_map.items():
-        results = partition_commit_map(commit_map)
-        if results[0]:
-          released[version] = results[0]
-        if results[1]:
-          unreleased[version] = results[1]
-      if not released:
-        released = None
-      if not unreleased:
-        unreleased = None
-      return released, unreleased
-
-    released = {}
-    unreleased = {}
-    for name, version_map in result_map.items():
-      released[name], unreleased[name] = partition_version_map(version_map)
-
-    return released, unreleased
+  def write_service_table(self, basename, table):
+    """Write the table into the output directory.
+
+    The table is always written as JSON lines for other commands to read.
+    It is also expanded into a yaml service map if --bom_service_map_yaml.
+    """
+    path = os.path.join(self.get_output_dir(), basename + '.jsonl')
+    logging.info('Writing bom analysis to %s', path)
+    ensure_dir_exists(os.path.dirname(path))
+    with open(path, 'w') as stream:
+      table.write(stream)
+
+    if self.options.bom_service_map_yaml:
+      path = os.path.join(self.get_output_dir(), basename + '.yml')
+      logging.info('Writing bom analysis to %s', path)
+      write_to_path(yaml.safe_dump(table.to_service_map(),
+                                   default_flow_style=False),
+                    path)
 
 
 class CollectBomVersionsFactory(CommandFactory):
@@ -432,6 +415,13 @@ class CollectBomVersionsFactory(CommandFactory):
     self.add_argument(
         parser, 'halyard_bom_bucket', defaults, 'halconfig',
         help='The bucket managing halyard BOMs and config profiles.')
+    self.add_argument(
+        parser, 'bom_cache_dir', defaults, None,
+        help='The directory to cache downloaded boms in between runs.'
+             ' The default is within the --input_dir.')
+    self.add_argument(
+        parser, 'bom_service_map_yaml', defaults, False, type=bool,
+        help='Also write the bom service maps as yaml for review.')
     self.add_argument(
         parser, 'docker_registry', defaults, None,
         help='The expected docker registry in boms.')
@@ -467,55 +457,17 @@ class CollectArtifactVersions(CommandProcessor):
     check_options_set(options,
                       ['docker_registry', 'bintray_org',
                        'bintray_jar_repository', 'bintray_debian_repository'])
-    user = os.environ.get('BINTRAY_USER')
-    password = os.environ.get('BINTRAY_KEY')
-    if user and password:
-      user_password = '{user}:{password}'.format(user=user, password=password)
-      encoded_auth = base64.b64encode(user_password)
-      self.__basic_auth = 'Basic %s' % encoded_auth.decode()
-    else:
-      self.__basic_auth = None
+    self.__bintray = BintrayClient.get_shared(options)
 
   def fetch_bintray_url(self, bintray_url):
-    request = Request(bintray_url)
-    if self.__basic_auth:
-      request.add_header('Authorization', self.__basic_auth)
-    try:
-      response = urlopen(request)
-      headers = response.info()
-      payload = response.read()
-      content = json.JSONDecoder().decode(payload.decode())
-    except HTTPError as ex:
-      raise_and_log_error(
-          ResponseError('Bintray failure: {}'.format(ex),
-                        server='bintray.api'),
-          'Failed on url=%s: %s' % (bintray_url, exception_to_message(ex)))
-    except Exception as ex:
-      raise
-    return headers, content
+    response = self.__bintray.check_request('GET', bintray_url)
+    return response.headers, response.json()
 
   def list_bintray_packages(self, subject_repo):
-    path = 'repos/%s/packages' % subject_repo
-    base_url = 'https://api.bintray.com/' + path
-    result = []
-    while True:
-      url = base_url + '?start_pos=%d' % len(result)
-      headers, content = self.fetch_bintray_url(url)
-      # logging.debug('Bintray responded with headers\n%s', headers)
-      total = headers.get('X-RangeLimit-Total', 0)
-      result.extend(['%s/%s' % (subject_repo, entry['name'])
-                     for entry in content])
-      if len(result) >= total:
-        break
-    return result
+    return self.__bintray.list_packages(subject_repo)
 
   def query_bintray_package_versions(self, package_path):
-    path = 'packages/' + package_path
-    url = 'https://api.bintray.com/' + path
-    _, content = self.fetch_bintray_url(url)
-    # logging.debug('Bintray responded with headers\n%s', headers)
-    package_name = package_path[package_path.rfind('/') + 1:]
-    return (package_name, content['versions'])
+    return self.__bintray.query_package_versions(package_path)
 
   def difference(self, versions, target):
     missing = []
@@ -587,38 +539,16 @@ class CollectArtifactVersions(CommandProcessor):
     return results[0], results[1]
 
   def query_gcr_image_versions(self, image):
-    options = self.options
-    command_parts = ['gcloud',
-                     '--format=json',
-                     'container images list-tags',
-                     image, '--limit 10000']
-    if options.gcb_service_account:
-      command_parts.extend(['--account', options.gcb_service_account])
-    response = check_subprocess(' '.join(command_parts))
-    result = []
-    for version in json.JSONDecoder().decode(response):
-      result.extend(version['tags'])
-    return (image[image.rfind('/') + 1:], result)
+    inventory = RegistryTagInventory.from_options(self.options)
+    name = image[image.rfind('/') + 1:]
+    return (name, sorted(inventory.image_tags(name)))
 
-  def collect_gcb_versions(self, pool):
+  def collect_gcb_versions(self):
     options = self.options
     logging.debug('Collecting GCB versions from %s', options.docker_registry)
-    command_parts = ['gcloud',
-                     '--format=json',
-                     'container images list',
-                     '--repository', options.docker_registry]
     if options.gcb_service_account:
       logging.debug('Using account %s', options.gcb_service_account)
-      command_parts.extend(['--account', options.gcb_service_account])
-
-    response = check_subprocess(' '.join(command_parts))
-    images = [entry['name']
-              for entry in json.JSONDecoder().decode(response)]
-    image_versions = pool.map(self.query_gcr_image_versions, images)
-
-    image_map = {}
-    for name, versions in image_versions:
-      image_map[name] = versions
+    image_map = RegistryTagInventory.from_options(options).tag_map()
 
     path = os.path.join(
         self.get_output_dir(),
@@ -633,16 +563,12 @@ class CollectArtifactVersions(CommandProcessor):
     options = self.options
     project = options.publish_gce_image_project
     logging.debug('Collecting GCE image versions from %s', project)
-    command_parts = ['gcloud', '--format=json',
-                     'compute images list', '--project', project,
-                     '--filter spinnaker-']
     if options.build_gce_service_account:
       logging.debug('Using account %s', options.build_gce_service_account)
-      command_parts.extend(['--account', options.build_gce_service_account])
-
-    response = check_subprocess(' '.join(command_parts))
-    images = [entry['name']
-              for entry in json.JSONDecoder().decode(response)]
+    inventory = GceImageInventory.get_shared(
+        project, account=options.build_gce_service_account,
+        ttl_secs=options.gce_image_inventory_ttl_secs)
+    images = inventory.image_names()
     image_map = {}
     for name in images:
       parts = name.split('-', 2)
@@ -709,7 +635,7 @@ class CollectArtifactVersions(CommandProcessor):
   def _do_command(self):
     pool = ThreadPool(16)
     bintray_jars, bintray_debians = self.collect_bintray_versions(pool)
-    self.collect_gcb_versions(pool)
+    self.collect_gcb_versions()
     self.collect_gce_image_versions()
     self.collect_config_bucket_versions()
     pool.close()
@@ -763,6 +689,7 @@ class CollectArtifactVersionsFactory(CommandFactory):
     self.add_argument(
         parser, 'bintray_debian_repository', defaults, None,
         help='bintray repository in the bintray_org containing debians.')
+    BintrayClient.add_parser_args(parser, defaults)
     self.add_argument(
         parser, 'version_name_prefix', defaults, None,
         help='Prefix for bintray versions to collect.')
@@ -775,6 +702,8 @@ class CollectArtifactVersionsFactory(CommandFactory):
     self.add_argument(
         parser, 'build_gce_service_account', defaults, None,
         help='The service account to use with the gce project.')
+    RegistryTagInventory.add_parser_args(parser, defaults)
+    GceImageInventory.add_parser_args(parser, defaults)
     self.add_argument(
         parser, 'publish_gce_image_project', defaults, None,
         help='The GCE project to collect images from.')
@@ -843,15 +772,34 @@ class AuditArtifactVersions(CommandProcessor):
 
     logging.debug('Loading container image versions from "%s"', gcr_paths[0])
     with open(gcr_paths[0], 'r') as stream:
-      self.__container_versions = yaml.safe_load(stream.read())
+      self.__container_versions = yaml.load(stream, Loader=YAML_SAFE_LOADER)
     with open(jar_paths[0], 'r') as stream:
-      self.__jar_versions = yaml.safe_load(stream.read())
+      self.__jar_versions = yaml.load(stream, Loader=YAML_SAFE_LOADER)
     with open(debian_paths[0], 'r') as stream:
-      self.__debian_versions = yaml.safe_load(stream.read())
+      self.__debian_versions = yaml.load(stream, Loader=YAML_SAFE_LOADER)
     with open(image_paths[0], 'r') as stream:
-      self.__gce_image_versions = yaml.safe_load(stream.read())
+      self.__gce_image_versions = yaml.load(stream, Loader=YAML_SAFE_LOADER)
     with open(config_paths[0], 'r') as stream:
-      self.__config_versions = yaml.safe_load(stream.read())
+      self.__config_versions = yaml.load(stream, Loader=YAML_SAFE_LOADER)
+
+  @staticmethod
+  def load_bom_service_map(bom_data_dir, basename, what):
+    """Load a service map written by collect_bom_versions.
+
+    This reads the compact BomServiceTable if it is there, falling back on
+    the yaml service map.
+    """
+    path = os.path.join(bom_data_dir, basename + '.jsonl')
+    if os.path.exists(path):
+      logging.debug('Loading %s from "%s"', what, path)
+      with open(path, 'r') as stream:
+        return BomServiceTable.read(stream).to_service_map()
+
+    path = os.path.join(bom_data_dir, basename + '.yml')
+    check_path_exists(path, what)
+    logging.debug('Loading %s from "%s"', what, path)
+    with open(path, 'r') as stream:
+      return yaml.load(stream, Loader=YAML_SAFE_LOADER)
 
   def __extract_all_bom_versions(self, bom_map):
     result = set([])
@@ -924,28 +872,25 @@ class AuditArtifactVersions(CommandProcessor):
     self.__min_semver = SemanticVersion.make('ignored-' + min_version)
 
     bom_data_dir = os.path.join(base_path, 'collect_bom_versions')
-    path = os.path.join(bom_data_dir, 'released_bom_service_map.yml')
-    check_path_exists(path, 'released bom analysis')
-    with open(path, 'r') as stream:
-      self.__all_released_boms = {}      # forever
-      self.__current_released_boms = {}  # since min_version to audit
-      for service, versions in yaml.safe_load(stream.read()).items():
-        if not versions:
-          # e.g. this service has not yet been released.
-          logging.info('No versions for service=%s', service)
-          continue
+    released_boms = self.load_bom_service_map(
+        bom_data_dir, 'released_bom_service_map', 'released bom analysis')
+    self.__all_released_boms = {}      # forever
+    self.__current_released_boms = {}  # since min_version to audit
+    for service, versions in released_boms.items():
+      if not versions:
+        # e.g. this service has not yet been released.
+        logging.info('No versions for service=%s', service)
+        continue
 
-        self.__all_released_boms[service] = versions
-        self.__current_released_boms[service] = versions
-        stripped_versions = self.__remove_old_bom_versions(
-            self.__min_semver, versions)
-        if stripped_versions:
-          self.__current_released_boms[service] = stripped_versions
+      self.__all_released_boms[service] = versions
+      self.__current_released_boms[service] = versions
+      stripped_versions = self.__remove_old_bom_versions(
+          self.__min_semver, versions)
+      if stripped_versions:
+        self.__current_released_boms[service] = stripped_versions
 
-    path = os.path.join(bom_data_dir, 'unreleased_bom_service_map.yml')
-    check_path_exists(path, 'unreleased bom analysis')
-    with open(path, 'r') as stream:
-      self.__unreleased_boms = yaml.safe_load(stream.read())
+    self.__unreleased_boms = self.load_bom_service_map(
+        bom_data_dir, 'unreleased_bom_service_map', 'unreleased bom analysis')
 
     self.__only_bad_and_invalid_boms = False
     self.__all_bom_versions = self.__extract_all_bom_versions(
@@ -19,6 +19,7 @@ import logging
 from buildtool import add_parser_argument
 from buildtool.inmemory_metrics import InMemoryMetricsRegistry
 from buildtool.influxdb_metrics import InfluxDbMetricsRegistry
+from buildtool.prometheus_metrics import PrometheusMetricsRegistry
 
 
 class MetricsManager(object):
@@ -38,15 +39,23 @@ class MetricsManager(object):
     """Init argparser with metrics-related options."""
     InMemoryMetricsRegistry.init_argument_parser(parser, defaults)
     InfluxDbMetricsRegistry.init_argument_parser(parser, defaults)
+    PrometheusMetricsRegistry.init_argument_parser(parser, defaults)
     add_parser_argument(
         parser, 'monitoring_enabled', defaults, False, type=bool,
         help='Enable monitoring to stackdriver.')
     add_parser_argument(
         parser, 'monitoring_flush_frequency', defaults, 15,
         help='Frequency at which to push metrics in seconds.')
+    add_parser_argument(
+        parser, 'monitoring_thread_local_metrics', defaults, False, type=bool,
+        help='Have each thread queue its counter and timer updates, which'
+             ' are then merged when metrics are flushed. This reduces lock'
+             ' contention between busy threads, but counter and timer values'
+             ' lag until the next flush or until the thread has queued'
+             ' enough updates to merge them itself.')
     add_parser_argument(
         parser, 'monitoring_system', defaults, 'file',
-        choices=['file', 'influxdb'],
+        choices=['file', 'influxdb', 'prometheus'],
         help='Where to store metrics.')
     add_parser_argument(
         parser, 'monitoring_context_labels', defaults, None,
@@ -59,7 +68,8 @@ class MetricsManager(object):
     """Startup metrics module with concrete system."""
     monitoring_systems = {
         'file': InMemoryMetricsRegistry,
-        'influxdb': InfluxDbMetricsRegistry
+        'influxdb': InfluxDbMetricsRegistry,
+        'prometheus': PrometheusMetricsRegistry
     }
     klas = monitoring_systems[options.monitoring_system]
     logging.debug('Initializing monitoring with system="%s"', klas.__name__)
@@ -0,0 +1,218 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Metrics support via the Prometheus text exposition format.
+
+https://prometheus.io/docs/instrumenting/exposition_formats/
+
+This gives live visibility into long running jobs without a push backend.
+The registry serves the current metric values from /metrics on a local
+HTTP server that Prometheus can scrape, and can also write them to a file
+for the node exporter's textfile collector. It still keeps everything the
+in-memory registry does, and renders directly from its metric instances.
+
+Counters are exposed as "<name>_total". Timers are exposed as summaries
+named "<name>_seconds" with quantiles estimated from their LatencyHistogram.
+"""
+
+import logging
+import os
+import re
+import threading
+
+try:
+  from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+  from SocketServer import ThreadingMixIn
+except ImportError:
+  from http.server import BaseHTTPRequestHandler, HTTPServer
+  from socketserver import ThreadingMixIn
+
+from buildtool import (
+    add_parser_argument,
+    write_to_path)
+
+from buildtool.base_metrics import MetricFamily
+from buildtool.inmemory_metrics import InMemoryMetricsRegistry
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_INVALID_NAME_CHARS = re.compile(r'[^a-zA-Z0-9_:]')
+
+
+def _to_name(name):
+  name = _INVALID_NAME_CHARS.sub('_', name)
+  return '_' + name if name[:1].isdigit() else name
+
+
+def _escape_label_value(value):
+  if isinstance(value, bool):
+    value = 'true' if value else 'false'
+  return (str(value).replace('\\', r'\\')
+          .replace('\n', r'\n').replace('"', r'\"'))
+
+
+def _to_label_text(labels, extra=None):
+  items = sorted(labels.items()) + (extra or [])
+  if not items:
+    return ''
+  return '{%s}' % ','.join('{0}="{1}"'.format(_to_name(key),
+                                               _escape_label_value(value))
+                           for key, value in items)
+
+
+def _to_value_text(value):
+  if value is None:
+    return 'NaN'
+  return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+  """Serves the registry's metrics from /metrics."""
+
+  def do_GET(self):
+    # pylint: disable=invalid-name
+    if self.path.split('?')[0] != '/metrics':
+      self.send_error(404)
+      return
+    body = self.server.registry.render_text().encode('utf-8')
+    self.send_response(200)
+    self.send_header('Content-Type', CONTENT_TYPE)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, fmt, *pos_args):
+    logging.debug('Prometheus scrape: ' + fmt, *pos_args)
+
+
+class PrometheusMetricsRegistry(InMemoryMetricsRegistry):
+  """Exposes the in-memory metrics in the Prometheus text format."""
+
+  @staticmethod
+  def init_argument_parser(parser, defaults):
+    """Initialize argument parser with prometheus parameters."""
+    InMemoryMetricsRegistry.init_argument_parser(parser, defaults)
+    if hasattr(parser, 'added_prometheus'):
+      return
+    parser.added_prometheus = True
+    add_parser_argument(
+        parser, 'prometheus_port', defaults, 0, type=int,
+        help='The port to serve /metrics from. 0 picks an unused port,'
+             ' which is logged. A negative port does not serve at all.')
+    add_parser_argument(
+        parser, 'prometheus_address', defaults, 'localhost',
+        help='The interface to serve /metrics on.')
+    add_parser_argument(
+        parser, 'prometheus_textfile', defaults, None,
+        help='If set, write the metrics to this file whenever they are'
+             ' flushed, such as for the node exporter textfile collector'
+             ' (which expects a ".prom" suffix).')
+
+  @property
+  def server_port(self):
+    """The port serving /metrics or None."""
+    return self.__server.server_address[1] if self.__server else None
+
+  def __init__(self, options):
+    super(PrometheusMetricsRegistry, self).__init__(options)
+    self.__server = None
+    if not options.monitoring_enabled or options.prometheus_port < 0:
+      return
+
+    self.__server = _ThreadingHTTPServer(
+        (options.prometheus_address, options.prometheus_port),
+        _MetricsRequestHandler)
+    self.__server.registry = self
+    thread = threading.Thread(name='PrometheusServer',
+                              target=self.__server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    logging.info('Serving prometheus metrics from http://%s:%d/metrics',
+                 options.prometheus_address, self.server_port)
+
+  def render_text(self):
+    """Returns the current metrics in the Prometheus text format."""
+    self.merge_thread_local_metrics()
+    lines = []
+    render = {
+        MetricFamily.COUNTER: self.__render_counter,
+        MetricFamily.GAUGE: self.__render_gauge,
+        MetricFamily.TIMER: self.__render_timer
+    }
+    for family in sorted(self.metric_family_list, key=lambda f: f.name):
+      render[family.family_type](family, list(family.instance_list), lines)
+    lines.append('')
+    return '\n'.join(lines)
+
+  @staticmethod
+  def __render_counter(family, metrics, lines):
+    name = _to_name(family.name) + '_total'
+    lines.append('# TYPE {0} counter'.format(name))
+    for metric in metrics:
+      lines.append('{0}{1} {2}'.format(
+          name, _to_label_text(metric.labels), _to_value_text(metric.count)))
+
+  @staticmethod
+  def __render_gauge(family, metrics, lines):
+    name = _to_name(family.name)
+    lines.append('# TYPE {0} gauge'.format(name))
+    for metric in metrics:
+      lines.append('{0}{1} {2}'.format(
+          name, _to_label_text(metric.labels), _to_value_text(metric.value)))
+
+  @staticmethod
+  def __render_timer(family, metrics, lines):
+    name = _to_name(family.name) + '_seconds'
+    lines.append('# TYPE {0} summary'.format(name))
+    for metric in metrics:
+      histogram = metric.histogram
+      for percent in metric.PERCENTILES:
+        quantile = [('quantile', str(percent / 100.0))]
+        lines.append('{0}{1} {2}'.format(
+            name, _to_label_text(metric.labels, quantile),
+            _to_value_text(histogram.percentile(percent))))
+      label_text = _to_label_text(metric.labels)
+      lines.append('{0}_sum{1} {2}'.format(
+          name, label_text, _to_value_text(metric.total_seconds)))
+      lines.append('{0}_count{1} {2}'.format(
+          name, label_text, _to_value_text(metric.count)))
+
+  def __write_textfile(self):
+    path = self.options.prometheus_textfile
+    if not path:
+      return
+    # Use intermediate temp file so the collector never sees a partial file.
+    tmp_path = path + '.tmp'
+    write_to_path(self.render_text(), tmp_path)
+    os.rename(tmp_path, path)
+
+  def _do_flush_updated_metrics(self, updated_metrics):
+    """Implements interface."""
+    super(PrometheusMetricsRegistry, self)._do_flush_updated_metrics(
+        updated_metrics)
+    self.__write_textfile()
+
+  def _do_flush_final_metrics(self):
+    """Implements interface."""
+    super(PrometheusMetricsRegistry, self)._do_flush_final_metrics()
+    self.__write_textfile()
+    if self.__server is not None:
+      self.__server.shutdown()
+      self.__server.server_close()
+      self.__server = None
@@ -15,12 +15,15 @@
 """Abstract CommandProcessor classes for commands on repositories and boms."""
 
 import logging
+import os
 
 # pylint: disable=relative-import
 from buildtool import (
     CommandProcessor,
     CommandFactory,
-    maybe_log_exception)
+    ConfigError,
+    maybe_log_exception,
+    raise_and_log_error)
 
 
 def _do_call_do_repository(repository, command):
@@ -53,6 +56,12 @@ class RepositoryCommandProcessor(CommandProcessor):
   Derived classes should override _do_repository() rather than _do_command().
   """
 
+  # Whether the command can run with --repository_executor=process.
+  # Only enable this for commands whose _do_repository returns what
+  # _do_postprocess needs rather than recording it on the command, since
+  # that would be lost in the worker process.
+  SUPPORTS_PROCESS_EXECUTOR = False
+
   @property
   def bom(self):
     """Return the bom, if one is bound."""
@@ -86,6 +95,11 @@ class RepositoryCommandProcessor(CommandProcessor):
 
     super(RepositoryCommandProcessor, self).__init__(
         factory, options, **kwargs)
+    if (vars(options).get('repository_executor') == 'process'
+        and not self.SUPPORTS_PROCESS_EXECUTOR):
+      raise_and_log_error(ConfigError(
+          '{name} does not support --repository_executor=process'.format(
+              name=factory.name)))
     self.__scm = factory.make_scm(options, self.get_input_dir(),
                                   max_threads=max_threads)
 
@@ -109,6 +123,16 @@ class RepositoryCommandProcessor(CommandProcessor):
     """Prepare the repository.git_dir."""
     self.__scm.ensure_local_repository(repository)
 
+  def prefetch_remote_refs(self):
+    """List the refs of every source repository not already cloned.
+
+    The repositories are listed concurrently so that later skip checks
+    can compare against the remote branches without cloning them.
+    """
+    self.git.remote_refs().prefetch(
+        [repository.origin for repository in self.source_repositories
+         if repository.origin and not os.path.exists(repository.git_dir)])
+
   def filter_repositories(self, source_repositories):
     """Filter a list of source_repositories using option constraints."""
     # pylint: disable=unused-argument
@@ -140,9 +164,18 @@ class RepositoryCommandProcessor(CommandProcessor):
 
     They can also implement _do_preprocess or _do_postprocess to inject
     behavior before processing any repositories or after processing all them.
+
+    With --repository_executor=process, _do_repository runs in a worker
+    process so should return what _do_postprocess needs rather than
+    recording it on the command. Commands that do so enable
+    SUPPORTS_PROCESS_EXECUTOR.
     """
     self._do_preprocess()
-    result_dict = self.__scm.foreach_source_repository(
+    if vars(self.options).get('repository_executor') == 'process':
+      foreach = self.__scm.foreach_source_repository_in_processes
+    else:
+      foreach = self.__scm.foreach_source_repository
+    result_dict = foreach(
         self.source_repositories, _do_call_do_repository, self)
     return self._do_postprocess(result_dict)
 
@@ -171,7 +204,7 @@ class RepositoryCommandProcessor(CommandProcessor):
           'SkipRepositoryCommand',
           {'command': self.name, 'repository': repository.name})
       logging.debug('Skipping repository %s', repository.name)
-      return None
+      return self._do_skipped_repository(repository)
 
     self.ensure_local_repository(repository)
     return self._do_repository(repository)
@@ -183,6 +216,16 @@ class RepositoryCommandProcessor(CommandProcessor):
     """
     return False
 
+  def _do_skipped_repository(self, repository):
+    """Returns the result for a repository that was skipped.
+
+    This is called in the same process as _do_can_skip_repository, so is
+    where to return anything the skip check learned that _do_postprocess
+    needs.
+    """
+    # pylint: disable=unused-argument
+    return None
+
   def _do_repository(self, repository):
     """This should be overriden to implement actual behavior."""
     raise NotImplementedError(
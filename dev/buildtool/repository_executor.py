@@ -0,0 +1,359 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A shared executor for running work across source repositories.
+
+A single RepositoryExecutor is shared by all the repository processing
+within a buildtool run. Worker threads are created on demand up to a
+bound and are reused between calls, so the preprocess, per-repository and
+postprocess phases of a command do not each pay for a new pool.
+
+Work is handed to idle workers from a shared queue so a slow repository
+only occupies its own worker. Results are reported in completion order
+as RepositoryOutcome instances, which capture failures (and timeouts)
+rather than abandoning the remaining repositories.
+
+The executor also manages named resource limits so that expensive
+operations (e.g. git network traffic, gradle builds, gcloud calls) can be
+bounded independent of how many repositories are in flight.
+"""
+
+import collections
+import logging
+import threading
+import time
+
+try:
+  from Queue import Queue, Empty
+except ImportError:
+  from queue import Queue, Empty
+
+from buildtool import (
+    add_parser_argument,
+    TimeoutError)
+
+
+# Names of the resources whose concurrency can be bounded.
+GIT_NETWORK_RESOURCE = 'git_network'
+GRADLE_RESOURCE = 'gradle'
+GCLOUD_RESOURCE = 'gcloud'
+
+
+class RepositoryOutcome(
+    collections.namedtuple('RepositoryOutcome',
+                           ['name', 'value', 'error', 'elapsed_secs'])):
+  """The result of running a function on an individual repository.
+
+  Attributes:
+    name: [string] The repository name.
+    value: [any] The value returned by the function, if it succeeded.
+    error: [Exception] The exception raised by the function, if it failed.
+    elapsed_secs: [float] How long the function took.
+  """
+
+  @property
+  def ok(self):
+    return self.error is None
+
+
+class RepositoryExecutor(object):
+  """A bounded, reusable pool of worker threads for repository work."""
+
+  __SINGLETON = None
+  __SINGLETON_LOCK = threading.Lock()
+  __RESOURCE_LIMITS = {}
+  __RESOURCE_LOCK = threading.Lock()
+
+  @staticmethod
+  def add_parser_args(parser, defaults):
+    """Add parser arguments controlling repository concurrency."""
+    if hasattr(parser, 'added_repository_executor'):
+      return
+    parser.added_repository_executor = True
+
+    add_parser_argument(
+        parser, 'repository_timeout_secs', defaults, None, type=int,
+        help='If set, then give up on an individual repository if it takes'
+             ' longer than this. The other repositories are unaffected.')
+    add_parser_argument(
+        parser, 'max_git_network_concurrency', defaults, 16, type=int,
+        help='Maximum number of concurrent git clone/fetch/push operations.')
+    add_parser_argument(
+        parser, 'max_gcloud_concurrency', defaults, 16, type=int,
+        help='Maximum number of concurrent gcloud invocations.')
+    add_parser_argument(
+        parser, 'repository_executor', defaults, 'thread',
+        choices=['thread', 'process'],
+        help='How repository commands run their repositories concurrently.'
+             ' "process" runs each repository in a forked worker process,'
+             ' which helps commands whose per-repository work is CPU bound.'
+             ' Only some commands support "process".')
+
+  @staticmethod
+  def configure(options):
+    """Configure the shared resource limits from the options.
+
+    The gradle limit comes from --max_local_builds if the command has it.
+    """
+    option_dict = vars(options)
+    RepositoryExecutor.set_resource_limit(
+        GIT_NETWORK_RESOURCE, option_dict.get('max_git_network_concurrency'))
+    RepositoryExecutor.set_resource_limit(
+        GCLOUD_RESOURCE, option_dict.get('max_gcloud_concurrency'))
+    RepositoryExecutor.set_resource_limit(
+        GRADLE_RESOURCE, option_dict.get('max_local_builds'))
+
+  @staticmethod
+  def set_resource_limit(name, limit):
+    """Bound the number of concurrent users of the named resource.
+
+    Args:
+      name: [string] The resource name, e.g. GIT_NETWORK_RESOURCE.
+      limit: [int] The maximum concurrency, or None for unlimited.
+    """
+    with RepositoryExecutor.__RESOURCE_LOCK:
+      semaphore = (threading.BoundedSemaphore(limit)
+                   if limit and limit > 0
+                   else None)
+      RepositoryExecutor.__RESOURCE_LIMITS[name] = (limit, semaphore)
+
+  @staticmethod
+  def resource_slot(name):
+    """Returns a context manager that holds a slot of the named resource.
+
+    If the resource is not limited then this does not block.
+    """
+    with RepositoryExecutor.__RESOURCE_LOCK:
+      _, semaphore = RepositoryExecutor.__RESOURCE_LIMITS.get(
+          name, (None, None))
+    return _ResourceSlot(name, semaphore)
+
+  @staticmethod
+  def singleton(max_threads=64):
+    """Returns the executor shared within this process.
+
+    Args:
+      max_threads: [int] Grow the shared pool to allow at least this many
+         workers. The pool never shrinks.
+    """
+    with RepositoryExecutor.__SINGLETON_LOCK:
+      executor = RepositoryExecutor.__SINGLETON
+      if executor is None:
+        executor = RepositoryExecutor(max_threads)
+        RepositoryExecutor.__SINGLETON = executor
+      else:
+        executor.ensure_max_threads(max_threads)
+      return executor
+
+  @staticmethod
+  def shutdown_singleton(timeout_secs=None):
+    """Stop the shared executor's workers, if any.
+
+    Args:
+      timeout_secs: [float] If set then wait up to this long for the
+         workers to exit.
+
+    Returns:
+      False if waiting and some workers were still running.
+    """
+    with RepositoryExecutor.__SINGLETON_LOCK:
+      executor = RepositoryExecutor.__SINGLETON
+      RepositoryExecutor.__SINGLETON = None
+    if executor is None:
+      return True
+    return executor.shutdown(timeout_secs=timeout_secs)
+
+  @property
+  def max_threads(self):
+    return self.__max_threads
+
+  def __init__(self, max_threads):
+    self.__max_threads = max(1, max_threads)
+    self.__lock = threading.Lock()
+    self.__tasks = Queue()
+    self.__workers = []
+    self.__idle_workers = 0
+    self.__local = threading.local()
+
+  def ensure_max_threads(self, max_threads):
+    with self.__lock:
+      self.__max_threads = max(self.__max_threads, max_threads)
+
+  def shutdown(self, timeout_secs=None):
+    """Stop the worker threads once they finish their current task.
+
+    Args:
+      timeout_secs: [float] If set then wait up to this long for the
+         workers to exit.
+
+    Returns:
+      False if waiting and some workers were still running.
+    """
+    with self.__lock:
+      workers = list(self.__workers)
+      self.__workers = []
+    for _ in workers:
+      self.__tasks.put(None)
+    if timeout_secs is None:
+      return True
+
+    deadline = time.time() + timeout_secs
+    current = threading.current_thread()
+    for worker in workers:
+      if worker is not current:
+        worker.join(max(0, deadline - time.time()))
+    return not any(worker.is_alive() for worker in workers)
+
+  def in_worker_thread(self):
+    """Returns True if the calling thread is one of our workers."""
+    return getattr(self.__local, 'is_worker', False)
+
+  def __worker_loop(self):
+    self.__local.is_worker = True
+    while True:
+      with self.__lock:
+        self.__idle_workers += 1
+      task = self.__tasks.get()
+      with self.__lock:
+        self.__idle_workers -= 1
+      if task is None:
+        return
+      task()
+
+  def __submit(self, task):
+    """Queue the task, growing the pool if there is no worker to take it."""
+    with self.__lock:
+      self.__tasks.put(task)
+      if (self.__tasks.qsize() > self.__idle_workers
+          and len(self.__workers) < self.__max_threads):
+        thread = threading.Thread(
+            target=self.__worker_loop,
+            name='RepositoryWorker-%d' % (len(self.__workers) + 1))
+        thread.daemon = True
+        self.__workers.append(thread)
+        thread.start()
+
+  def map_unordered(self, fn, items, name_func=None, max_concurrency=None,
+                    timeout_secs=None):
+    """Run fn on each item and yield RepositoryOutcome as each completes.
+
+    Args:
+      fn: [callable] Called with each item.
+      items: [list] The items to process, typically GitRepositorySpec.
+      name_func: [callable] Determines the outcome name for an item.
+         The default uses the item's "name" attribute.
+      max_concurrency: [int] At most this many items from this call will be
+         in flight at once. The default is the executor's max_threads.
+      timeout_secs: [int] If set then an item that takes longer than this
+         is reported with a TimeoutError. Its thread is not interrupted,
+         but its eventual result is ignored.
+
+    Yields:
+      A RepositoryOutcome for each item, in the order they completed.
+    """
+    # pylint: disable=too-many-arguments
+    name_func = name_func or (lambda item: item.name)
+    items = list(items)
+    if not items:
+      return
+
+    if self.in_worker_thread() or max_concurrency == 1 or len(items) == 1:
+      # Run inline. When called from a worker this avoids deadlocking on
+      # our own pool; otherwise it simplifies debugging.
+      for item in items:
+        yield self.__run_one(fn, item, name_func(item))
+      return
+
+    max_concurrency = min(max_concurrency or self.__max_threads, len(items))
+    results = Queue()
+    pending = list(enumerate(items))
+    started = {}
+    in_flight = set()
+
+    def make_task(index, item):
+      def task():
+        started[index] = time.time()
+        results.put((index, self.__run_one(fn, item, name_func(item))))
+      return task
+
+    def submit_next():
+      index, item = pending.pop(0)
+      in_flight.add(index)
+      self.__submit(make_task(index, item))
+
+    while pending and len(in_flight) < max_concurrency:
+      submit_next()
+
+    while in_flight:
+      wait_secs = None
+      if timeout_secs:
+        now = time.time()
+        deadlines = [started[index] + timeout_secs
+                     for index in in_flight if index in started]
+        wait_secs = max(0.1, min(deadlines) - now) if deadlines else 1
+      try:
+        index, outcome = results.get(timeout=wait_secs)
+      except Empty:
+        now = time.time()
+        for index in sorted(in_flight):
+          if index in started and now - started[index] >= timeout_secs:
+            name = name_func(items[index])
+            logging.error('Giving up on %s after %s secs', name, timeout_secs)
+            in_flight.remove(index)
+            if pending:
+              submit_next()
+            yield RepositoryOutcome(
+                name, None,
+                TimeoutError('{0} timed out after {1} secs'.format(
+                    name, timeout_secs), cause='repository'),
+                now - started[index])
+        continue
+
+      if index not in in_flight:
+        logging.debug('Ignoring late result for %s', outcome.name)
+        continue
+      in_flight.remove(index)
+      if pending:
+        submit_next()
+      yield outcome
+
+  @staticmethod
+  def __run_one(fn, item, name):
+    start_time = time.time()
+    try:
+      value = fn(item)
+      return RepositoryOutcome(name, value, None, time.time() - start_time)
+    except Exception as ex:
+      logging.debug('%s failed with %s', name, ex)
+      return RepositoryOutcome(name, None, ex, time.time() - start_time)
+
+
+class _ResourceSlot(object):
+  """Context manager that holds a resource semaphore, if any."""
+  # pylint: disable=too-few-public-methods
+
+  def __init__(self, name, semaphore):
+    self.__name = name
+    self.__semaphore = semaphore
+
+  def __enter__(self):
+    if self.__semaphore is not None and not self.__semaphore.acquire(False):
+      logging.debug('Waiting for a "%s" slot', self.__name)
+      self.__semaphore.acquire()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    if self.__semaphore is not None:
+      self.__semaphore.release()
+    return False
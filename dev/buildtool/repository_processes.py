@@ -0,0 +1,332 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Runs work across source repositories in a pool of worker processes.
+
+The RepositoryExecutor's threads share a single interpreter, so repository
+work that is CPU bound in python (e.g. analyzing commit histories and
+rendering changelogs) does not run in parallel. The ProcessRepositoryExecutor
+instead runs each repository in a forked worker process.
+
+The function and repositories are inherited by the workers when they are
+forked, so only the index of each repository and its outcome cross the
+process boundary. The function's return value must therefore be picklable,
+and any side effects it has on objects in the parent are not seen by the
+parent.
+
+Each worker reports the metrics it changed and the log records it emitted
+along with the outcome. These are merged into the parent's MetricsManager
+registry and re-emitted through the parent's logging handlers, so they end
+up in the same place as if the repository had been processed in a thread.
+
+A forked worker inherits every lock in the parent but only the thread that
+forked it, so a lock held by another thread at the time would never be
+released in the worker. Before forking, the parent stops the shared
+RepositoryExecutor's threads, which are the ones using the git caches and
+other shared state. If they do not stop in time then the repositories are
+processed in threads instead. The metrics registry is also used by the
+pusher, exporter and PrometheusServer threads, so each worker replaces the
+registry's locks rather than relying on their state.
+"""
+
+import logging
+import multiprocessing
+import pickle
+import sys
+import time
+
+try:
+  from Queue import Queue, Empty
+except ImportError:
+  from queue import Queue, Empty
+
+from buildtool import (
+    RepositoryExecutor,
+    RepositoryOutcome,
+    TimeoutError,
+    UnexpectedError)
+
+from buildtool.base_metrics import MetricFamily
+from buildtool.git_refs import LocalRepositoryQueryRegistry
+from buildtool.metrics import MetricsManager
+
+
+# The state of a worker process, set when it is forked.
+_WORKER_STATE = {'fn': None, 'items': None, 'log_records': None}
+
+# How long to wait for the shared executor's threads to finish their
+# current task before forking.
+_EXECUTOR_SHUTDOWN_TIMEOUT_SECS = 60
+
+
+class _LogRecordBuffer(logging.Handler):
+  """Keeps the log records emitted by a worker to send back to the parent."""
+
+  def emit(self, record):
+    try:
+      if record.exc_info:
+        record.exc_text = logging.Formatter().formatException(
+            record.exc_info)
+        record.exc_info = None
+      record.msg = record.getMessage()
+      record.args = None
+      _WORKER_STATE['log_records'].append(record)
+    except Exception:
+      self.handleError(record)
+
+
+def _init_worker(fn, items):
+  """Prepares a newly forked worker process."""
+  _WORKER_STATE.update({'fn': fn, 'items': items, 'log_records': []})
+
+  # The threads and cat-file processes we inherited belong to the parent.
+  RepositoryExecutor.shutdown_singleton()
+  LocalRepositoryQueryRegistry.forget_all()
+  MetricsManager.singleton().reset_after_fork()
+
+  root = logging.getLogger()
+  for handler in list(root.handlers):
+    root.removeHandler(handler)
+  root.addHandler(_LogRecordBuffer())
+
+
+def _metric_values(registry):
+  """Returns the current value of each metric keyed by type, name and labels."""
+  registry.merge_thread_local_metrics()
+  values = {}
+  for family in list(registry.metric_family_list):
+    for metric in list(family.instance_list):
+      key = (family.family_type, family.name,
+             tuple(sorted(metric.labels.items())))
+      if family.family_type == MetricFamily.TIMER:
+        values[key] = (metric.count, metric.total_seconds, metric.histogram)
+      elif family.family_type == MetricFamily.COUNTER:
+        values[key] = (metric.count, 0, None)
+      else:
+        values[key] = (metric.value, 0, None)
+  return values
+
+
+def _metric_deltas(before, after):
+  """Returns the changes from before to after as a list of (key, a, b, c).
+
+  The "c" is the timer's LatencyHistogram buckets, or None.
+  """
+  deltas = []
+  for key, value in after.items():
+    prev = before.get(key, (0, 0, None))
+    if value[:2] != prev[:2]:
+      buckets = None
+      if value[2] is not None:
+        buckets = (value[2].minus(prev[2]) if prev[2] is not None
+                   else value[2]).buckets
+      deltas.append((key, value[0] - prev[0], value[1] - prev[1], buckets))
+  return deltas
+
+
+def _ensure_picklable(value, error):
+  """Replace the value or error with an error if it cannot reach the parent."""
+  # pylint: disable=broad-except
+  try:
+    pickle.loads(pickle.dumps(error))
+  except Exception:
+    error = UnexpectedError('{type}: {error}'.format(
+        type=error.__class__.__name__, error=error))
+  try:
+    pickle.loads(pickle.dumps(value))
+  except Exception as ex:
+    value = None
+    error = UnexpectedError(
+        'Could not return result from worker process: {0}'.format(ex))
+  return value, error
+
+
+def _run_item(index):
+  """Runs the inherited function on the indexed item in a worker process.
+
+  Returns:
+    A tuple (index, value, error, elapsed_secs, metric_deltas, log_records).
+  """
+  registry = MetricsManager.singleton()
+  metrics_before = _metric_values(registry)
+  del _WORKER_STATE['log_records'][:]
+  value = None
+  error = None
+  start_time = time.time()
+  try:
+    value = _WORKER_STATE['fn'](_WORKER_STATE['items'][index])
+  except Exception as ex:
+    logging.debug('Item %d failed with %s', index, ex)
+    error = ex
+  elapsed_secs = time.time() - start_time
+  value, error = _ensure_picklable(value, error)
+  return (index, value, error, elapsed_secs,
+          _metric_deltas(metrics_before, _metric_values(registry)),
+          list(_WORKER_STATE['log_records']))
+
+
+def _merge_metrics(registry, deltas):
+  """Applies the metric changes reported by a worker."""
+  for (family_type, name, labels), first, second, buckets in deltas:
+    metric = registry.get_metric(family_type, name, dict(labels))
+    if family_type == MetricFamily.TIMER:
+      metric.observe_many(first, second, buckets=buckets)
+    else:
+      metric.inc(amount=first)
+
+
+def _replay_log_records(records):
+  """Emits the log records from a worker through our own handlers."""
+  for record in records:
+    logger = logging.getLogger(None if record.name == 'root' else record.name)
+    logger.handle(record)
+
+
+class ProcessRepositoryExecutor(object):
+  """Runs repository work in a pool of forked worker processes."""
+
+  @staticmethod
+  def in_worker_process():
+    """Returns True if this is one of our worker processes."""
+    return _WORKER_STATE['fn'] is not None
+
+  @property
+  def max_processes(self):
+    return self.__max_processes
+
+  def __init__(self, max_processes):
+    self.__max_processes = max(1, max_processes)
+
+  @staticmethod
+  def __failed_result(index, ex, started):
+    """Returns a _run_item result for an item whose worker failed."""
+    error = UnexpectedError('Worker process failed: {type}: {error}'.format(
+        type=ex.__class__.__name__, error=ex))
+    return index, None, error, time.time() - started[index], [], []
+
+  def map_unordered(self, fn, items, name_func=None, timeout_secs=None):
+    """Run fn on each item and yield RepositoryOutcome as each completes.
+
+    This is a drop-in replacement for RepositoryExecutor.map_unordered,
+    except fn runs in a worker process and its result must be picklable.
+
+    Args:
+      fn: [callable] Called with each item. This need not be picklable.
+      items: [list] The items to process, typically GitRepositorySpec.
+      name_func: [callable] Determines the outcome name for an item.
+         The default uses the item's "name" attribute.
+      timeout_secs: [int] If set then an item that takes longer than this
+         is reported with a TimeoutError and its worker is terminated
+         once the remaining items finish.
+
+    Yields:
+      A RepositoryOutcome for each item, in the order they completed.
+    """
+    name_func = name_func or (lambda item: item.name)
+    items = list(items)
+    if not items:
+      return
+
+    use_threads = (self.in_worker_process()
+                   or self.__max_processes == 1 or len(items) == 1)
+    if not use_threads and not RepositoryExecutor.shutdown_singleton(
+        timeout_secs=_EXECUTOR_SHUTDOWN_TIMEOUT_SECS):
+      logging.warning('Repository worker threads are still running,'
+                      ' so using threads rather than forking processes.')
+      use_threads = True
+
+    if use_threads:
+      # Forking would not buy anything, and daemonic worker processes
+      # cannot have children of their own, so use threads instead.
+      for outcome in RepositoryExecutor.singleton().map_unordered(
+          fn, items, name_func=name_func,
+          max_concurrency=self.__max_processes, timeout_secs=timeout_secs):
+        yield outcome
+      return
+
+    get_context = getattr(multiprocessing, 'get_context', None)
+    context = get_context('fork') if get_context else multiprocessing
+    num_processes = min(self.__max_processes, len(items))
+    pool = context.Pool(num_processes,
+                        initializer=_init_worker, initargs=(fn, items))
+    results = Queue()
+    pending = list(range(len(items)))
+    started = {}
+    in_flight = set()
+    abandoned = False
+    registry = MetricsManager.singleton()
+
+    def submit_next():
+      index = pending.pop(0)
+      in_flight.add(index)
+      started[index] = time.time()
+      kwargs = {'callback': results.put}
+      if sys.version_info[0] >= 3:
+        # Otherwise a failure outside _run_item's own handling, such as
+        # its result not pickling, would never be reported back.
+        kwargs['error_callback'] = (
+            lambda ex: results.put(self.__failed_result(index, ex, started)))
+      pool.apply_async(_run_item, (index,), **kwargs)
+
+    try:
+      while pending and len(in_flight) < num_processes:
+        submit_next()
+
+      while in_flight:
+        wait_secs = None
+        if timeout_secs:
+          deadline = min(started[index] for index in in_flight) + timeout_secs
+          wait_secs = max(0.1, deadline - time.time())
+        try:
+          index, value, error, elapsed_secs, deltas, records = results.get(
+              timeout=wait_secs)
+        except Empty:
+          now = time.time()
+          for index in sorted(in_flight):
+            if now - started[index] >= timeout_secs:
+              name = name_func(items[index])
+              logging.error('Giving up on %s after %s secs',
+                            name, timeout_secs)
+              in_flight.remove(index)
+              abandoned = True
+              if pending:
+                submit_next()
+              yield RepositoryOutcome(
+                  name, None,
+                  TimeoutError('{0} timed out after {1} secs'.format(
+                      name, timeout_secs), cause='repository'),
+                  now - started[index])
+          continue
+
+        # The worker's metrics and logs happened even if we gave up on it.
+        _merge_metrics(registry, deltas)
+        _replay_log_records(records)
+        if index not in in_flight:
+          logging.debug('Ignoring late result for %s',
+                        name_func(items[index]))
+          continue
+        in_flight.remove(index)
+        if pending:
+          submit_next()
+        yield RepositoryOutcome(name_func(items[index]),
+                                value, error, elapsed_secs)
+    except GeneratorExit:
+      abandoned = True
+      raise
+    finally:
+      if abandoned:
+        pool.terminate()
+      else:
+        pool.close()
+        pool.join()
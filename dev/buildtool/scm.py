@@ -18,8 +18,6 @@ This includes fetching the source to be built as well as manipulating
 the git repositories for tagging and annotations.
 """
 
-from multiprocessing.pool import ThreadPool
-
 import collections
 import logging
 import os
@@ -29,6 +27,7 @@ import yaml
 from buildtool import (
     GitRepositorySpec,
     GitRunner,
+    RepositoryExecutor,
     RepositorySummary,
 
     add_parser_argument,
@@ -37,6 +36,8 @@ from buildtool import (
     write_to_path,
     UnexpectedError)
 
+from buildtool.repository_processes import ProcessRepositoryExecutor
+
 
 class SourceInfo(
     collections.namedtuple('SourceInfo', ['build_number', 'summary'])):
@@ -83,6 +84,7 @@ class SpinnakerSourceCodeManager(object):
       return
     parser.added_scm = True
     GitRunner.add_parser_args(parser, defaults)
+    RepositoryExecutor.add_parser_args(parser, defaults)
     add_parser_argument(parser, 'github_upstream_owner',
                         defaults, 'spinnaker',
                         help='The standard upstream repository owner.')
@@ -111,6 +113,11 @@ class SpinnakerSourceCodeManager(object):
     self.__options = options
     self.__git = GitRunner(options)
     self.__root_source_dir = root_source_dir
+    RepositoryExecutor.configure(options)
+
+    # The summaries in the source_info files keyed by path.
+    # These are (mtime, RepositorySummary) to notice if the file changes.
+    self.__source_info_summaries = {}
 
   def service_name_to_repository_name(self, service_name):
     if service_name == 'monitoring-daemon':
@@ -221,17 +228,25 @@ class SpinnakerSourceCodeManager(object):
         'Refreshing source info for %s and caching to %s for buildnum=%s',
         repository.name, cache_path, build_number)
     write_to_path(info.summary.to_yaml(), cache_path)
+    self.__source_info_summaries[cache_path] = (
+        os.path.getmtime(cache_path), summary)
     return info
 
   def lookup_source_info(self, repository):
     """Return the SourceInfo for the given repository."""
     filename = repository.name + '-meta.yml'
     dir_path = os.path.join(self.__options.output_dir, 'source_info')
+    path = os.path.join(dir_path, filename)
     build_number = self.determine_build_number(repository)
-    with open(os.path.join(dir_path, filename), 'r') as stream:
-      return SourceInfo(
-          build_number,
-          RepositorySummary.from_dict(yaml.safe_load(stream.read())))
+
+    mtime = os.path.getmtime(path)
+    known = self.__source_info_summaries.get(path)
+    if known is None or known[0] != mtime:
+      with open(path, 'r') as stream:
+        summary = RepositorySummary.from_dict(yaml.safe_load(stream.read()))
+      known = (mtime, summary)
+      self.__source_info_summaries[path] = known
+    return SourceInfo(build_number, known[1])
 
   def check_source_info(self, repository):
     """Ensure cached source info is consistent with current repository."""
@@ -249,33 +264,76 @@ class SpinnakerSourceCodeManager(object):
 
   def foreach_source_repository(
       self, all_repos, call_function, *posargs, **kwargs):
-    """Call the function on each of the SourceRepository instances."""
+    """Call the function on each of the SourceRepository instances.
+
+    Every repository is processed even if some of them fail.
+    If any failed then the first failure is raised after they all finish.
+
+    Returns:
+      A dictionary of the function results keyed by repository name.
+    """
+    return self.__collect_outcomes(
+        all_repos,
+        self.stream_source_repository_outcomes(
+            all_repos, call_function, *posargs, **kwargs))
+
+  def foreach_source_repository_in_processes(
+      self, all_repos, call_function, *posargs, **kwargs):
+    """Like foreach_source_repository but each runs in a worker process.
+
+    The call_function runs in a forked process so its result must be
+    picklable, and any side effects it has on objects here are lost.
+
+    Returns:
+      A dictionary of the function results keyed by repository name.
+    """
     worker = RepositoryWorker(call_function, *posargs, **kwargs)
-    num_threads = min(self.__max_threads, len(all_repos))
-    if num_threads > 1:
-      pool = ThreadPool(num_threads)
-      logging.info('Mapping %d/%s',
-                   len(all_repos), [repo.name for repo in all_repos])
-      try:
-        raw_list = pool.map(worker, all_repos)
-        result = {name: value for name, value in raw_list}
-      except Exception:
-        logging.error('Map caught exception')
-        pool.close()
-        pool.join()
-        raise
-      logging.info('Finished mapping')
-      pool.close()
-      pool.join()
-    else:
-      # If we have only one thread, skip the pool
-      # this is primarily to make debugging easier.
-      result = {
-          repository.name: worker(repository)[1]
-          for repository in all_repos
-      }
+    executor = ProcessRepositoryExecutor(self.__max_threads)
+    timeout_secs = vars(self.__options).get('repository_timeout_secs')
+    return self.__collect_outcomes(
+        all_repos,
+        executor.map_unordered(lambda repository: worker(repository)[1],
+                               all_repos, timeout_secs=timeout_secs))
+
+  @staticmethod
+  def __collect_outcomes(all_repos, outcomes):
+    """Gathers the outcomes from mapping all_repos into a result dictionary."""
+    logging.info('Mapping %d/%s',
+                 len(all_repos), [repo.name for repo in all_repos])
+    result = {}
+    failures = []
+    for outcome in outcomes:
+      if outcome.ok:
+        result[outcome.name] = outcome.value
+      else:
+        failures.append(outcome)
+
+    if failures:
+      logging.error('Map failed on %d/%d repositories: %s',
+                    len(failures), len(all_repos),
+                    ', '.join(['{name} ({error})'.format(
+                        name=outcome.name, error=outcome.error)
+                               for outcome in failures]))
+      raise failures[0].error
+    logging.info('Finished mapping')
     return result
 
+  def stream_source_repository_outcomes(
+      self, all_repos, call_function, *posargs, **kwargs):
+    """Call the function on each repository, yielding results as they finish.
+
+    This uses the RepositoryExecutor shared by the process.
+
+    Returns:
+      A generator of RepositoryOutcome in completion order.
+    """
+    worker = RepositoryWorker(call_function, *posargs, **kwargs)
+    executor = RepositoryExecutor.singleton(self.__max_threads)
+    timeout_secs = vars(self.__options).get('repository_timeout_secs')
+    return executor.map_unordered(
+        lambda repository: worker(repository)[1], all_repos,
+        max_concurrency=self.__max_threads, timeout_secs=timeout_secs)
+
   def push_to_origin_if_not_upstream(self, repository, branch):
     """Push the local repository back to the origin, but not upstream."""
     git_dir = repository.git_dir
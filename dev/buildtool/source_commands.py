@@ -34,6 +34,8 @@ from buildtool import (
 class FetchSourceCommand(RepositoryCommandProcessor):
   """Implements the fetch_source command."""
 
+  SUPPORTS_PROCESS_EXECUTOR = True
+
   def __init__(self, factory, options):
     """Implements CommandProcessor interface."""
 
@@ -86,6 +88,9 @@ class FetchSourceCommandFactory(RepositoryCommandFactory):
 
 class ExtractSourceInfoCommand(RepositoryCommandProcessor):
   """Get the Git metadata for each repository, and associate a build number."""
+
+  SUPPORTS_PROCESS_EXECUTOR = True
+
   def _do_repository(self, repository):
     """Implements RepositoryCommandProcessor interface."""
     self.source_code_manager.refresh_source_info(
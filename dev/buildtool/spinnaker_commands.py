@@ -39,6 +39,7 @@ from buildtool import (
     RepositoryCommandProcessor,
     GitRunner,
     HalRunner,
+    RefTransaction,
 
     exception_to_message,
     check_options_set,
@@ -241,50 +242,98 @@ class PublishSpinnakerCommand(CommandProcessor):
     bom_scm = self.__bom_scm
     branch_scm = self.__branch_scm
 
-    # Run in two passes so we dont push anything if we hit a problem
-    # in the tagging pass. Since we are spread against multiple repositiories,
-    # we cannot do this atomically. The two passes gives us more protection
-    # from a partial push due to errors in a repo.
-    names_to_push = set([])
-    for which in ['tag', 'push']:
-      for name, spec in bom['services'].items():
-        if name in ['monitoring-third-party', 'defaultArtifact']:
-          # Ignore this, it is redundant to monitoring-daemon
-          continue
-        if name == 'monitoring-daemon':
-          name = 'spinnaker-monitoring'
-        if self.__only_repositories and name not in self.__only_repositories:
-          logging.debug('Skipping %s because of --only_repositories', name)
-          continue
-        if spec is None:
-          logging.warning('HAVE bom.services.%s = None', name)
-          continue
-
-        repository = bom_scm.make_repository_spec(name)
-        bom_scm.ensure_local_repository(repository)
-        version = bom_scm.determine_repository_version(repository)
-        if which == 'tag':
-          added = self.__branch_and_tag_repository(
-              repository, self.__branch, version)
-          if added:
-            names_to_push.add(name)
-        else:
-          self.__push_branch_and_maybe_tag_repository(
-              repository, self.__branch, version, name in names_to_push)
-
-    additional_repositories = list(SPINNAKER_PROCESS_REPOSITORY_NAMES)
-    for name in additional_repositories:
+    bom_repositories = []
+    for name, spec in bom['services'].items():
+      if name in ['monitoring-third-party', 'defaultArtifact']:
+        # Ignore this, it is redundant to monitoring-daemon
+        continue
+      if name == 'monitoring-daemon':
+        name = 'spinnaker-monitoring'
+      if self.__only_repositories and name not in self.__only_repositories:
+        logging.debug('Skipping %s because of --only_repositories', name)
+        continue
+      if spec is None:
+        logging.warning('HAVE bom.services.%s = None', name)
+        continue
+      bom_repositories.append(bom_scm.make_repository_spec(name))
+
+    process_repositories = []
+    for name in SPINNAKER_PROCESS_REPOSITORY_NAMES:
       if self.__only_repositories and name not in self.__only_repositories:
         logging.debug('Skipping %s because of --only_repositories', name)
         continue
-      repository = branch_scm.make_repository_spec(name)
-      branch_scm.ensure_local_repository(repository)
-      git_summary = self.__git.collect_repository_summary(repository.git_dir)
-      version = git_summary.version
-      if self.__branch_and_tag_repository(
-          repository, self.__branch, version):
-        self.__push_branch_and_maybe_tag_repository(
-            repository, self.__branch, version, True)
+      process_repositories.append(branch_scm.make_repository_spec(name))
+
+    # Run in phases so we dont push anything if we hit a problem in any
+    # repository before then. Each phase runs across all the repositories
+    # concurrently and fails if any of them does. Since we are spread
+    # against multiple repositiories, we cannot push atomically, but each
+    # repository's branch and tag are pushed atomically together.
+    plans = bom_scm.foreach_source_repository(
+        bom_repositories, self.__plan_bom_repository)
+    plans.update(branch_scm.foreach_source_repository(
+        process_repositories, self.__plan_process_repository))
+
+    self.__tag_repositories(
+        [plan for plan in plans.values() if plan['add_tag']])
+    bom_scm.foreach_source_repository(
+        [plan['repository'] for plan in plans.values()
+         if plan['push_branch'] or plan['add_tag']],
+        lambda repository: self.__push_repository(plans[repository.name]))
+
+  def __plan_bom_repository(self, repository):
+    """Determine how to tag and push a repository in the BOM."""
+    bom_scm = self.__bom_scm
+    bom_scm.ensure_local_repository(repository)
+    version = bom_scm.determine_repository_version(repository)
+    return self.__make_plan(repository, version, push_branch=True)
+
+  def __plan_process_repository(self, repository):
+    """Determine how to tag and push a repository that is not in the BOM.
+
+    These only push their branch if they need a new tag.
+    """
+    self.__branch_scm.ensure_local_repository(repository)
+    git_summary = self.__git.collect_repository_summary(repository.git_dir)
+    return self.__make_plan(repository, git_summary.version, push_branch=False)
+
+  def __make_plan(self, repository, version, push_branch):
+    tag = 'version-' + version
+    add_tag = not self.__already_have_tag(repository, tag)
+    return {
+        'repository': repository,
+        'tag': tag,
+        'commit': self.__git.query_local_repository_commit_id(
+            repository.git_dir),
+        'add_tag': add_tag,
+        'push_branch': push_branch or add_tag
+    }
+
+  def __tag_repositories(self, plans):
+    """Add the version tags to all the repositories, or none of them."""
+    def add_tag(repository):
+      plan = plans_by_name[repository.name]
+      transaction = RefTransaction()
+      transaction.create('refs/tags/' + plan['tag'], plan['commit'])
+      self.__git.apply_ref_transaction(repository.git_dir, transaction)
+
+    plans_by_name = {plan['repository'].name: plan for plan in plans}
+    outcomes = list(self.__bom_scm.stream_source_repository_outcomes(
+        [plan['repository'] for plan in plans], add_tag))
+    failures = [outcome for outcome in outcomes if not outcome.ok]
+    if not failures:
+      return
+
+    logging.error('Tagging failed in %s -- removing the tags just added.',
+                  ', '.join([outcome.name for outcome in failures]))
+    for outcome in outcomes:
+      if outcome.ok:
+        plan = plans_by_name[outcome.name]
+        transaction = RefTransaction()
+        transaction.delete('refs/tags/' + plan['tag'], plan['commit'])
+        self.__git.apply_ref_transaction(
+            plan['repository'].git_dir, transaction)
+    raise failures[0].error
 
   def __already_have_tag(self, repository, tag):
     """Determine if we already have the tag in the repository."""
@@ -304,25 +353,25 @@ class PublishSpinnakerCommand(CommandProcessor):
                     have=existing_commit, want=want_commit)))
     return False  # not reached
 
-  def __branch_and_tag_repository(self, repository, branch, version):
-    """Create a branch and/or version tag in the repository, if needed."""
-    tag = 'version-' + version
-    if self.__already_have_tag(repository, tag):
-      return False
-
-    self.__git.check_run(repository.git_dir, 'tag ' + tag)
-    return True
-
-  def __push_branch_and_maybe_tag_repository(self, repository, branch, version,
-                                             also_tag):
-    """Push the branch and version tag to the origin."""
-    tag = 'version-' + version
-    self.__git.push_branch_to_origin(repository.git_dir, branch)
-    if also_tag:
-      self.__git.push_tag_to_origin(repository.git_dir, tag)
+  def __push_repository(self, plan):
+    """Push the branch and version tag to the origin together."""
+    repository = plan['repository']
+    git_dir = repository.git_dir
+    refspecs = []
+    if plan['push_branch']:
+      in_branch = self.__git.query_local_repository_branch(git_dir)
+      if in_branch == self.__branch:
+        refspecs.append(self.__branch)
+      else:
+        logging.warning(
+            'Skipping push %s "%s" to origin because branch is "%s".',
+            git_dir, self.__branch, in_branch)
+    if plan['add_tag']:
+      refspecs.append(plan['tag'])
     else:
       logging.info('%s was already tagged with "%s" -- skip',
-                   repository.git_dir, tag)
+                   git_dir, plan['tag'])
+    self.__git.push_refs_to_origin(git_dir, refspecs)
 
   def _do_command(self):
     """Implements CommandProcessor interface."""
@@ -14,10 +14,13 @@
 
 """Support for running subprocess commands."""
 
+import codecs
+import collections
 import io
 import datetime
 import logging
 import os
+import select
 import shlex
 import subprocess
 import time
@@ -28,7 +31,8 @@ from buildtool import (
     log_timestring,
     raise_and_log_error,
     timedelta_string,
-    ExecutionError)
+    ExecutionError,
+    TimeoutError)
 
 from buildtool.base_metrics import BaseMetricsRegistry
 
@@ -38,6 +42,119 @@ from buildtool.base_metrics import BaseMetricsRegistry
 # this module does not offer encapsulated configuration.
 ERROR_LOGFILE_DIR = 'errors'
 
+# When a subprocess's output is being written to a stream (e.g. a logfile)
+# only this many trailing characters are kept in memory to return to the
+# caller. Output that is not otherwise persisted is returned in full.
+STREAMED_OUTPUT_TAIL_CHARS = 256 * 1024
+
+# How much to read from a pipe at a time.
+_READ_CHUNK_BYTES = 64 * 1024
+
+# How often to check for timeouts and cancellation while draining output.
+_POLL_INTERVAL_SECS = 0.5
+
+
+class _OutputCollector(object):
+  """Decodes process output, keeping either all of it or only the tail."""
+
+  def __init__(self, max_chars=None):
+    self.__decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    self.__chunks = collections.deque()
+    self.__num_chars = 0
+    self.__max_chars = max_chars
+
+  def add(self, data, final=False):
+    """Add raw bytes to the output and return them as decoded text."""
+    text = self.__decoder.decode(data, final)
+    if not text:
+      return text
+    self.__chunks.append(text)
+    self.__num_chars += len(text)
+    if self.__max_chars:
+      while (len(self.__chunks) > 1
+             and self.__num_chars - len(self.__chunks[0]) >= self.__max_chars):
+        self.__num_chars -= len(self.__chunks.popleft())
+    return text
+
+  def text(self):
+    """Return the collected text."""
+    text = ''.join(self.__chunks)
+    if self.__max_chars and len(text) > self.__max_chars:
+      text = text[-self.__max_chars:]
+    return text
+
+
+class _StderrLogger(object):
+  """Logs each line a process writes to stderr as it is received."""
+  # pylint: disable=too-few-public-methods
+
+  def __init__(self, pid, log_level):
+    self.__pid = pid
+    self.__log_level = log_level
+    self.__decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    self.__partial = ''
+
+  def add(self, data, final=False):
+    lines = (self.__partial + self.__decoder.decode(data, final)).split('\n')
+    self.__partial = '' if final else lines.pop()
+    for line in lines:
+      if line or not final:
+        logging.log(self.__log_level, 'PID %s wrote to stderr: %s',
+                    self.__pid, line)
+
+
+def _drain_pipes(process, handlers, deadline=None, cancel_event=None):
+  """Concurrently read the process pipes until they close.
+
+  Reading the pipes together (rather than stdout to EOF then stderr)
+  prevents deadlocking on a child blocked writing to a full stderr pipe.
+
+  Args:
+    process: [Popen] The process whose pipes are to be drained.
+    handlers: [dict] Maps the pipes to read to a handler(data, final=False).
+    deadline: [float] If the process is not done by this time then kill it.
+    cancel_event: [threading.Event] If set then kill the process.
+
+  Returns:
+    None if the pipes were closed normally, otherwise the reason the process
+    was killed.
+  """
+  readers = {pipe.fileno(): (pipe, handler)
+             for pipe, handler in handlers.items()}
+  killed_reason = None
+  poll_secs = (_POLL_INTERVAL_SECS
+               if deadline is not None or cancel_event is not None
+               else None)
+  while readers:
+    ready, _, _ = select.select(list(readers.keys()), [], [], poll_secs)
+    for fileno in ready:
+      _, handler = readers[fileno]
+      data = os.read(fileno, _READ_CHUNK_BYTES)
+      if data:
+        handler(data)
+      else:
+        handler(b'', final=True)
+        del readers[fileno]
+
+    if killed_reason is not None:
+      if not ready:
+        # Descendants may still hold our pipes open after the kill.
+        break
+      continue
+    if deadline is not None and time.time() > deadline:
+      killed_reason = 'timed out'
+    elif cancel_event is not None and cancel_event.is_set():
+      killed_reason = 'cancelled'
+    if killed_reason is not None:
+      logging.warning('Killing PID %s because it %s.',
+                      process.pid, killed_reason)
+      process.kill()
+
+  if killed_reason is not None:
+    for _, handler in readers.values():
+      handler(b'', final=True)
+  return killed_reason
+
 def start_subprocess(cmd, stream=None, stdout=None, stderr=None, echo=False, **kwargs):
   """Starts a subprocess and returns handle to it."""
   split_cmd = shlex.split(cmd)
@@ -68,56 +185,79 @@ def start_subprocess(cmd, stream=None, stdout=None, stderr=None, echo=False, **k
   return process
 
 
-def wait_subprocess(process, stream=None, echo=False, postprocess_hook=None):
+def wait_subprocess(process, stream=None, echo=False, postprocess_hook=None,
+                    timeout_secs=None, cancel_event=None):
   """Waits for subprocess to finish and returns (final status, stdout).
 
   This will also consume the remaining output to return it.
+  Both stdout and stderr are drained concurrently. If stdout is being
+  written to a stream then only its tail is retained to return.
+
+  Args:
+    process: [Popen] The process to wait on.
+    stream: [stream] If provided then write the stdout to this stream.
+    echo: [bool] If true then log the output at INFO rather than DEBUG.
+    postprocess_hook: [callable] Called with (returncode, stdout) when done.
+    timeout_secs: [int] If provided then kill the process if it takes longer.
+    cancel_event: [threading.Event] If provided then kill the process
+       should the event be set while waiting on it.
 
   Returns:
     Process exit code, stdout remaining in process prior to this invocation.
     Any previously read output from the process will not be included.
+
+  Raises:
+    TimeoutError if the process took longer than timeout_secs.
+    ExecutionError if the process was cancelled.
   """
-  text_lines = []
+  # pylint: disable=too-many-arguments
+  log_level = logging.INFO if echo else logging.DEBUG
+  collector = _OutputCollector(
+      max_chars=STREAMED_OUTPUT_TAIL_CHARS if stream else None)
+
+  def handle_stdout(data, final=False):
+    text = collector.add(data, final)
+    if stream and text:
+      stream.write(text)
+      stream.flush()
+
+  handlers = {}
   if process.stdout is not None:
     # stdout isnt going to another stream; collect it from the pipe.
-    for raw_line in iter(process.stdout.readline, ''):
-      if not raw_line:
-        break
-      decoded_line = raw_line.decode(encoding='utf-8')
-      text_lines.append(decoded_line)
-      if stream:
-        stream.write(decoded_line)
-        stream.flush()
-
+    handlers[process.stdout] = handle_stdout
   if process.stderr is not None:
-    log_level = logging.INFO if echo else logging.DEBUG
     # stderr isn't going to another file handle; log it
-    for raw_line in iter(process.stderr.readline, ''):
-      decoded_line = raw_line.decode(encoding='utf-8').rstrip('\n')
-      logging.log(log_level, 'PID %s wrote to stderr: %s', process.pid, decoded_line)
+    handlers[process.stderr] = _StderrLogger(process.pid, log_level).add
 
-   
+  start_date = getattr(process, 'start_date', None)
+  deadline = None
+  if timeout_secs:
+    started = (time.mktime(start_date.timetuple())
+               if start_date else time.time())
+    deadline = started + timeout_secs
+
+  killed_reason = _drain_pipes(process, handlers,
+                               deadline=deadline, cancel_event=cancel_event)
   process.wait()
-  if stream is None and process.stdout is not None:
-    # Close stdout pipe if we didnt give a stream.
-    # Otherwise caller owns the stream.
-    process.stdout.close()
-
-  if hasattr(process, 'start_date'):
-    end_date = datetime.datetime.now()
-    delta_time_str = timedelta_string(end_date - process.start_date)
+  for pipe in handlers:
+    pipe.close()
+
+  end_date = datetime.datetime.now()
+  if start_date:
+    delta_time_str = timedelta_string(end_date - start_date)
   else:
     delta_time_str = 'UNKNOWN'
 
   returncode = process.returncode
-  stdout = ''.join(text_lines)
+  stdout = collector.text()
 
   if stream:
     stream.write(
-        u'\n\n----\n{time} Spawned process completed'
+        u'\n\n----\n{time} Spawned process {how}'
         u' with returncode {returncode} in {delta_time}.\n'
-        .format(time=log_timestring(now=end_date), returncode=returncode,
-                delta_time=delta_time_str))
+        .format(time=log_timestring(now=end_date),
+                how=killed_reason or 'completed',
+                returncode=returncode, delta_time=delta_time_str))
     stream.flush()
 
   if echo:
@@ -129,15 +269,29 @@ def wait_subprocess(process, stream=None, echo=False, postprocess_hook=None):
   if postprocess_hook:
     postprocess_hook(returncode, stdout)
 
+  if killed_reason == 'timed out':
+    raise_and_log_error(
+        TimeoutError('PID {pid} timed out after {secs} secs'.format(
+            pid=process.pid, secs=timeout_secs), cause='subprocess'))
+  if killed_reason:
+    raise_and_log_error(
+        ExecutionError('PID {pid} was {why}'.format(
+            pid=process.pid, why=killed_reason), program='subprocess'))
+
   return returncode, stdout.strip()
 
 
 def run_subprocess(cmd, stream=None, echo=False, **kwargs):
-  """Returns retcode, stdout."""
-  postprocess_hook = kwargs.pop('postprocess_hook', None)
+  """Returns retcode, stdout.
+
+  The postprocess_hook, timeout_secs and cancel_event kwargs are passed
+  to wait_subprocess. Any others are passed to start_subprocess.
+  """
+  wait_kwargs = {key: kwargs.pop(key)
+                 for key in ['postprocess_hook', 'timeout_secs', 'cancel_event']
+                 if key in kwargs}
   process = start_subprocess(cmd, stream=stream, echo=echo, **kwargs)
-  return wait_subprocess(process, stream=stream, echo=echo,
-                         postprocess_hook=postprocess_hook)
+  return wait_subprocess(process, stream=stream, echo=echo, **wait_kwargs)
 
 
 def check_subprocess(cmd, stream=None, **kwargs):
@@ -0,0 +1,113 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-docstring
+
+import json
+import unittest
+
+from mock import patch
+
+from buildtool.artifact_inventory import (
+    GceImageInventory,
+    RegistryTagInventory)
+
+from test_util import init_runtime
+
+
+REGISTRY = 'gcr.io/test-project'
+REGISTRY_TAGS = {
+    'clouddriver': [['1.2.3-slim', 'latest'], ['1.2.3-ubuntu']],
+    'deck': [['2.0.0-slim']],
+}
+
+
+def fake_gcloud(command, **kwargs):
+  # pylint: disable=unused-argument
+  if 'container images list-tags' in command:
+    name = command.split()[5][len(REGISTRY) + 1:]
+    return json.JSONEncoder().encode(
+        [{'digest': 'sha256:' + str(index), 'tags': tags}
+         for index, tags in enumerate(REGISTRY_TAGS.get(name, []))])
+  if 'container images list' in command:
+    return json.JSONEncoder().encode(
+        [{'name': REGISTRY + '/' + name} for name in REGISTRY_TAGS])
+  raise ValueError('Unexpected command: ' + command)
+
+
+class TestRegistryTagInventory(unittest.TestCase):
+  def test_lists_registry_once(self):
+    inventory = RegistryTagInventory(REGISTRY, account='test@account')
+    with patch('buildtool.artifact_inventory.check_subprocess',
+               side_effect=fake_gcloud) as mock_run:
+      self.assertTrue(inventory.has_tag('clouddriver', '1.2.3-slim'))
+      self.assertTrue(inventory.has_tag('clouddriver', '1.2.3-ubuntu'))
+      self.assertFalse(inventory.has_tag('deck', '2.0.0-ubuntu'))
+      self.assertFalse(inventory.has_tag('missing', '1.0.0-slim'))
+      self.assertEqual({'clouddriver': ['1.2.3-slim', '1.2.3-ubuntu', 'latest'],
+                        'deck': ['2.0.0-slim']},
+                       inventory.tag_map())
+      self.assertEqual(3, mock_run.call_count)
+      self.assertIn('--account test@account', mock_run.call_args[0][0])
+
+  def test_invalidate_requeries_only_image(self):
+    inventory = RegistryTagInventory(REGISTRY)
+    with patch('buildtool.artifact_inventory.check_subprocess',
+               side_effect=fake_gcloud) as mock_run:
+      self.assertFalse(inventory.has_tag('deck', '2.0.1-slim'))
+      self.assertEqual(3, mock_run.call_count)
+
+      REGISTRY_TAGS['deck'].append(['2.0.1-slim'])
+      try:
+        inventory.invalidate('deck')
+        self.assertTrue(inventory.has_tag('deck', '2.0.1-slim'))
+        self.assertTrue(inventory.has_tag('deck', '2.0.1-slim'))
+      finally:
+        REGISTRY_TAGS['deck'].pop()
+      self.assertEqual(4, mock_run.call_count)
+
+  def test_ttl_expires_listing(self):
+    inventory = RegistryTagInventory(REGISTRY, ttl_secs=-1)
+    with patch('buildtool.artifact_inventory.check_subprocess',
+               side_effect=fake_gcloud) as mock_run:
+      inventory.has_tag('deck', '2.0.0-slim')
+      inventory.has_tag('deck', '2.0.0-slim')
+      self.assertEqual(6, mock_run.call_count)
+
+
+class TestGceImageInventory(unittest.TestCase):
+  def test_image_lookup_and_invalidate(self):
+    inventory = GceImageInventory('test-project', account='test@account')
+    image_name = GceImageInventory.make_image_name('clouddriver', '1.2.3-20')
+    self.assertEqual('spinnaker-clouddriver-1-2-3-20', image_name)
+    listing = '\n'.join([image_name, 'spinnaker-deck-2-0-0-10', ''])
+    with patch('buildtool.artifact_inventory.check_subprocess',
+               return_value=listing) as mock_run:
+      self.assertTrue(inventory.has_image(image_name))
+      self.assertFalse(inventory.has_image('spinnaker-deck-2-0-1-10'))
+      self.assertEqual([image_name, 'spinnaker-deck-2-0-0-10'],
+                       inventory.image_names())
+      self.assertEqual(1, mock_run.call_count)
+      command = mock_run.call_args[0][0]
+      self.assertIn('--project test-project', command)
+      self.assertIn('--account test@account', command)
+
+      inventory.invalidate(image_name)
+      self.assertFalse(inventory.has_image(image_name))
+      self.assertEqual(1, mock_run.call_count)
+
+
+if __name__ == '__main__':
+  init_runtime()
+  unittest.main(verbosity=2)
@@ -0,0 +1,152 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-docstring
+
+import json
+import threading
+import unittest
+
+try:
+  from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+  from SocketServer import ThreadingMixIn
+except ImportError:
+  from http.server import BaseHTTPRequestHandler, HTTPServer
+  from socketserver import ThreadingMixIn
+
+from buildtool import ResponseError
+from buildtool.bintray_support import BintrayClient
+
+from test_util import init_runtime
+
+
+class FakeBintrayHandler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+  existing_versions = ['/packages/org/repo/pkg-a/versions/1.0.0',
+                       '/packages/org/repo/pkg-b/versions/2.0.0']
+  failures_remaining = {}
+  connections = set()
+  requests = []
+
+  def log_message(self, *args):
+    pass
+
+  def __respond(self, code, body=b'', headers=None):
+    self.send_response(code)
+    for key, value in (headers or {}).items():
+      self.send_header(key, value)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def do_GET(self):
+    FakeBintrayHandler.connections.add(self.client_address)
+    FakeBintrayHandler.requests.append(self.path)
+    remaining = FakeBintrayHandler.failures_remaining.get(self.path, 0)
+    if remaining:
+      FakeBintrayHandler.failures_remaining[self.path] = remaining - 1
+      self.__respond(503, headers={'Retry-After': '0'})
+    elif self.path in FakeBintrayHandler.existing_versions:
+      self.__respond(200, b'{}')
+    elif self.path.startswith('/repos/org/repo/packages'):
+      start = int(self.path.split('start_pos=')[1])
+      names = ['pkg-a', 'pkg-b', 'pkg-c'][start:start + 2]
+      body = json.JSONEncoder().encode([{'name': name} for name in names])
+      self.__respond(200, body.encode('utf-8'),
+                     headers={'X-RangeLimit-Total': '3'})
+    elif self.path == '/packages/org/repo/forbidden/versions/1':
+      self.__respond(403)
+    else:
+      self.__respond(404)
+
+
+class ThreadedServer(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+
+class TestBintrayClient(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.server = ThreadedServer(('localhost', 0), FakeBintrayHandler)
+    cls.base_url = 'http://localhost:%d/' % cls.server.server_address[1]
+    thread = threading.Thread(target=cls.server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.server.shutdown()
+    cls.server.server_close()
+
+  def setUp(self):
+    FakeBintrayHandler.connections.clear()
+    del FakeBintrayHandler.requests[:]
+    FakeBintrayHandler.failures_remaining.clear()
+
+  def version_url(self, package, version):
+    return BintrayClient.version_path('org', 'repo', package, version)
+
+  def test_reuses_connection_and_retries(self):
+    client = BintrayClient(max_connections=1, initial_backoff_secs=0,
+                           api_url=self.base_url)
+    self.addCleanup(client.close)
+    path = '/packages/org/repo/pkg-a/versions/1.0.0'
+    FakeBintrayHandler.failures_remaining[path] = 2
+    self.assertEqual(
+        200, client.request('GET', self.version_url('pkg-a', '1.0.0')).status)
+    self.assertEqual(
+        404, client.request('GET', self.version_url('pkg-a', '9.9.9')).status)
+    self.assertEqual(4, len(FakeBintrayHandler.requests))
+    self.assertEqual(1, len(FakeBintrayHandler.connections))
+
+  def test_gives_up_after_max_retries(self):
+    client = BintrayClient(max_retries=1, initial_backoff_secs=0,
+                           api_url=self.base_url)
+    self.addCleanup(client.close)
+    path = '/packages/org/repo/pkg-a/versions/1.0.0'
+    FakeBintrayHandler.failures_remaining[path] = 5
+    self.assertEqual(
+        503, client.request('GET', self.version_url('pkg-a', '1.0.0')).status)
+    self.assertEqual(2, len(FakeBintrayHandler.requests))
+
+  def test_check_request_raises_on_error(self):
+    client = BintrayClient(api_url=self.base_url)
+    self.addCleanup(client.close)
+    self.assertIsNone(client.check_request(
+        'GET', self.version_url('pkg-c', '1.0.0'), allow_404=True))
+    with self.assertRaises(ResponseError):
+      client.check_request('GET', self.version_url('forbidden', '1'),
+                           allow_404=True)
+
+  def test_query_existing_versions(self):
+    client = BintrayClient(max_connections=4, api_url=self.base_url)
+    self.addCleanup(client.close)
+    keys = [('org', 'repo', package, version)
+            for package, version in [('pkg-a', '1.0.0'), ('pkg-a', '2.0.0'),
+                                     ('pkg-b', '2.0.0'), ('pkg-c', '1.0.0')]]
+    found = client.query_existing_versions(keys)
+    self.assertEqual([True, False, True, False],
+                     [found[key] for key in keys])
+
+  def test_list_packages_follows_pages(self):
+    client = BintrayClient(api_url=self.base_url)
+    self.addCleanup(client.close)
+    packages = client.list_packages('org/repo')
+    self.assertEqual(3, len(packages))
+    self.assertEqual(2, len(FakeBintrayHandler.requests))
+
+
+if __name__ == '__main__':
+  init_runtime()
+  unittest.main(verbosity=2)
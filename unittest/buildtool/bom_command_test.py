@@ -34,7 +34,7 @@ import buildtool
 import buildtool.__main__ as bomtool_main
 import buildtool.bom_commands
 from buildtool.bom_commands import (
-    BomBuilder, BuildBomCommand)
+    BomBuilder, BuildBomCommand, BuildBomCommandFactory)
 
 
 from test_util import (
@@ -65,6 +65,8 @@ def make_default_options(options):
   options.docker_registry = 'test-docker-registry'
   options.publish_gce_image_project = 'test-image-project-name'
   options.github_upstream_owner = 'spinnaker'
+  options.git_clone_policy = 'blobless'
+  options.git_mirror_dir = None
   return options
 
 
@@ -201,6 +203,32 @@ class TestBuildBomCommand(BaseGitRepoTestFixture):
     for key, value in golden_bom.items():
       self.assertEqual(value, bom[key])
 
+  def run_build_bom(self, repository_executor):
+    options = self.options
+    options.git_branch = PATCH_BRANCH
+    options.github_owner = 'default'
+    options.github_disable_upstream_push = True
+    options.git_fallback_branch = None
+    options.one_at_a_time = False
+    options.only_repositories = ','.join(ALL_STANDARD_TEST_BOM_REPO_NAMES)
+    options.exclude_repositories = None
+    options.refresh_from_bom_path = None
+    options.refresh_from_bom_version = None
+    options.bom_path = os.path.join(
+        self.test_root, repository_executor + '_bom.yml')
+    options.repository_executor = repository_executor
+    command = BuildBomCommandFactory().make_command(options)
+    command()
+    with open(options.bom_path, 'r') as stream:
+      return yaml.safe_load(stream.read())
+
+  def test_build_bom_in_worker_processes(self):
+    expect = self.run_build_bom('thread')['services']
+    self.assertEqual(
+        set(['gate', 'monitoring-daemon', 'monitoring-third-party']),
+        set(expect.keys()))
+    self.assertEqual(expect, self.run_build_bom('process')['services'])
+
 
 class TestBomBuilder(BaseGitRepoTestFixture):
   def make_test_options(self):
@@ -51,6 +51,8 @@ class TestBomRepositoryCommandProcessor(BaseGitRepoTestFixture):
     options.only_repositories = None
     options.exclude_repositories = None
     options.github_disable_upstream_push = True
+    options.git_clone_policy = 'blobless'
+    options.git_mirror_dir = None
     options.git_branch = PATCH_BRANCH
     write_to_path(yaml.safe_dump(self.golden_bom), options.bom_path)
     return options
@@ -0,0 +1,87 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-docstring
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from buildtool.bom_service_index import BomServiceIndex
+
+from test_util import init_runtime
+
+
+PREFIX = 'gs://test-bucket/bom/'
+
+
+def make_bom(version):
+  return {'version': version,
+          'services': {'clouddriver': {'version': '1.2.3-4', 'commit': 'abc'}}}
+
+
+class TestBomServiceIndex(unittest.TestCase):
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp(prefix='bom_index_test')
+    self.path = os.path.join(self.temp_dir, 'index.jsonl')
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def count_lines(self):
+    with open(self.path, 'r') as stream:
+      return len(stream.readlines())
+
+  def test_entries_persist_by_generation(self):
+    index = BomServiceIndex(self.path)
+    index.record(PREFIX + '1.0.0.yml', '10', bom=make_bom('1.0.0'))
+    index.record(PREFIX + '1.1.0.yml', '20', error='Malformed')
+    index.record(PREFIX + 'uncached.yml', None, bom=make_bom('uncached'))
+    self.assertIsNotNone(index.lookup(PREFIX + 'uncached.yml', None))
+    index.save()
+    self.assertEqual(3, self.count_lines())
+
+    reloaded = BomServiceIndex(self.path)
+    self.assertEqual(make_bom('1.0.0'),
+                     reloaded.lookup(PREFIX + '1.0.0.yml', '10')['bom'])
+    self.assertEqual('Malformed',
+                     reloaded.lookup(PREFIX + '1.1.0.yml', '20')['error'])
+    self.assertIsNone(reloaded.lookup(PREFIX + '1.0.0.yml', '11'))
+    self.assertIsNone(reloaded.lookup(PREFIX + 'uncached.yml', None))
+
+    reloaded.record(PREFIX + '1.1.0.yml', '21', bom=make_bom('1.1.0'))
+    reloaded.save()
+    self.assertEqual(4, self.count_lines())
+    self.assertIsNotNone(
+        BomServiceIndex(self.path).lookup(PREFIX + '1.1.0.yml', '21'))
+
+  def test_forget_and_compact(self):
+    index = BomServiceIndex(self.path)
+    for version in ['1.0.0', '1.1.0', '1.2.0']:
+      index.record(PREFIX + version + '.yml', '1', bom=make_bom(version))
+    index.save()
+
+    index.forget_missing(PREFIX + '1.', [PREFIX + '1.0.0.yml'])
+    index.record(PREFIX + '1.0.0.yml', '2', bom=make_bom('1.0.0'))
+    index.save()
+    self.assertEqual(2, self.count_lines())
+    reloaded = BomServiceIndex(self.path)
+    self.assertIsNone(reloaded.lookup(PREFIX + '1.1.0.yml', '1'))
+    self.assertIsNotNone(reloaded.lookup(PREFIX + '1.0.0.yml', '2'))
+
+
+if __name__ == '__main__':
+  init_runtime()
+  unittest.main(verbosity=2)
@@ -0,0 +1,92 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-docstring
+
+import re
+import unittest
+
+try:
+  from StringIO import StringIO
+except ImportError:
+  from io import StringIO
+
+from buildtool.bom_service_table import BomServiceTable
+
+from test_util import init_runtime
+
+
+RELEASED_MATCHER = re.compile(r'^\d+(?:\.\d+){2}$')
+
+
+def make_info(version, timestamp):
+  return {'bom_version': version, 'bom_timestamp': timestamp}
+
+
+def make_table():
+  table = BomServiceTable()
+  table.add_service_name('echo')
+  table.add_bom(make_info('master-2', '2018-01-02'),
+                [('clouddriver', '1.2.3', 'abc', '4'),
+                 ('deck', '2.0.0', 'def', '5')])
+  table.add_bom(make_info('1.0.0', '2018-01-01'),
+                [('clouddriver', '1.2.3', 'abc', '4')])
+  return table
+
+
+class TestBomServiceTable(unittest.TestCase):
+  def test_to_service_map(self):
+    table = make_table()
+    self.assertEqual(3, len(table))
+    self.assertEqual(set(['1.0.0', 'master-2']), table.bom_versions())
+    self.assertEqual(
+        {'echo': None,
+         'clouddriver': {'1.2.3': {'abc': {'4': [
+             make_info('1.0.0', '2018-01-01'),
+             make_info('master-2', '2018-01-02')]}}},
+         'deck': {'2.0.0': {'def': {'5': [
+             make_info('master-2', '2018-01-02')]}}}},
+        table.to_service_map())
+
+  def test_partition(self):
+    released, unreleased = make_table().partition(RELEASED_MATCHER)
+    self.assertEqual(
+        {'echo': None, 'deck': None,
+         'clouddriver': {'1.2.3': {'abc': {'4': [
+             make_info('1.0.0', '2018-01-01')]}}}},
+        released.to_service_map())
+    self.assertEqual(
+        {'echo': None, 'clouddriver': None,
+         'deck': {'2.0.0': {'def': {'5': [
+             make_info('master-2', '2018-01-02')]}}}},
+        unreleased.to_service_map())
+
+  def test_write_and_read(self):
+    table = make_table()
+    _, unreleased = table.partition(RELEASED_MATCHER)
+    for original in [table, unreleased]:
+      stream = StringIO()
+      original.write(stream)
+      stream.seek(0)
+      copy = BomServiceTable.read(stream)
+      self.assertEqual(original.service_names, copy.service_names)
+      self.assertEqual(original.to_service_map(), copy.to_service_map())
+
+    with self.assertRaises(ValueError):
+      BomServiceTable.read(StringIO('{"version": 0}\n'))
+
+
+if __name__ == '__main__':
+  init_runtime()
+  unittest.main(verbosity=2)
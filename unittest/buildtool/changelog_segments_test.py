@@ -0,0 +1,142 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-docstring
+
+import os
+import shutil
+import tempfile
+import unittest
+import yaml
+
+from buildtool import (
+    CommitMessage,
+    GitRepositorySpec,
+    RepositorySummary,
+    write_to_path)
+
+from buildtool.changelog_commands import (
+    BuildChangelogFactory,
+    ChangelogBuilder)
+from buildtool.changelog_segments import ChangelogSegmentStore
+
+from test_util import (
+    BaseGitRepoTestFixture,
+    PATCH_BRANCH,
+    init_runtime)
+
+
+def make_summary(commit_id, *messages):
+  return RepositorySummary(
+      commit_id, 'version-1.2.3', '1.2.3', '1.2.2',
+      [CommitMessage(commit_id, 'Author', 'Date', text) for text in messages])
+
+
+class TestChangelogSegmentStore(unittest.TestCase):
+  def setUp(self):
+    self.segment_dir = tempfile.mkdtemp(prefix='changelog_segments_test')
+    self.repository = GitRepositorySpec(
+        'clouddriver', origin='https://github.com/spinnaker/clouddriver')
+
+  def tearDown(self):
+    shutil.rmtree(self.segment_dir)
+
+  def test_lookup(self):
+    store = ChangelogSegmentStore(self.segment_dir, {'with_detail': False})
+    self.assertIsNone(store.lookup(self.repository, 'HEAD_A'))
+    store.record(self.repository, 'HEAD_A', None, 'version-1.2.2', 'TAG')
+    store.record(self.repository, 'HEAD_A', 'BASE', 'version-1.2.2', 'BASE')
+
+    reloaded = ChangelogSegmentStore(self.segment_dir, {'with_detail': False})
+    self.assertEqual('TAG', reloaded.lookup(self.repository, 'HEAD_A'))
+    self.assertEqual('BASE',
+                     reloaded.lookup(self.repository, 'HEAD_A', 'BASE'))
+    self.assertIsNone(reloaded.lookup(self.repository, 'HEAD_B'))
+    self.assertIsNone(reloaded.lookup(self.repository, 'HEAD_A', 'OTHER'))
+
+    moved = GitRepositorySpec(
+        'clouddriver', origin='https://github.com/fork/clouddriver')
+    self.assertIsNone(reloaded.lookup(moved, 'HEAD_A'))
+
+    detailed = ChangelogSegmentStore(self.segment_dir, {'with_detail': True})
+    self.assertIsNone(detailed.lookup(self.repository, 'HEAD_A'))
+
+  def test_builder_with_rendered_segments(self):
+    repositories = [
+        GitRepositorySpec(name, origin='https://github.com/spinnaker/' + name)
+        for name in ['clouddriver', 'deck', 'echo']]
+    summaries = [make_summary('A' * 40, 'fix(cats): fixed it'),
+                 make_summary('B' * 40, 'feat(ui): added it'),
+                 make_summary('C' * 40)]
+
+    expect_builder = ChangelogBuilder()
+    for repository, summary in zip(repositories, summaries):
+      expect_builder.add_repository(repository, summary)
+
+    builder = ChangelogBuilder()
+    builder.add_repository(repositories[2], summaries[2])
+    builder.add_repository(repositories[0], summaries[0])
+    entry = ChangelogBuilder()
+    entry.add_repository(repositories[1], summaries[1])
+    builder.add_rendered_segment(repositories[1], entry.build())
+    self.assertEqual(expect_builder.build(), builder.build())
+
+
+class TestBuildChangelogCommand(BaseGitRepoTestFixture):
+  def make_test_options(self):
+    options = super(TestBuildChangelogCommand, self).make_test_options()
+    options.bom_path = os.path.join(self.test_root, 'bom.yml')
+    options.one_at_a_time = False
+    options.only_repositories = None
+    options.exclude_repositories = None
+    options.github_disable_upstream_push = True
+    options.git_clone_policy = 'blobless'
+    options.git_mirror_dir = None
+    options.git_remote_refs_cache_path = None
+    options.git_remote_refs_cache_ttl_secs = 300
+    options.git_branch = PATCH_BRANCH
+    options.include_changelog_details = False
+    options.relative_to_bom_path = None
+    options.relative_to_bom_version = None
+    options.changelog_segment_dir = os.path.join(self.test_root, 'segments')
+    options.repository_executor = 'process'
+    write_to_path(yaml.safe_dump(self.golden_bom), options.bom_path)
+    return options
+
+  def read_changelog(self, command):
+    with open(os.path.join(command.get_output_dir(), 'changelog.md')) as stream:
+      return stream.read()
+
+  def test_segments_in_worker_processes(self):
+    factory = BuildChangelogFactory()
+    command = factory.make_command(self.options)
+    command()
+    changelog = self.read_changelog(command)
+    self.assertTrue(os.listdir(self.options.changelog_segment_dir))
+
+    # Every repository is skipped this time, but still has its segment.
+    command = factory.make_command(self.options)
+    command()
+    self.assertEqual(changelog, self.read_changelog(command))
+
+    self.options.changelog_segment_dir = None
+    self.options.repository_executor = 'thread'
+    command = factory.make_command(self.options)
+    command()
+    self.assertEqual(changelog, self.read_changelog(command))
+
+
+if __name__ == '__main__':
+  init_runtime()
+  unittest.main(verbosity=2)
@@ -0,0 +1,98 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-docstring
+
+import unittest
+
+from mock import patch
+
+from buildtool import (
+    CommitMessage,
+    SemanticVersion)
+
+from buildtool.commit_classifier import (
+    CommitClassification,
+    CommitClassifier)
+
+from test_util import init_runtime
+
+
+MESSAGES = [
+    'fix(test): fixed something',
+    'feat(test): added something',
+    'feature: added something',
+    'config(test): changed a default',
+    'chore(deps): bump',
+    'docs (readme): spaced before the paren',
+    'feat (test): spaced feature',
+    'refactor: tidy up\n\nBREAKING CHANGE: removed an api',
+    'Updated something\n\n* fix(test): as a bullet',
+    'Updated something\n\n*fix(test): not a bullet',
+    'fixup: not a type',
+    'fix2: not a type',
+    'Merged something\n\nfix(a): first\nfeat(b): second',
+    'No conventional title at all (#123)',
+    '',
+]
+
+
+class TestCommitClassifier(unittest.TestCase):
+  def test_semver_level_matches_regexs(self):
+    for text in MESSAGES:
+      commit = CommitMessage('ID', 'Author', 'Date', text)
+      self.assertEqual(
+          commit.determine_semver_implication(
+              major_regexs=CommitMessage.DEFAULT_MAJOR_REGEXS,
+              minor_regexs=CommitMessage.DEFAULT_MINOR_REGEXS,
+              patch_regexs=CommitMessage.DEFAULT_PATCH_REGEXS),
+          commit.determine_semver_implication(),
+          text)
+
+  def test_classify_text(self):
+    tests = [
+        ('fix(test): x', ('PATCH', 'Fixes', 'test')),
+        ('feat(test): x', ('MINOR', 'Features', 'test')),
+        ('config(test): x', ('MINOR', 'Configuration', 'test')),
+        ('chore(deps): x', ('PATCH', 'Other', 'deps')),
+        ('feat (test): x', ('MINOR', 'Other', '')),
+        ('fix(a): x\nBREAKING CHANGE: y', ('MAJOR', 'Breaking Changes', 'a')),
+        ('fix(a): x\nfeat(b): y', ('MINOR', 'Features', 'a')),
+        ('Something else', (None, 'Other', '')),
+    ]
+    for text, expect in tests:
+      self.assertEqual(CommitClassification(*expect),
+                       CommitClassifier.classify_text(text))
+
+  def test_classify_is_remembered(self):
+    commit = CommitMessage('REMEMBERED', 'Author', 'Date', 'fix(x): y')
+    other = CommitMessage('REMEMBERED', 'Author', 'Date', 'feat(x): y')
+    self.assertEqual('PATCH', CommitClassifier.classify(commit).level)
+    with patch('buildtool.commit_classifier.CommitClassifier.classify_text'
+              ) as mock_classify:
+      self.assertEqual('PATCH', CommitClassifier.classify(commit).level)
+      self.assertEqual(0, mock_classify.call_count)
+    self.assertEqual('MINOR', CommitClassifier.classify(other).level)
+
+  def test_default_level(self):
+    commit = CommitMessage('ID', 'Author', 'Date', 'Something else')
+    self.assertEqual(
+        SemanticVersion.PATCH_INDEX,
+        commit.determine_semver_implication(
+            default_semver_index=SemanticVersion.PATCH_INDEX))
+
+
+if __name__ == '__main__':
+  init_runtime()
+  unittest.main(verbosity=2)
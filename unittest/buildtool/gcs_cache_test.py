@@ -0,0 +1,102 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-docstring
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from buildtool.gcs_cache import GcsObjectCache
+
+from test_util import init_runtime
+
+
+PREFIX = 'gs://test-bucket/bom/'
+
+
+class FakeGsutil(object):
+  def __init__(self, objects):
+    # url to list of (generation, content) with the live version last.
+    self.objects = objects
+    self.downloaded = []
+
+  def __call__(self, command, **kwargs):
+    if command.startswith('gsutil ls -a '):
+      return '\n'.join(['{0}#{1}'.format(url, generation)
+                        for url, versions in sorted(self.objects.items())
+                        for generation, _ in versions])
+    if command.startswith('gsutil -m -q cp -I '):
+      download_dir = command.split()[-1]
+      for line in kwargs['stdin'].read().split('\n'):
+        if not line:
+          continue
+        url, generation = line.split('#')
+        content = dict(self.objects.get(url, [])).get(generation)
+        if content is None:
+          continue
+        self.downloaded.append(url)
+        with open(os.path.join(download_dir, url[url.rfind('/') + 1:]),
+                  'w') as stream:
+          stream.write(content)
+      return ''
+    raise ValueError('Unexpected command: ' + command)
+
+
+class TestGcsObjectCache(unittest.TestCase):
+  def setUp(self):
+    self.cache_dir = tempfile.mkdtemp(prefix='gcs_cache_test')
+
+  def tearDown(self):
+    shutil.rmtree(self.cache_dir)
+
+  def test_fetch_only_new_generations(self):
+    gsutil = FakeGsutil({
+        PREFIX + '1.0.0.yml': [('100', 'version: 1.0.0')],
+        PREFIX + '1.1.0.yml': [('200', 'old'), ('201', 'version: 1.1.0')],
+        PREFIX + 'README.txt': [('300', 'ignored')],
+    })
+    with patch('buildtool.gcs_cache.check_subprocess', side_effect=gsutil):
+      cache = GcsObjectCache(self.cache_dir, batch_size=1)
+      objects = cache.list_objects(PREFIX, suffix='.yml')
+      self.assertEqual([(PREFIX + '1.0.0.yml', '100'),
+                        (PREFIX + '1.1.0.yml', '201')], objects)
+
+      fetched = dict(cache.fetch(objects))
+      with open(fetched[PREFIX + '1.1.0.yml']) as stream:
+        self.assertEqual('version: 1.1.0', stream.read())
+      self.assertEqual(2, len(gsutil.downloaded))
+
+      gsutil.objects[PREFIX + '1.0.0.yml'].append(('101', 'version: 1.0.1'))
+      gsutil.objects[PREFIX + '1.2.0.yml'] = [('400', 'version: 1.2.0')]
+      gsutil.objects[PREFIX + '1.3.0.yml'] = []
+      del gsutil.downloaded[:]
+      objects = cache.list_objects(PREFIX, suffix='.yml')
+      objects.append((PREFIX + 'missing.yml', '1'))
+      fetched = dict(cache.fetch(objects))
+      self.assertEqual(sorted([PREFIX + '1.0.0.yml', PREFIX + '1.2.0.yml']),
+                       sorted(gsutil.downloaded))
+      with open(fetched[PREFIX + '1.0.0.yml']) as stream:
+        self.assertEqual('version: 1.0.1', stream.read())
+      self.assertIsNone(fetched[PREFIX + 'missing.yml'])
+      self.assertFalse([name for name in os.listdir(self.cache_dir)
+                        if name.startswith('staging')])
+
+
+if __name__ == '__main__':
+  init_runtime()
+  unittest.main(verbosity=2)
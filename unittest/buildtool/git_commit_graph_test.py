@@ -0,0 +1,139 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-docstring
+
+import argparse
+import os
+import shutil
+import tempfile
+import unittest
+
+from buildtool import (
+    GitRunner,
+    check_subprocess,
+    check_subprocess_sequence)
+
+from buildtool.git_commit_graph import CommitGraphIndex
+
+from test_util import init_runtime
+
+
+def make_default_options():
+  parser = argparse.ArgumentParser()
+  GitRunner.add_parser_args(parser, {})
+  return parser.parse_args([])
+
+
+class TestCommitGraphIndex(unittest.TestCase):
+  @classmethod
+  def run_git(cls, command):
+    return check_subprocess(
+        'git -C "{dir}" {command}'.format(dir=cls.git_dir, command=command))
+
+  @classmethod
+  def setUpClass(cls):
+    cls.git = GitRunner(make_default_options())
+    cls.base_temp_dir = tempfile.mkdtemp(prefix='commit_graph_test')
+    cls.git_dir = os.path.join(cls.base_temp_dir, 'test_repository')
+    os.makedirs(cls.git_dir)
+
+    gitify = lambda args: 'git -C "{dir}" {args}'.format(
+        dir=cls.git_dir, args=args)
+    check_subprocess_sequence([
+        gitify('init'),
+        gitify('checkout -b master'),
+        gitify('commit --allow-empty -m "feat(test): base"'),
+        gitify('tag version-0.1.0 HEAD'),
+        gitify('checkout -b release-a'),
+        gitify('commit --allow-empty -m "fix(test): on a"'),
+        gitify('tag -a version-0.1.1 -m "annotated" HEAD'),
+        gitify('checkout master'),
+        gitify('commit --allow-empty -m "feat(test): on master"'),
+        gitify('merge --no-ff -m "merge a" release-a'),
+        gitify('commit --allow-empty -m "feat(test): after merge"'),
+    ])
+
+  @classmethod
+  def tearDownClass(cls):
+    shutil.rmtree(cls.base_temp_dir)
+
+  def test_merge_base_matches_git(self):
+    graph = CommitGraphIndex(self.git, self.git_dir)
+    graph.refresh()
+    master = graph.resolve_ref('master')
+    tag_commit = graph.query_tag_commit('version-0.1.1')
+    self.assertEqual(self.run_git('rev-parse version-0.1.1^{commit}'),
+                     tag_commit)
+    self.assertEqual(self.run_git('merge-base master version-0.1.1'),
+                     graph.merge_base(master, tag_commit))
+    self.assertEqual(tag_commit, graph.merge_base(tag_commit, master))
+
+    head_parent = self.run_git('rev-parse master~1')
+    release_head = graph.resolve_ref('release-a')
+    self.assertEqual(self.run_git('merge-base master~2 release-a'),
+                     graph.merge_base(self.run_git('rev-parse master~2'),
+                                      release_head))
+    self.assertIn(head_parent, graph.ancestors(master))
+    containing = graph.query_branches_containing(
+        release_head, ref_prefix='refs/heads/')
+    self.assertIn('master', containing)
+    self.assertIn('release-a', containing)
+
+  def test_incremental_refresh_is_persisted(self):
+    graph = CommitGraphIndex(self.git, self.git_dir)
+    graph.refresh()
+    self.run_git('checkout -b incremental master')
+    self.run_git('commit --allow-empty -m "fix(test): incremental"')
+    head = self.run_git('rev-parse HEAD')
+    self.assertFalse(graph.has_commit(head))
+
+    graph.refresh()
+    self.assertTrue(graph.has_commit(head))
+    reloaded = CommitGraphIndex(self.git, self.git_dir)
+    self.assertTrue(reloaded.has_commit(head))
+    self.assertEqual(head, reloaded.resolve_ref('incremental'))
+    self.run_git('checkout master')
+
+  def test_deepened_shallow_clone_is_rebuilt(self):
+    clone_dir = os.path.join(self.base_temp_dir, 'shallow_clone')
+    check_subprocess('git clone --depth 1 --branch master file://{src} {dest}'
+                     .format(src=self.git_dir, dest=clone_dir))
+    index_path = os.path.join(
+        clone_dir, '.git', CommitGraphIndex.INDEX_BASENAME)
+    clone_git = lambda args: check_subprocess(
+        'git -C "{dir}" {args}'.format(dir=clone_dir, args=args))
+
+    graph = CommitGraphIndex(self.git, clone_dir)
+    graph.refresh()
+    head = graph.resolve_ref('refs/heads/master')
+    self.assertEqual(set([head]), graph.ancestors(head))
+    self.assertFalse(os.path.exists(index_path))
+
+    clone_git('fetch --deepen=1 origin')
+    graph.refresh()
+    self.assertEqual(set(clone_git('rev-list HEAD').split()),
+                     graph.ancestors(head))
+    self.assertFalse(os.path.exists(index_path))
+
+    clone_git('fetch --deepen=100 origin')
+    graph.refresh()
+    self.assertEqual(set(clone_git('rev-list HEAD').split()),
+                     graph.ancestors(head))
+    self.assertTrue(graph.has_commit(graph.query_tag_commit('version-0.1.0')))
+
+
+if __name__ == '__main__':
+  init_runtime()
+  unittest.main(verbosity=2)
@@ -0,0 +1,168 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-docstring
+
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from buildtool import (
+    ExecutionError,
+    GitRunner,
+    check_subprocess,
+    check_subprocess_sequence)
+
+from buildtool.git_fetch import FetchCoordinator
+
+from test_util import init_runtime
+
+
+def make_default_options():
+  parser = argparse.ArgumentParser()
+  GitRunner.add_parser_args(parser, {})
+  return parser.parse_args([])
+
+
+class ScriptedNetworkGit(object):
+  """Delegates to a GitRunner but scripts its network commands."""
+
+  def __init__(self, git):
+    self.git = git
+    self.network_calls = 0
+    self.fetch_entered = threading.Event()
+    self.release_fetch = threading.Event()
+
+  def __getattr__(self, name):
+    return getattr(self.git, name)
+
+  def check_network_run(self, git_dir, command):
+    self.network_calls += 1
+    if self.network_calls == 2:
+      raise ExecutionError('Injected failure', program='git')
+    if command.startswith('fetch '):
+      self.fetch_entered.set()
+      self.release_fetch.wait()
+      return 'fetched'
+    return self.git.check_network_run(git_dir, command)
+
+
+class TestFetchCoordinator(unittest.TestCase):
+  def setUp(self):
+    self.git = GitRunner(make_default_options())
+    self.base_temp_dir = tempfile.mkdtemp(prefix='git_fetch_test')
+    self.origin_dir = os.path.join(self.base_temp_dir, 'origin')
+    self.git_dir = os.path.join(self.base_temp_dir, 'clone')
+    os.makedirs(self.origin_dir)
+    check_subprocess_sequence([
+        'git -C "{dir}" init'.format(dir=self.origin_dir),
+        'git -C "{dir}" checkout -b master'.format(dir=self.origin_dir),
+        'git -C "{dir}" commit --allow-empty -m "feat(test): base"'.format(
+            dir=self.origin_dir),
+        'git clone {origin} {dir}'.format(origin=self.origin_dir,
+                                          dir=self.git_dir)])
+
+  def tearDown(self):
+    shutil.rmtree(self.base_temp_dir)
+
+  def test_skips_unchanged_fetch(self):
+    coordinator = FetchCoordinator(self.git)
+    coordinator.fetch(self.git_dir)
+    self.assertEqual('', coordinator.fetch(self.git_dir))
+
+    # Another process sees the same state.
+    self.assertEqual('', FetchCoordinator(self.git).fetch(self.git_dir))
+
+    # As when the remote's listing expires from the RemoteRefResolver.
+    check_subprocess('git -C "{dir}" tag version-0.1.0'.format(
+        dir=self.origin_dir))
+    self.git.remote_refs().invalidate(self.origin_dir)
+    self.assertNotEqual('', coordinator.fetch(self.git_dir))
+    self.assertEqual(
+        check_subprocess('git -C "{dir}" rev-parse master'.format(
+            dir=self.origin_dir)),
+        self.git.query_commit_at_tag(self.git_dir, 'version-0.1.0'))
+    self.assertEqual('', coordinator.fetch(self.git_dir))
+
+  def test_refetches_after_local_change(self):
+    coordinator = FetchCoordinator(self.git)
+    coordinator.fetch(self.git_dir)
+    check_subprocess('git -C "{dir}" update-ref -d refs/remotes/origin/master'
+                     .format(dir=self.git_dir))
+    coordinator.fetch(self.git_dir)
+    self.assertEqual(
+        check_subprocess('git -C "{dir}" rev-parse master'.format(
+            dir=self.origin_dir)),
+        check_subprocess('git -C "{dir}" rev-parse origin/master'.format(
+            dir=self.git_dir)))
+
+  def test_uses_remote_ref_resolver(self):
+    coordinator = FetchCoordinator(self.git)
+    coordinator.fetch(self.git_dir)
+
+    # The listing is reused, so the fetch does not see the new tag.
+    self.git.remote_refs().query_refs(self.origin_dir)
+    check_subprocess('git -C "{dir}" tag version-0.1.0'.format(
+        dir=self.origin_dir))
+    self.assertEqual('', coordinator.fetch(self.git_dir))
+
+    # Once the listing expires the tag is fetched. The real fetch also
+    # forgets the new listing, so the next fetch sees later changes.
+    self.git.remote_refs().invalidate(self.origin_dir)
+    self.assertNotEqual('', coordinator.fetch(self.git_dir))
+    check_subprocess('git -C "{dir}" tag version-0.2.0'.format(
+        dir=self.origin_dir))
+    self.assertNotEqual('', coordinator.fetch(self.git_dir))
+    self.assertIn('refs/tags/version-0.2.0',
+                  self.git.remote_refs().query_refs(self.origin_dir))
+
+  def test_failed_fetch_is_not_coalesced(self):
+    git = ScriptedNetworkGit(self.git)
+    coordinator = FetchCoordinator(git)
+    outcomes = []
+
+    def fetch():
+      try:
+        outcomes.append(coordinator.fetch(self.git_dir))
+      except ExecutionError as ex:
+        outcomes.append(ex)
+
+    # Two callers wait on the first fetch. The remote changes meanwhile,
+    # so whichever goes next fetches again and fails. The other must not
+    # take that failed fetch as up to date.
+    first = threading.Thread(target=fetch)
+    first.start()
+    git.fetch_entered.wait()
+    waiters = [threading.Thread(target=fetch) for _ in range(2)]
+    for thread in waiters:
+      thread.start()
+    time.sleep(0.2)
+    check_subprocess('git -C "{dir}" tag version-0.1.0'.format(
+        dir=self.origin_dir))
+    git.release_fetch.set()
+    for thread in [first] + waiters:
+      thread.join()
+
+    self.assertEqual('fetched', outcomes[0])
+    self.assertEqual(['fetched'], [outcome for outcome in outcomes[1:]
+                                   if not isinstance(outcome, ExecutionError)])
+
+
+if __name__ == '__main__':
+  init_runtime()
+  unittest.main(verbosity=2)
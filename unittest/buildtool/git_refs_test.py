@@ -0,0 +1,139 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-docstring
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from buildtool import (
+    check_subprocess,
+    check_subprocess_sequence)
+
+from buildtool.git_refs import (
+    LocalRepositoryQuery,
+    LocalRepositoryQueryRegistry)
+
+from test_util import init_runtime
+
+
+class TestLocalRepositoryQuery(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.base_temp_dir = tempfile.mkdtemp(prefix='git_refs_test')
+    cls.git_dir = os.path.join(cls.base_temp_dir, 'repo')
+    os.makedirs(cls.git_dir)
+    gitify = lambda args: 'git -C "{dir}" {args}'.format(
+        dir=cls.git_dir, args=args)
+    check_subprocess_sequence([
+        gitify('init'),
+        gitify('checkout -b master'),
+        gitify('commit --allow-empty -m "feat(test): base"'),
+        gitify('tag -a version-0.1.0 -m "annotated"'),
+        gitify('tag version-0.1.1'),
+        gitify('remote add origin https://github.com/testing/repo.git'),
+        gitify('remote add upstream https://github.com/upstream/repo.git'),
+        gitify('update-ref refs/remotes/origin/master HEAD'),
+        gitify('pack-refs --all'),
+        # These are loose and the first overrides the packed ref.
+        gitify('commit --allow-empty -m "fix(test): loose"'),
+        gitify('tag version-0.2.0')])
+
+  @classmethod
+  def tearDownClass(cls):
+    LocalRepositoryQueryRegistry.close_all()
+    shutil.rmtree(cls.base_temp_dir)
+
+  def git(self, args):
+    return check_subprocess(
+        'git -C "{dir}" {args}'.format(dir=self.git_dir, args=args))
+
+  def test_unsupported(self):
+    self.assertIsNone(LocalRepositoryQueryRegistry.get(self.base_temp_dir))
+    self.assertIsNone(LocalRepositoryQuery.find_dot_git(self.base_temp_dir))
+
+  def test_list_refs(self):
+    query = LocalRepositoryQueryRegistry.get(self.git_dir)
+    self.assertEqual(query, LocalRepositoryQueryRegistry.get(self.git_dir))
+
+    expect = {}
+    for line in self.git('show-ref').split('\n'):
+      object_id, name = line.split(' ')
+      expect[name] = object_id
+    self.assertEqual(expect, query.list_refs())
+    self.assertEqual(
+        {name: object_id for name, object_id in expect.items()
+         if name.startswith('refs/tags/')},
+        query.list_refs('refs/tags/'))
+
+  def test_query_head(self):
+    query = LocalRepositoryQueryRegistry.get(self.git_dir)
+    self.assertEqual(('refs/heads/master', self.git('rev-parse HEAD')),
+                     query.query_head())
+
+  def test_query_remote_urls(self):
+    query = LocalRepositoryQueryRegistry.get(self.git_dir)
+    self.assertEqual(
+        {'origin': 'https://github.com/testing/repo.git',
+         'upstream': 'https://github.com/upstream/repo.git'},
+        query.query_remote_urls())
+
+  def test_peel_to_commit(self):
+    query = LocalRepositoryQueryRegistry.get(self.git_dir)
+    for name in ['version-0.1.0', 'version-0.2.0', 'HEAD~1']:
+      self.assertEqual(self.git('rev-list -n 1 ' + name),
+                       query.peel_to_commit(name))
+    self.assertIsNone(query.peel_to_commit('version-9.9.9'))
+
+  def test_packed_refs_rewritten_within_same_mtime(self):
+    query = LocalRepositoryQueryRegistry.get(self.git_dir)
+    self.assertIn('refs/tags/version-0.1.1', query.list_refs())
+    path = os.path.join(self.git_dir, '.git', 'packed-refs')
+    stat = os.stat(path)
+    self.git('tag version-0.0.9 HEAD~1')
+    self.git('pack-refs')
+    # As if on a filesystem with coarse timestamps.
+    os.utime(path, (stat.st_atime, stat.st_mtime))
+    self.assertEqual(self.git('rev-parse HEAD~1'),
+                     query.resolve_ref('refs/tags/version-0.0.9'))
+    self.git('tag -d version-0.0.9')
+
+  def test_peel_after_cat_file_dies(self):
+    query = LocalRepositoryQuery(self.git_dir,
+                                 os.path.join(self.git_dir, '.git'))
+    head = self.git('rev-parse HEAD')
+    self.assertEqual(head, query.peel_to_commit('HEAD'))
+    process = query._LocalRepositoryQuery__cat_file
+    process.kill()
+    process.wait()
+    self.assertEqual(head, query.peel_to_commit('HEAD'))
+    self.assertIsNot(process, query._LocalRepositoryQuery__cat_file)
+
+    # If it cannot be restarted then git rev-parse answers instead.
+    query._LocalRepositoryQuery__cat_file.kill()
+    with patch.object(LocalRepositoryQuery,
+                      '_LocalRepositoryQuery__start_cat_file',
+                      side_effect=OSError('Injected failure')):
+      self.assertEqual(head, query.peel_to_commit('HEAD'))
+      self.assertIsNone(query.peel_to_commit('version-9.9.9'))
+    query.close()
+
+
+if __name__ == '__main__':
+  init_runtime()
+  unittest.main(verbosity=2)
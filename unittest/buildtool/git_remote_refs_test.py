@@ -0,0 +1,120 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-docstring
+
+import argparse
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from buildtool import (
+    GitRunner,
+    check_subprocess,
+    check_subprocess_sequence)
+
+from buildtool.git_remote_refs import RemoteRefResolver
+
+from test_util import init_runtime
+
+
+def make_default_options():
+  parser = argparse.ArgumentParser()
+  GitRunner.add_parser_args(parser, {})
+  return parser.parse_args([])
+
+
+class TestRemoteRefResolver(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.git = GitRunner(make_default_options())
+    cls.base_temp_dir = tempfile.mkdtemp(prefix='remote_refs_test')
+    cls.git_dirs = [os.path.join(cls.base_temp_dir, name)
+                    for name in ['first', 'second']]
+    for git_dir in cls.git_dirs:
+      os.makedirs(git_dir)
+      gitify = lambda args, git_dir=git_dir: 'git -C "{dir}" {args}'.format(
+          dir=git_dir, args=args)
+      check_subprocess_sequence([
+          gitify('init'),
+          gitify('checkout -b master'),
+          gitify('commit --allow-empty -m "feat(test): base"'),
+          gitify('tag -a version-0.1.0 -m "annotated"'),
+          gitify('checkout -b release-a'),
+          gitify('commit --allow-empty -m "fix(test): on a"'),
+          gitify('checkout master')])
+
+  @classmethod
+  def tearDownClass(cls):
+    shutil.rmtree(cls.base_temp_dir)
+
+  def rev_parse(self, git_dir, ref):
+    return check_subprocess(
+        'git -C "{dir}" rev-parse {ref}^{{commit}}'.format(dir=git_dir,
+                                                            ref=ref))
+
+  def test_resolve(self):
+    resolver = RemoteRefResolver(self.git)
+    git_dir = self.git_dirs[0]
+    for name in ['master', 'release-a', 'version-0.1.0',
+                 'refs/heads/release-a']:
+      self.assertEqual(self.rev_parse(git_dir, name),
+                       resolver.resolve(git_dir, name))
+    self.assertIsNone(resolver.resolve(git_dir, 'missing'))
+
+  def test_prefetch_and_cache(self):
+    cache_path = os.path.join(self.base_temp_dir, 'refs.json')
+    resolver = RemoteRefResolver(self.git, cache_path=cache_path)
+    resolver.prefetch(self.git_dirs)
+
+    reloaded = RemoteRefResolver(self.git, cache_path=cache_path)
+    with patch('buildtool.git_support.check_subprocess') as mock_check:
+      for git_dir in self.git_dirs:
+        self.assertEqual(self.rev_parse(git_dir, 'release-a'),
+                         reloaded.resolve(git_dir, 'release-a'))
+      self.assertEqual(0, mock_check.call_count)
+
+    expired = RemoteRefResolver(self.git, cache_path=cache_path, ttl_secs=-1)
+    with patch('buildtool.git_support.check_subprocess',
+               return_value='') as mock_check:
+      self.assertIsNone(expired.resolve(self.git_dirs[0], 'master'))
+      self.assertEqual(1, mock_check.call_count)
+
+  def test_push_invalidates(self):
+    cache_path = os.path.join(self.base_temp_dir, 'push_refs.json')
+    options = make_default_options()
+    options.git_remote_refs_cache_path = cache_path
+    options.git_never_push = False
+    git = GitRunner(options)
+    origin = self.git_dirs[1]
+    clone_dir = os.path.join(self.base_temp_dir, 'push_clone')
+    check_subprocess('git clone {origin} {dir}'.format(origin=origin,
+                                                       dir=clone_dir))
+    self.assertIsNone(git.remote_refs().resolve(origin, 'pushed'))
+    git.remote_refs().save()
+
+    check_subprocess('git -C "{dir}" branch pushed'.format(dir=clone_dir))
+    git.push_refs_to_origin(clone_dir, ['pushed'])
+    commit = self.rev_parse(clone_dir, 'pushed')
+    reloaded = RemoteRefResolver(git, cache_path=cache_path)
+    self.assertEqual(commit, reloaded.resolve(origin, 'pushed'))
+    self.assertEqual(commit, git.remote_refs().resolve(origin, 'pushed'))
+
+
+if __name__ == '__main__':
+  init_runtime()
+  unittest.main(verbosity=2)
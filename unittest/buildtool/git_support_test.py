@@ -17,23 +17,28 @@
 import argparse
 import datetime
 import os
+import re
 import shutil
 import tempfile
 import unittest
 import yaml
 
 import dateutil.parser
+from mock import patch
 
 from buildtool import (
     CommitMessage,
     GitRepositorySpec,
     GitRunner,
+    RefTransaction,
     RepositorySummary,
     SemanticVersion,
 
     check_subprocess,
     check_subprocess_sequence)
 
+from buildtool.git_summary_cache import RepositorySummaryCache
+
 from test_util import init_runtime
 
 
@@ -318,6 +323,50 @@ class TestGitRunner(unittest.TestCase):
     self.assertEqual(BRANCH_A,
                      self.git.query_local_repository_branch(test_dir))
 
+  def test_clone_with_mirror(self):
+    options = make_default_options()
+    options.git_mirror_dir = os.path.join(self.base_temp_dir, 'mirrors')
+    git = GitRunner(options)
+    mirror_path = git.mirror_cache().mirror_path(
+        GitRunner.normalize_repo_url(self.git_dir))
+
+    for index, branch in enumerate([BRANCH_A, BRANCH_B]):
+      test_dir = os.path.join(
+          self.base_temp_dir, 'test_clone_with_mirror_%d' % index,
+          TEST_REPO_NAME)
+      repository = GitRepositorySpec(
+          TEST_REPO_NAME, git_dir=test_dir, origin=self.git_dir)
+      git.clone_repository_to_path(repository, branch=branch)
+      self.assertEqual(branch, git.query_local_repository_branch(test_dir))
+      with open(os.path.join(test_dir, '.git', 'objects', 'info',
+                             'alternates')) as stream:
+        self.assertEqual(os.path.join(mirror_path, 'objects'),
+                         stream.read().strip())
+
+    self.assertEqual(
+        git.query_local_repository_commit_id(self.git_dir),
+        check_subprocess('git -C "{dir}" rev-parse master'.format(
+            dir=mirror_path)))
+
+  def test_shallow_clone_deepens_to_version_tag(self):
+    options = make_default_options()
+    options.git_clone_policy = 'shallow'
+    git = GitRunner(options)
+    test_dir = os.path.join(self.base_temp_dir, 'test_shallow_clone',
+                            TEST_REPO_NAME)
+    repository = GitRepositorySpec(
+        TEST_REPO_NAME, git_dir=test_dir, origin='file://' + self.git_dir)
+    git.clone_repository_to_path(repository, branch=BRANCH_C)
+    self.assertTrue(git.is_shallow_repository(test_dir))
+    self.assertEqual(
+        '1', check_subprocess(
+            'git -C "{dir}" rev-list --count HEAD'.format(dir=test_dir)))
+
+    git.deepen_to_version_tag(test_dir)
+    self.assertEqual(
+        VERSION_BASE, check_subprocess(
+            'git -C "{dir}" describe --abbrev=0 --tags'.format(dir=test_dir)))
+
   def test_branch_not_found_exception(self):
     test_parent = os.path.join(self.base_temp_dir, 'test_bad_branch')
     os.makedirs(test_parent)
@@ -368,6 +417,57 @@ class TestGitRunner(unittest.TestCase):
     self.assertIsNone(
         self.git.query_commit_at_tag(self.git_dir, 'BogusTag'))
 
+  def test_ref_transaction_and_atomic_push(self):
+    test_dir = os.path.join(
+        self.base_temp_dir, 'test_ref_transaction', TEST_REPO_NAME)
+    repository = GitRepositorySpec(
+        TEST_REPO_NAME, git_dir=test_dir, origin=self.git_dir)
+    self.git.clone_repository_to_path(repository, branch='master')
+    commit_id = self.git.query_local_repository_commit_id(test_dir)
+
+    transaction = RefTransaction()
+    transaction.create('refs/tags/txn-tag', commit_id)
+    transaction.create('refs/heads/txn-branch', commit_id)
+    self.git.apply_ref_transaction(test_dir, transaction)
+    self.assertEqual(commit_id,
+                     self.git.query_commit_at_tag(test_dir, 'txn-tag'))
+
+    # Nothing changes if any part of the transaction fails.
+    transaction = RefTransaction()
+    transaction.create('refs/tags/txn-other', commit_id)
+    transaction.create('refs/tags/txn-tag', commit_id)
+    with self.assertRaises(Exception):
+      self.git.apply_ref_transaction(test_dir, transaction)
+    self.assertIsNone(self.git.query_commit_at_tag(test_dir, 'txn-other'))
+
+    # The clone is of an upstream repository, so has its pushes disabled.
+    check_subprocess('git -C "{dir}" remote set-url --push origin {url}'
+                     .format(dir=test_dir, url=self.git_dir))
+    options = make_default_options()
+    options.git_never_push = False
+    GitRunner(options).push_refs_to_origin(
+        test_dir, ['txn-branch', 'txn-tag'])
+    self.assertEqual(commit_id, self.run_git('rev-parse txn-branch'))
+    self.assertEqual(commit_id, self.run_git('rev-parse txn-tag'))
+    self.run_git('branch -D txn-branch')
+    self.run_git('tag -d txn-tag')
+
+    self.git.remove_all_non_version_tags(repository)
+    tags = check_subprocess('git -C "{dir}" tag'.format(dir=test_dir))
+    self.assertIn(VERSION_BASE, tags.split('\n'))
+    self.assertEqual([], [tag for tag in tags.split('\n')
+                          if not re.match(TAG_VERSION_PATTERN, tag)])
+
+  def test_query_commit_messages(self):
+    revision_range = VERSION_BASE + '..master'
+    medium = CommitMessage.make_list_from_result(
+        self.run_git('log --pretty=medium ' + revision_range))
+    self.assertEqual(2, len(medium))
+    self.assertEqual(
+        medium, self.git.query_commit_messages(self.git_dir, revision_range))
+    self.assertEqual(
+        [], self.git.query_commit_messages(self.git_dir, 'master..master'))
+
   def test_summarize(self):
     # All the tags in this fixture are where the head is tagged, so
     # these are not that interesting. This is tested again in the
@@ -385,6 +485,33 @@ class TestGitRunner(unittest.TestCase):
       self.assertEqual([], summary.commit_messages)
 
 
+  def test_summary_cache(self):
+    test_dir = os.path.join(self.base_temp_dir, 'test_summary_cache')
+    check_subprocess('git clone {source} {target}'.format(
+        source=self.git_dir, target=test_dir))
+    check_subprocess('git -C {dir} checkout -q {branch}'.format(
+        dir=test_dir, branch=BRANCH_C))
+    summary = self.git.collect_repository_summary(test_dir)
+    self.assertTrue(os.path.exists(os.path.join(
+        test_dir, '.git', RepositorySummaryCache.CACHE_BASENAME)))
+
+    with patch('buildtool.git_support.CommitMessage'
+               '.determine_semver_implication_on_list') as mock_implication:
+      self.assertEqual(summary, self.git.collect_repository_summary(test_dir))
+      reloaded = RepositorySummaryCache(self.git, test_dir)
+      self.assertEqual(
+          summary, RepositorySummary.from_dict(
+              reloaded.lookup(reloaded.make_key(summary.commit_id))))
+      self.assertEqual(0, mock_implication.call_count)
+
+      # A new version tag invalidates the cached summary.
+      check_subprocess('git -C {dir} tag version-0.9.0 HEAD'.format(
+          dir=test_dir))
+      mock_implication.return_value = SemanticVersion.PATCH_INDEX
+      self.assertEqual(
+          'version-0.9.0', self.git.collect_repository_summary(test_dir).tag)
+
+
 class TestSemanticVersion(unittest.TestCase):
   def test_semver_make_valid(self):
     tests = [('simple-1.0.0', SemanticVersion('simple', 1, 0, 0)),
@@ -532,6 +659,21 @@ class TestCommitMessage(unittest.TestCase):
         gitify('commit -a -m "fix(test): Second Fix"'),
     ])
 
+  def test_make_list_from_formatted_log(self):
+    text = '\0'.join([
+        'abc123', 'First Author <first@test.com>', 'Mon Jan 1 2018',
+        'fix(test): first\n\n  Indented detail  \n\n',
+        'def456', 'Second Author <second@test.com>', 'Tue Jan 2 2018',
+        'feat(test): second'])
+    self.assertEqual(
+        [CommitMessage('abc123', 'First Author <first@test.com>',
+                       'Mon Jan 1 2018',
+                       '    fix(test): first\n\n      Indented detail'),
+         CommitMessage('def456', 'Second Author <second@test.com>',
+                       'Tue Jan 2 2018', '    feat(test): second')],
+        CommitMessage.make_list_from_formatted_log(text))
+    self.assertEqual([], CommitMessage.make_list_from_formatted_log(''))
+
   def test_summarize(self):
     expect_messages = ['feat(testC): added major_file\n'
                        '\nInterestingly enough, this is a BREAKING CHANGE.',
@@ -0,0 +1,154 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-docstring
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+import zlib
+
+try:
+  from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+  from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from buildtool.influxdb_exporter import (
+    InfluxDbExporter,
+    gzip_bytes)
+
+from test_util import init_runtime
+
+
+class FakeInfluxDb(HTTPServer):
+  def __init__(self):
+    HTTPServer.__init__(self, ('127.0.0.1', 0), FakeInfluxDbHandler)
+    self.statuses = []  # The status to respond with, default 204
+    self.requests = []  # (path, encoding, lines)
+    self.connections = set([])
+
+  @property
+  def url(self):
+    return 'http://127.0.0.1:{0}'.format(self.server_address[1])
+
+
+class FakeInfluxDbHandler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def do_POST(self):
+    # pylint: disable=invalid-name
+    body = self.rfile.read(int(self.headers['Content-Length']))
+    encoding = self.headers['Content-Encoding']
+    text = zlib.decompress(body, 16 + zlib.MAX_WBITS).decode('utf-8')
+    self.server.connections.add(self.client_address)
+    self.server.requests.append((self.path, encoding, text.split('\n')))
+    status = self.server.statuses.pop(0) if self.server.statuses else 204
+    self.send_response(status)
+    self.send_header('Content-Length', '0')
+    self.end_headers()
+
+  def log_message(self, *pos_args):
+    pass
+
+
+class TestInfluxDbExporter(unittest.TestCase):
+  def setUp(self):
+    self.server = FakeInfluxDb()
+    self.thread = threading.Thread(target=self.server.serve_forever)
+    self.thread.daemon = True
+    self.thread.start()
+    self.spool_dir = tempfile.mkdtemp(prefix='influxdb_exporter_test')
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+    shutil.rmtree(self.spool_dir)
+
+  def make_exporter(self, **kwargs):
+    return InfluxDbExporter(self.server.url, 'TestDb', self.spool_dir,
+                            initial_backoff_secs=0.01, **kwargs)
+
+  def test_batches_over_one_connection(self):
+    exporter = self.make_exporter(batch_bytes=20)
+    lines = ['a value=1 1', 'b value=2 2', 'c value=3 3']
+    exporter.submit(lines)
+    exporter.close(5)
+    self.assertEqual(
+        [('/write?db=TestDb', 'gzip', [line]) for line in lines],
+        self.server.requests)
+    self.assertEqual(1, len(self.server.connections))
+
+  def test_retries_then_spools_and_replays(self):
+    self.server.statuses = [503, 500]
+    exporter = self.make_exporter(max_attempts=2)
+    exporter.export(['a value=1 1', 'b value=2 2'])
+    exporter.close(1)
+    self.assertEqual(2, len(self.server.requests))
+    self.assertEqual(1, len(os.listdir(self.spool_dir)))
+
+    # A later run replays the spool before sending its own metrics.
+    exporter = self.make_exporter()
+    exporter.export(['c value=3 3'])
+    exporter.close(1)
+    self.assertEqual([['a value=1 1', 'b value=2 2'], ['c value=3 3']],
+                     [request[2] for request in self.server.requests[2:]])
+    self.assertEqual([], os.listdir(self.spool_dir))
+
+  def test_rejected_batch_is_not_spooled(self):
+    self.server.statuses = [400]
+    exporter = self.make_exporter()
+    exporter.export(['bad line'])
+    exporter.close(1)
+    self.assertEqual(1, len(self.server.requests))
+    self.assertEqual([], os.listdir(self.spool_dir))
+
+  def test_recovers_batches_claimed_by_dead_process(self):
+    exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+    exited.wait()
+    claimed = {exited.pid: 'a value=1 1', os.getppid(): 'b value=2 2'}
+    for pid, line in claimed.items():
+      name = '0000000000001-{0}-000001.lp.gz.{0}'.format(pid)
+      with open(os.path.join(self.spool_dir, name), 'wb') as stream:
+        stream.write(gzip_bytes(line.encode('utf-8')))
+
+    exporter = self.make_exporter()
+    exporter.export([])
+    exporter.close(1)
+    self.assertEqual([['a value=1 1']],
+                     [request[2] for request in self.server.requests])
+    # The live process may still be sending its batch.
+    self.assertEqual(
+        ['0000000000001-{0}-000001.lp.gz.{0}'.format(os.getppid())],
+        os.listdir(self.spool_dir))
+
+  def test_unreachable_spools_without_stalling(self):
+    port = self.server.server_address[1]
+    self.server.shutdown()
+    self.server.server_close()
+    exporter = InfluxDbExporter(
+        'http://127.0.0.1:{0}'.format(port), 'TestDb', self.spool_dir,
+        batch_bytes=10, initial_backoff_secs=0.01, max_spool_files=2)
+    exporter.export(['a value=1 1', 'b value=2 2', 'c value=3 3'])
+    self.assertEqual(2, len(os.listdir(self.spool_dir)))
+    self.server = FakeInfluxDb()  # So tearDown has something to stop.
+    threading.Thread(target=self.server.serve_forever).start()
+
+
+if __name__ == '__main__':
+  init_runtime()
+  unittest.main(verbosity=2)
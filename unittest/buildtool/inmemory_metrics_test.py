@@ -0,0 +1,203 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-docstring
+
+import datetime
+import threading
+import unittest
+
+from buildtool.base_metrics import (
+    LatencyHistogram,
+    MetricFamily)
+from buildtool.inmemory_metrics import (
+    DataPoint,
+    InMemoryMetricsRegistry,
+    TimeSeries)
+
+from test_util import init_runtime
+
+
+BASE_TIME = datetime.datetime(2018, 1, 2, 3, 4, 5, 678901)
+
+
+def at_secs(secs):
+  return BASE_TIME + datetime.timedelta(seconds=secs)
+
+
+class Options(object):
+  # pylint: disable=too-few-public-methods
+  def __init__(self, capacity, thread_local=False):
+    self.monitoring_enabled = False
+    self.metrics_timeseries_capacity = capacity
+    self.monitoring_thread_local_metrics = thread_local
+
+
+class TestTimeSeries(unittest.TestCase):
+  def test_points_and_mark(self):
+    series = TimeSeries(2, capacity=8)
+    series.append(at_secs(0), 1, 0.5)
+    series.append(at_secs(1), 2, 1.25)
+    self.assertEqual(DataPoint((2, 1.25), at_secs(1)), series.last())
+    self.assertEqual(([DataPoint((1, 0.5), at_secs(0)),
+                       DataPoint((2, 1.25), at_secs(1))], (0, 0)),
+                     series.mark())
+    series.append(at_secs(2), 3, 2)
+    self.assertEqual(([DataPoint((3, 2), at_secs(2))], (2, 1.25)),
+                     series.mark())
+    self.assertEqual([{'time': at_secs(0).isoformat(), 'count': 1, 't': 0.5},
+                      {'time': at_secs(1).isoformat(), 'count': 2, 't': 1.25},
+                      {'time': at_secs(2).isoformat(), 'count': 3, 't': 2}],
+                     series.to_snapshot_values(['count', 't']))
+
+  def test_bounded_and_thinned(self):
+    series = TimeSeries(1, capacity=8)
+    for value in range(6):
+      series.append(at_secs(value), value)
+    points, _ = series.mark()
+    self.assertEqual(list(range(6)), [point.value for point in points])
+
+    for value in range(6, 100):
+      series.append(at_secs(value), value)
+      self.assertLessEqual(len(series), 8)
+
+    values = [point.value for point in series.points()]
+    self.assertEqual(sorted(values), values)
+    self.assertEqual(99, values[-1])
+
+    # The mark resumes after the last point it returned, and its value
+    # still reflects that point even though it may since have been thinned.
+    points, marked_value = series.mark()
+    self.assertEqual(5, marked_value)
+    self.assertTrue(all(point.value > 5 for point in points))
+    self.assertEqual(99, points[-1].value)
+    self.assertEqual(([], 99), series.mark())
+
+
+class TestLatencyHistogram(unittest.TestCase):
+  def test_percentiles(self):
+    histogram = LatencyHistogram()
+    self.assertIsNone(histogram.percentile(50))
+    for millis in range(1, 1001):
+      histogram.add(millis / 1000.0)
+    histogram.add(0)
+    accuracy = LatencyHistogram.RELATIVE_ACCURACY
+    for percent, expect in [(50, 0.5), (90, 0.9), (99, 0.99)]:
+      self.assertAlmostEqual(expect, histogram.percentile(percent),
+                             delta=expect * accuracy)
+    self.assertEqual(0, histogram.percentile(0))
+
+  def test_merge_and_minus(self):
+    first = LatencyHistogram()
+    second = LatencyHistogram()
+    for secs in [1, 2, 3]:
+      first.add(secs)
+    for secs in [100, 200]:
+      second.add(secs)
+    merged = LatencyHistogram(first.buckets)
+    merged.merge(second.buckets)
+    self.assertEqual(5, merged.count)
+    self.assertAlmostEqual(200, merged.percentile(100), delta=200 * 0.02)
+    self.assertEqual(second.buckets, merged.minus(first).buckets)
+
+
+class TestInMemoryMetrics(unittest.TestCase):
+  def test_counter_delta_survives_thinning(self):
+    registry = InMemoryMetricsRegistry(Options(8))
+    counter = registry.get_metric(MetricFamily.COUNTER, 'TestCounter', {})
+    for _ in range(3):
+      counter.inc()
+    self.assertEqual([1, 2, 3],
+                     [point.value for point in counter.mark_as_delta()])
+    for _ in range(50):
+      counter.inc(amount=2)
+    self.assertEqual(100, counter.mark_as_delta()[-1].value)
+    self.assertLessEqual(len(counter.timeseries), 8)
+
+  def test_snapshot(self):
+    registry = InMemoryMetricsRegistry(Options(None))
+    registry.inc_counter('TestCounter', {'a': 'A'}, amount=2)
+    registry.observe_timer('TestTimer', {}, 1.5)
+    snapshot, metric_count, point_count = registry.make_snapshot()
+    self.assertEqual((2, 2), (metric_count, point_count))
+    counter = snapshot['counters']['TestCounter']['collectors'][0]
+    self.assertEqual({'a': 'A'}, counter['labels'])
+    self.assertEqual(2, counter['values'][0]['value'])
+    timer = snapshot['timers']['TestTimer']['collectors'][0]
+    self.assertEqual(1, timer['values'][0]['count'])
+    self.assertEqual(1.5, timer['values'][0]['totalSecs'])
+    self.assertEqual(['p50', 'p90', 'p99'], sorted(timer['percentiles']))
+    self.assertAlmostEqual(1.5, timer['percentiles']['p99'], delta=0.03)
+
+  def test_timer_mark_histogram(self):
+    registry = InMemoryMetricsRegistry(Options(None))
+    timer = registry.observe_timer('TestTimer', {}, 10)
+    self.assertEqual(1, timer.mark_histogram().count)
+    timer.observe(1)
+    timer.observe_many(2, 4)
+    histogram = timer.mark_histogram()
+    self.assertEqual(3, histogram.count)
+    self.assertAlmostEqual(2, histogram.percentile(50), delta=0.04)
+
+
+class TestThreadLocalMetrics(unittest.TestCase):
+  def test_merged_at_flush(self):
+    registry = InMemoryMetricsRegistry(Options(None, thread_local=True))
+
+    def record(index):
+      for _ in range(500):
+        registry.inc_counter('TestCounter', {'parity': index % 2})
+        registry.observe_timer('TestTimer', {}, index + 1)
+
+    threads = [threading.Thread(target=record, args=[index])
+               for index in range(8)]
+    for thread in threads:
+      thread.start()
+    registry.merge_thread_local_metrics()  # While the threads are running.
+    for thread in threads:
+      thread.join()
+
+    counter = registry.inc_counter('TestCounter', {'parity': 0}, amount=0)
+    timer = registry.get_metric(MetricFamily.TIMER, 'TestTimer', {})
+    registry.flush_updated_metrics()
+    self.assertEqual(2000, counter.count)
+    self.assertEqual(4000, timer.count)
+    self.assertEqual(500 * sum(range(1, 9)), timer.total_seconds)
+    self.assertEqual(4000, timer.histogram.count)
+    self.assertAlmostEqual(8, timer.percentiles()['p99'], delta=8 * 0.02)
+
+    # Updates are not seen until they are merged.
+    registry.observe_timer('TestTimer', {}, 1)
+    self.assertEqual(4000, timer.count)
+    registry.merge_thread_local_metrics()
+    self.assertEqual(4001, timer.count)
+
+  def test_merged_without_flush(self):
+    registry = InMemoryMetricsRegistry(Options(None, thread_local=True))
+    threshold = registry.THREAD_LOCAL_MERGE_THRESHOLD
+    counter = registry.get_metric(MetricFamily.COUNTER, 'TestCounter', {})
+    for _ in range(threshold * 3):
+      registry.inc_counter('TestCounter', {})
+
+    # Nothing flushed, but the thread merged its queue whenever it filled.
+    self.assertEqual(threshold * 3, counter.count)
+    registry.inc_counter('TestCounter', {})
+    self.assertEqual(threshold * 3, counter.count)
+    registry.merge_thread_local_metrics()
+    self.assertEqual(threshold * 3 + 1, counter.count)
+
+
+if __name__ == '__main__':
+  init_runtime()
+  unittest.main(verbosity=2)
@@ -0,0 +1,95 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-docstring
+
+import argparse
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+  from urllib2 import urlopen, HTTPError
+except ImportError:
+  from urllib.request import urlopen
+  from urllib.error import HTTPError
+
+from buildtool import MetricsManager
+from buildtool.prometheus_metrics import PrometheusMetricsRegistry
+
+from test_util import init_runtime
+
+
+class TestPrometheusMetricsRegistry(unittest.TestCase):
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp(prefix='prometheus_metrics_test')
+    parser = argparse.ArgumentParser()
+    MetricsManager.init_argument_parser(parser, {})
+    self.options = parser.parse_args([
+        '--monitoring_enabled=true',
+        '--monitoring_system=prometheus',
+        '--metrics_dir=' + self.temp_dir,
+        '--prometheus_textfile=' + os.path.join(self.temp_dir, 'test.prom')])
+    self.options.command = 'test'
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def test_render_text(self):
+    self.options.prometheus_port = -1
+    registry = PrometheusMetricsRegistry(self.options)
+    registry.inc_counter('Calls', {'repository': 'deck', 'success': True},
+                         amount=2)
+    registry.set('InProgress', {}, 3)
+    timer = registry.observe_timer('Build.Time', {'note': 'say "hi"'}, 2.0)
+    percentiles = timer.percentiles()
+    self.assertEqual(
+        '\n'.join([
+            '# TYPE Build_Time_seconds summary',
+            'Build_Time_seconds{note="say \\"hi\\"",quantile="0.5"} %r' % (
+                percentiles['p50']),
+            'Build_Time_seconds{note="say \\"hi\\"",quantile="0.9"} %r' % (
+                percentiles['p90']),
+            'Build_Time_seconds{note="say \\"hi\\"",quantile="0.99"} %r' % (
+                percentiles['p99']),
+            'Build_Time_seconds_sum{note="say \\"hi\\""} 2.0',
+            'Build_Time_seconds_count{note="say \\"hi\\""} 1',
+            '# TYPE Calls_total counter',
+            'Calls_total{repository="deck",success="true"} 2',
+            '# TYPE InProgress gauge',
+            'InProgress 3',
+            '']),
+        registry.render_text())
+
+  def test_serve_and_textfile(self):
+    registry = PrometheusMetricsRegistry(self.options)
+    registry.inc_counter('Calls', {})
+    url = 'http://localhost:{0}'.format(registry.server_port)
+    response = urlopen(url + '/metrics')
+    self.assertEqual(registry.render_text(),
+                     response.read().decode('utf-8'))
+    self.assertTrue(response.info()['Content-Type'].startswith('text/plain'))
+    with self.assertRaises(HTTPError):
+      urlopen(url + '/other')
+
+    registry.flush_final_metrics()
+    self.assertIsNone(registry.server_port)
+    with open(self.options.prometheus_textfile, 'r') as stream:
+      self.assertEqual(registry.render_text(), stream.read())
+
+
+if __name__ == '__main__':
+  init_runtime()
+  unittest.main(verbosity=2)
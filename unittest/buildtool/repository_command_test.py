@@ -22,7 +22,8 @@ import unittest
 from buildtool import (
     RepositoryCommandProcessor,
     RepositoryCommandFactory,
-    BranchSourceCodeManager)
+    BranchSourceCodeManager,
+    ConfigError)
 
 import custom_test_command
 
@@ -123,6 +124,15 @@ class RepositoryCommandProcessorTest(BaseGitRepoTestFixture):
       expected_repo_names,
       [repository.name for repository in command.source_repositories])
 
+  def test_process_executor_requires_support(self):
+    factory = RepositoryCommandFactory(
+        'test_process', TestRepositoryCommand, 'A test command.',
+        BranchSourceCodeManager, 123,
+        source_repository_names=ALL_STANDARD_TEST_BOM_REPO_NAMES)
+    self.options.repository_executor = 'process'
+    with self.assertRaises(ConfigError):
+      factory.make_command(self.options)
+
   def do_test_command(self, options, command_name):
     init_dict = {'a': 'A', 'b': 'B'}
     factory = RepositoryCommandFactory(
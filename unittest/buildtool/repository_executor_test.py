@@ -0,0 +1,121 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-docstring
+
+import collections
+import threading
+import time
+import unittest
+
+from buildtool import (
+    RepositoryExecutor,
+    TimeoutError)
+
+from test_util import init_runtime
+
+
+Item = collections.namedtuple('Item', ['name', 'delay'])
+
+
+def sleep_and_return(item):
+  if item.delay < 0:
+    raise ValueError('Injected failure for ' + item.name)
+  time.sleep(item.delay)
+  return item.name.upper()
+
+
+class TestRepositoryExecutor(unittest.TestCase):
+  def test_completion_order_and_partial_failure(self):
+    executor = RepositoryExecutor(4)
+    items = [Item('slow', 0.3), Item('bad', -1), Item('fast', 0.01)]
+    outcomes = list(executor.map_unordered(sleep_and_return, items))
+    self.assertEqual(['bad', 'fast', 'slow'],
+                     [outcome.name for outcome in outcomes])
+    self.assertIsInstance(outcomes[0].error, ValueError)
+    self.assertEqual('FAST', outcomes[1].value)
+    self.assertEqual('SLOW', outcomes[2].value)
+    self.assertTrue(outcomes[2].ok)
+    executor.shutdown()
+
+  def test_timeout(self):
+    executor = RepositoryExecutor(2)
+    items = [Item('hung', 2), Item('ok', 0.01)]
+    outcomes = {outcome.name: outcome
+                for outcome in executor.map_unordered(
+                    sleep_and_return, items, timeout_secs=0.2)}
+    self.assertEqual('OK', outcomes['ok'].value)
+    self.assertIsInstance(outcomes['hung'].error, TimeoutError)
+    executor.shutdown()
+
+  def test_bounded_concurrency(self):
+    executor = RepositoryExecutor(8)
+    active = [0]
+    peak = [0]
+    lock = threading.Lock()
+
+    def track(item):
+      with lock:
+        active[0] += 1
+        peak[0] = max(peak[0], active[0])
+      time.sleep(item.delay)
+      with lock:
+        active[0] -= 1
+      return item.name
+
+    items = [Item(str(i), 0.05) for i in range(8)]
+    outcomes = list(executor.map_unordered(track, items, max_concurrency=2))
+    self.assertEqual(8, len(outcomes))
+    self.assertEqual(2, peak[0])
+    executor.shutdown()
+
+  def test_nested_calls_run_inline(self):
+    executor = RepositoryExecutor(1)
+
+    def nested(item):
+      inner = list(executor.map_unordered(
+          sleep_and_return, [Item(item.name + '-a', 0), Item('b', 0)]))
+      return [outcome.value for outcome in inner]
+
+    outcomes = list(executor.map_unordered(
+        nested, [Item('x', 0), Item('y', 0)]))
+    self.assertEqual(sorted([['X-A', 'B'], ['Y-A', 'B']]),
+                     sorted([outcome.value for outcome in outcomes]))
+    executor.shutdown()
+
+  def test_resource_slot(self):
+    RepositoryExecutor.set_resource_limit('test_resource', 1)
+    acquired = []
+
+    def hold():
+      with RepositoryExecutor.resource_slot('test_resource'):
+        acquired.append(time.time())
+        time.sleep(0.1)
+
+    threads = [threading.Thread(target=hold) for _ in range(2)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertGreaterEqual(abs(acquired[1] - acquired[0]), 0.09)
+
+    RepositoryExecutor.set_resource_limit('test_resource', None)
+    with RepositoryExecutor.resource_slot('test_resource'):
+      with RepositoryExecutor.resource_slot('test_resource'):
+        pass
+
+
+if __name__ == '__main__':
+  init_runtime()
+  unittest.main(verbosity=2)
@@ -0,0 +1,171 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=missing-docstring
+
+import collections
+import logging
+import os
+import threading
+import time
+import unittest
+
+from buildtool import (
+    MetricsManager,
+    RepositoryExecutor,
+    TimeoutError,
+    UnexpectedError)
+
+from buildtool import repository_processes
+from buildtool.base_metrics import MetricFamily
+from buildtool.repository_processes import ProcessRepositoryExecutor
+
+from test_util import init_runtime
+
+
+Item = collections.namedtuple('Item', ['name', 'delay'])
+
+
+def sleep_and_return(item):
+  metrics = MetricsManager.singleton()
+  metrics.inc_counter('ProcessTestCalls', {'item': item.name})
+  metrics.observe_timer('ProcessTestTime', {}, 2)
+  logging.info('Processing %s', item.name)
+  if item.delay < 0:
+    raise ValueError('Injected failure for ' + item.name)
+  time.sleep(item.delay)
+  return (item.name.upper(), os.getpid())
+
+
+class CapturingHandler(logging.Handler):
+  def __init__(self):
+    super(CapturingHandler, self).__init__()
+    self.messages = []
+
+  def emit(self, record):
+    self.messages.append(record.getMessage())
+
+
+class TestProcessRepositoryExecutor(unittest.TestCase):
+  def test_outcomes_metrics_and_logs(self):
+    handler = CapturingHandler()
+    logging.getLogger().addHandler(handler)
+    metrics = MetricsManager.singleton()
+    timer = metrics.get_metric(MetricFamily.TIMER, 'ProcessTestTime', {})
+    timer_count = timer.count
+    try:
+      items = [Item('slow', 0.3), Item('bad', -1), Item('fast', 0.01)]
+      outcomes = list(ProcessRepositoryExecutor(4).map_unordered(
+          sleep_and_return, items))
+    finally:
+      logging.getLogger().removeHandler(handler)
+
+    self.assertEqual(['bad', 'fast', 'slow'],
+                     [outcome.name for outcome in outcomes])
+    self.assertIsInstance(outcomes[0].error, ValueError)
+    self.assertEqual('FAST', outcomes[1].value[0])
+    self.assertNotEqual(os.getpid(), outcomes[1].value[1])
+
+    for item in items:
+      counter = metrics.get_metric(
+          MetricFamily.COUNTER, 'ProcessTestCalls', {'item': item.name})
+      self.assertEqual(1, counter.count)
+      self.assertIn('Processing ' + item.name, handler.messages)
+    self.assertEqual(timer_count + 3, timer.count)
+    self.assertAlmostEqual(2, timer.percentiles()['p50'], delta=0.04)
+
+  def test_timeout(self):
+    items = [Item('hung', 5), Item('ok', 0.01)]
+    start_time = time.time()
+    outcomes = {outcome.name: outcome
+                for outcome in ProcessRepositoryExecutor(2).map_unordered(
+                    sleep_and_return, items, timeout_secs=0.5)}
+    self.assertEqual('OK', outcomes['ok'].value[0])
+    self.assertIsInstance(outcomes['hung'].error, TimeoutError)
+    self.assertLess(time.time() - start_time, 4)
+
+  def test_unpicklable_result(self):
+    items = [Item('a', 0), Item('b', 0)]
+    outcomes = list(ProcessRepositoryExecutor(2).map_unordered(
+        lambda item: threading.Lock(), items))
+    for outcome in outcomes:
+      self.assertIsInstance(outcome.error, UnexpectedError)
+
+  def test_worker_failure_outside_item(self):
+    def log_unpicklable(item):
+      logging.info('Processing %s', item.name,
+                   extra={'unpicklable': threading.Lock()})
+      return item.name
+
+    items = [Item('a', 0), Item('b', 0)]
+    outcomes = list(ProcessRepositoryExecutor(2).map_unordered(
+        log_unpicklable, items, timeout_secs=20))
+    self.assertEqual(['a', 'b'], sorted(outcome.name for outcome in outcomes))
+    for outcome in outcomes:
+      self.assertIsInstance(outcome.error, UnexpectedError)
+
+  def test_metric_locks_held_by_another_thread(self):
+    metrics = MetricsManager.singleton()
+    counter = metrics.get_metric(
+        MetricFamily.COUNTER, 'ProcessTestCalls', {'item': 'locked'})
+    initial_count = counter.count
+    locked = threading.Event()
+    release = threading.Event()
+
+    def hold_metric_lock():
+      with counter.mutex:
+        locked.set()
+        release.wait(10)
+
+    holder = threading.Thread(target=hold_metric_lock)
+    holder.start()
+    locked.wait(10)
+    try:
+      items = [Item('locked', 0), Item('locked', 0)]
+      outcomes = list(ProcessRepositoryExecutor(2).map_unordered(
+          sleep_and_return, items, name_func=lambda item: item.delay,
+          timeout_secs=10))
+    finally:
+      release.set()
+      holder.join()
+
+    self.assertEqual([None, None], [outcome.error for outcome in outcomes])
+    self.assertEqual(initial_count + 2, counter.count)
+
+  def test_uses_threads_if_executor_is_busy(self):
+    release = threading.Event()
+    busy = threading.Thread(target=lambda: list(
+        RepositoryExecutor.singleton().map_unordered(
+            lambda item: release.wait(10), ['busy', 'also_busy'],
+            name_func=lambda item: item)))
+    busy.start()
+    saved_timeout = repository_processes._EXECUTOR_SHUTDOWN_TIMEOUT_SECS
+    repository_processes._EXECUTOR_SHUTDOWN_TIMEOUT_SECS = 0.2
+    try:
+      time.sleep(0.1)
+      items = [Item('a', 0), Item('b', 0)]
+      outcomes = list(ProcessRepositoryExecutor(2).map_unordered(
+          sleep_and_return, items))
+    finally:
+      repository_processes._EXECUTOR_SHUTDOWN_TIMEOUT_SECS = saved_timeout
+      release.set()
+      busy.join()
+
+    self.assertEqual([os.getpid(), os.getpid()],
+                     [outcome.value[1] for outcome in outcomes])
+
+
+if __name__ == '__main__':
+  init_runtime()
+  unittest.main(verbosity=2)
@@ -18,14 +18,19 @@ import io
 import logging
 import os
 import shutil
+import subprocess
 import tempfile
+import threading
+import time
 import unittest
 
+import buildtool.subprocess_support
 from buildtool import (
     check_subprocess,
     check_subprocesses_to_logfile,
     run_subprocess,
-    ExecutionError)
+    ExecutionError,
+    TimeoutError)
 
 from test_util import init_runtime
 
@@ -126,6 +131,42 @@ class TestRunner(unittest.TestCase):
     expect = "/bin/ls: cannot access '/abc/def': No such file or directory"
     self.assertEqual(expect, body)
 
+  def test_run_subprocess_drains_stderr_concurrently(self):
+    # Fill the stderr pipe well past its capacity before writing stdout.
+    # This would deadlock if stdout were read to EOF before stderr.
+    cmd = ('/bin/sh -c "head -c 200000 /dev/zero | tr \'\\\\0\' x >&2;'
+           ' echo done"')
+    code, output = run_subprocess(cmd, stderr=subprocess.PIPE)
+    self.assertEqual(0, code)
+    self.assertEqual('done', output)
+
+  def test_run_subprocess_timeout(self):
+    start = time.time()
+    with self.assertRaises(TimeoutError):
+      run_subprocess('/bin/sleep 30', timeout_secs=1)
+    self.assertLess(time.time() - start, 10)
+
+  def test_run_subprocess_cancel(self):
+    cancel_event = threading.Event()
+    timer = threading.Timer(0.5, cancel_event.set)
+    timer.start()
+    with self.assertRaises(ExecutionError):
+      run_subprocess('/bin/sleep 30', cancel_event=cancel_event)
+
+  def test_streamed_output_keeps_tail(self):
+    path = os.path.join(self.base_temp_dir, 'tail.log')
+    old_limit = buildtool.subprocess_support.STREAMED_OUTPUT_TAIL_CHARS
+    buildtool.subprocess_support.STREAMED_OUTPUT_TAIL_CHARS = 100
+    try:
+      with io.open(path, 'w', encoding='utf-8') as stream:
+        output = check_subprocess('/usr/bin/seq 1 10000', stream=stream)
+    finally:
+      buildtool.subprocess_support.STREAMED_OUTPUT_TAIL_CHARS = old_limit
+    self.assertLessEqual(len(output), 100)
+    self.assertTrue(output.endswith('9999\n10000'))
+    with io.open(path, 'r', encoding='utf-8') as stream:
+      self.assertEqual(1, stream.read().count('\n1\n'))
+
   def test_run_subprocess_get_pid(self):
     # See if we can run a job by looking up our job
     # This is also testing parsing command lines.